@@ -0,0 +1,194 @@
+import json
+import math
+import uuid
+from datetime import datetime
+
+import catalog
+
+ANNOTATION_TYPES = ("highlight", "underline", "strikeout", "note", "ink")
+# Largest number of changes accepted in one batch
+MAX_BATCH_SIZE = 5000
+
+# One row per annotation, keyed for per-page reads.  ``document`` is the
+# blob store file id of the PDF, which survives overwrites of the file.
+# annotation_documents carries a per-document version that changes with
+# every applied batch.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS annotations (
+        id TEXT PRIMARY KEY,
+        document TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        type TEXT NOT NULL DEFAULT 'highlight',
+        rects TEXT NOT NULL DEFAULT '[]',
+        color TEXT,
+        text TEXT NOT NULL DEFAULT '',
+        author TEXT,
+        version INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_annotations_document_page ON annotations (document, page);
+
+    CREATE TABLE IF NOT EXISTS annotation_documents (
+        document TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL
+    );
+"""
+
+
+class AnnotationError(Exception):
+    """Raised for invalid or conflicting changes; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def init_annotations():
+    """Create the annotation tables"""
+    catalog.get_connection().executescript(SCHEMA)
+
+
+def annotation_from_row(row):
+    """Public form of an annotation row"""
+    return {
+        "id": row["id"],
+        "document": row["document"],
+        "page": row["page"],
+        "type": row["type"],
+        "rects": json.loads(row["rects"]),
+        "color": row["color"],
+        "text": row["text"],
+        "author": row["author"],
+        "version": row["version"],
+        "createdAt": row["created_at"],
+        "updatedAt": row["updated_at"]
+    }
+
+
+def validate(entry):
+    """Check one client supplied annotation and return it normalised"""
+    if not isinstance(entry, dict):
+        raise AnnotationError("Each annotation must be an object")
+    page = entry.get("page")
+    if not isinstance(page, int) or isinstance(page, bool) or page < 1:
+        raise AnnotationError(f"Invalid page for annotation {entry.get('id')!r}")
+    annotation_type = entry.get("type", "highlight")
+    if annotation_type not in ANNOTATION_TYPES:
+        raise AnnotationError(f"Unknown annotation type {annotation_type!r}")
+    rects = entry.get("rects", [])
+    if not isinstance(rects, list) or not all(
+        isinstance(rect, list) and len(rect) == 4 and all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in rect
+        )
+        for rect in rects
+    ):
+        raise AnnotationError("rects must be a list of [x0, y0, x1, y1] boxes in PDF points")
+    for field in ("id", "color", "text", "author"):
+        if entry.get(field) is not None and not isinstance(entry[field], str):
+            raise AnnotationError(f"{field} must be a string")
+    expected_version = entry.get("version")
+    if expected_version is not None and (not isinstance(expected_version, int) or isinstance(expected_version, bool)):
+        raise AnnotationError("version must be an integer")
+    return {
+        "id": entry.get("id") or uuid.uuid4().hex,
+        "page": page,
+        "type": annotation_type,
+        "rects": json.dumps(rects),
+        "color": entry.get("color"),
+        "text": entry.get("text") or "",
+        "author": entry.get("author"),
+        "expected_version": expected_version
+    }
+
+
+def document_version(document):
+    """Version of a document's annotation set (0 before the first change)"""
+    row = catalog.get_connection().execute(
+        "SELECT version FROM annotation_documents WHERE document = ?", (document,)
+    ).fetchone()
+    return row["version"] if row else 0
+
+
+def list_annotations(document, pages=None):
+    """Return a document's annotations, optionally only those on ``pages``, in page order"""
+    sql = "SELECT * FROM annotations WHERE document = ?"
+    params = [document]
+    if pages:
+        sql += f" AND page IN ({', '.join('?' * len(pages))})"
+        params.extend(pages)
+    sql += " ORDER BY page, created_at, id"
+    return [annotation_from_row(row) for row in catalog.get_connection().execute(sql, params)]
+
+
+def apply_batch(document, upserts=(), deletes=()):
+    """Apply an editing session's creates, updates and deletes in one transaction
+
+    An upsert replaces the whole stored annotation.  One that carries
+    ``version`` only applies if the stored row still
+    has that version; any conflict rejects the whole batch with 409.
+    Deleting an id that does not exist is not an error.  Returns the new
+    document version and the id and version of every upserted annotation.
+    """
+    if len(upserts) + len(deletes) > MAX_BATCH_SIZE:
+        raise AnnotationError(f"A batch may contain at most {MAX_BATCH_SIZE} changes", 413)
+    if not all(isinstance(annotation_id, str) for annotation_id in deletes):
+        raise AnnotationError("delete must be a list of annotation ids")
+    entries = [validate(entry) for entry in upserts]
+    if len({entry["id"] for entry in entries}) != len(entries):
+        raise AnnotationError("An annotation id appears more than once in the batch")
+    now = datetime.now().isoformat()
+
+    conflicts = []
+    results = []
+    with catalog.transaction() as conn:
+        for entry in entries:
+            current = conn.execute(
+                "SELECT document, version FROM annotations WHERE id = ?", (entry["id"],)
+            ).fetchone()
+            if current is not None and current["document"] != document:
+                conflicts.append({"id": entry["id"], "reason": "belongs to another document"})
+                continue
+            if entry["expected_version"] is not None and (current["version"] if current else 0) != entry["expected_version"]:
+                conflicts.append({"id": entry["id"], "reason": "version mismatch",
+                                  "version": current["version"] if current else None})
+                continue
+            results.append({"id": entry["id"], "version": current["version"] + 1 if current else 1})
+        for annotation_id in deletes:
+            current = conn.execute("SELECT document FROM annotations WHERE id = ?", (annotation_id,)).fetchone()
+            if current is not None and current["document"] != document:
+                conflicts.append({"id": annotation_id, "reason": "belongs to another document"})
+        if conflicts:
+            # Raising rolls the whole batch back
+            raise AnnotationError("Conflicting changes; nothing was applied", 409, conflicts=conflicts)
+
+        conn.executemany(
+            "INSERT INTO annotations (id, document, page, type, rects, color, text, author, version, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET page = excluded.page, type = excluded.type, rects = excluded.rects, "
+            "color = excluded.color, text = excluded.text, author = excluded.author, "
+            "version = annotations.version + 1, updated_at = excluded.updated_at",
+            [(entry["id"], document, entry["page"], entry["type"], entry["rects"], entry["color"], entry["text"],
+              entry["author"], now, now) for entry in entries]
+        )
+        conn.executemany(
+            "DELETE FROM annotations WHERE id = ? AND document = ?", [(annotation_id, document) for annotation_id in deletes]
+        )
+        conn.execute(
+            "INSERT INTO annotation_documents (document, version, updated_at) VALUES (?, 1, ?) "
+            "ON CONFLICT (document) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at",
+            (document, now)
+        )
+        version = conn.execute(
+            "SELECT version FROM annotation_documents WHERE document = ?", (document,)
+        ).fetchone()["version"]
+    return {"document": document, "version": version, "upserted": results, "deleted": list(deletes)}
+
+
+def remove_documents(documents):
+    """Drop every annotation of the given documents, e.g. after their PDFs were deleted"""
+    with catalog.transaction() as conn:
+        conn.executemany("DELETE FROM annotations WHERE document = ?", [(document,) for document in documents])
+        conn.executemany("DELETE FROM annotation_documents WHERE document = ?", [(document,) for document in documents])
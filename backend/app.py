@@ -1,90 +1,316 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import os
+import json
 import time
+import mimetypes
 import shutil
 import subprocess
+import threading
 import uuid
-import json
+from contextlib import contextmanager
 from datetime import datetime
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
+import annotations
+import batch_ops
+import blob_store
+import catalog
+import changes
+import chunked_upload
+import compression
+import export_zip
+import folder_stats
+import highlight_pdf
+import jobs
+import listing
+import metrics
+import object_store
+import pdf_optimize
+import pdf_versions
+import search_index
+import snip_images
+import snip_watcher
+import thumbnails
+import tiering
+import trash
+
 app = Flask(__name__)
-CORS(app)
+# pdf.js needs to read the range and validator headers on cross-origin responses, and
+# list clients the change feed position of their snapshot
+CORS(app, expose_headers=["Accept-Ranges", "Content-Range", "Content-Length", "ETag", "Last-Modified", "X-Request-ID",
+                                  "X-Change-Seq"])
 
 UPLOAD_FOLDER = os.path.abspath("uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
-
-# File to store folder metadata persistently
-METADATA_FILE = "folders_metadata.json"
-
-def load_folders_metadata():
-    """Load folder metadata from JSON file"""
-    if os.path.exists(METADATA_FILE):
-        try:
-            with open(METADATA_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
-    return {}
-
-def save_folders_metadata(metadata):
-    """Save folder metadata to JSON file"""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
-
-# Load existing metadata on startup
-folders_metadata = load_folders_metadata()
-
-# ✅ Function to find latest snip in multiple locations
-def find_latest_snip():
-    possible_folders = [
-        os.path.join(os.path.expanduser("~"), "Pictures", "Screenshots"),
-        os.path.join(os.path.expanduser("~"), "OneDrive", "Pictures", "Screenshots"),
-        os.path.join(os.path.expanduser("~"), "Pictures")
-    ]
-
-    latest_screenshot = None
-    latest_time = 0
-
-    for folder in possible_folders:
-        if os.path.exists(folder):
-            files = [f for f in os.listdir(folder) if f.endswith((".png", ".jpg"))]
-            for file in files:
-                file_path = os.path.join(folder, file)
-                file_time = os.path.getctime(file_path)
-                if file_time > latest_time:
-                    latest_screenshot = file_path
-                    latest_time = file_time
-
-    return latest_screenshot
-
-# ✅ Get all folders
+# Behind Apache or lighttpd, let the proxy send files itself with X-Sendfile
+app.config["USE_X_SENDFILE"] = os.environ.get("BACKEND_X_SENDFILE", "") == "1"
+# Per-route latency, byte counts and JSON access logs with request ids
+metrics.instrument(app)
+# Registered after metrics so byte counts are of the compressed bodies
+compression.init_app(app)
+
+# Sort keys and fields accepted by the list endpoints
+FOLDER_SORTS = {"name": "name", "date": "upload_date", "size": "total_bytes"}
+FOLDER_FIELDS = ("id", "name", "path", "fileCount", "pdfCount", "totalBytes", "optimizedBytesSaved", "lastModified",
+                 "uploadDate")
+PDF_SORTS = {"name": "path", "date": "created_at", "size": "size"}
+PDF_FIELDS = ("id", "filename", "url", "sha256", "thumbnailUrl", "size", "modified")
+SNIP_SORTS = {"name": "title", "date": "created_at"}
+SNIP_FIELDS = catalog.SNIP_FIELDS + ("width", "height", "size", "renditions", "image_status",
+                                     "thumbnailUrl", "displayUrl")
+HIGHLIGHTED_PDF_SORTS = {"name": "filename", "date": "created_at"}
+
+# Longest a snip or background job status request may wait for completion
+SNIP_LONG_POLL_MAX = 30
+JOB_LONG_POLL_MAX = 30
+CHANGES_LONG_POLL_MAX = 30
+# Change event streams are closed after this many seconds; EventSource reconnects
+# with Last-Event-ID, so a stream never holds a worker thread for long
+CHANGE_STREAM_MAX = int(os.environ.get("CHANGE_STREAM_MAX", "60"))
+CHANGE_STREAM_KEEPALIVE = 15
+# Every long-poll and event stream parks a worker thread while it waits, so only
+# this many may wait at once (a quarter of the serve.py pool by default); the
+# rest are answered at once and the pool stays free for ordinary requests
+WAIT_SLOTS = int(os.environ.get("BACKEND_WAIT_SLOTS", max(1, int(os.environ.get("BACKEND_THREADS", "16")) // 4)))
+# Reconnect delay suggested to event streams that found no free wait slot
+BUSY_STREAM_RETRY_MS = 5000
+_wait_slots = threading.BoundedSemaphore(WAIT_SLOTS)
+# Most changes returned by one /changes request
+MAX_CHANGES_PER_REQUEST = 1000
+
+# Most pages a single annotation fetch may ask for
+MAX_PAGES_PER_REQUEST = 500
+
+# Cache lifetime for URLs pinned to a content hash with ?v=<sha256>
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Folder, snip and highlighted PDF metadata live in the SQLite catalog
+catalog.init_catalog()
+# Uploaded bytes are stored once by SHA-256; folder files are links into the store
+blob_store.init_blob_store(UPLOAD_FOLDER)
+chunked_upload.init_chunked_uploads(UPLOAD_FOLDER)
+thumbnails.init_thumbnails(UPLOAD_FOLDER)
+search_index.init_search_index()
+annotations.init_annotations()
+pdf_versions.init_pdf_versions()
+pdf_optimize.init_pdf_optimize()
+highlight_pdf.init_highlight_pdf()
+# Every folder, file, snip and highlight write is logged with a sequence number
+changes.init_changes()
+# Slow work (folder imports, deletions, exports, PDF optimization, archiving) runs from a durable queue
+jobs.init_jobs(UPLOAD_FOLDER)
+# Folders idle for a long time are packed into cold archives and read back on demand
+tiering.init_tiering(UPLOAD_FOLDER)
+# Local disk or an S3-compatible bucket, with presigned URLs for direct transfers
+object_store.init_object_store(UPLOAD_FOLDER)
+# Deletes go to a trash with an undo window; a throttled reaper purges them afterwards
+trash.init_trash(UPLOAD_FOLDER)
+
+def existing_file_size(file_path):
+    """Return the size of a file that is about to be written, or None if it is new"""
+    return os.path.getsize(file_path) if os.path.isfile(file_path) else None
+
+def on_file_stored(file_path, stored):
+    """Refresh derived artifacts after ``blob_store.put`` wrote a file"""
+    if file_path.lower().endswith(".pdf"):
+        # A re-upload of a versioned PDF becomes its newest version instead of being
+        # rewritten back to the old head on the next read
+        pdf_versions.record_overwrite(stored["id"])
+    previous_hash = stored.get("previousHash")
+    if previous_hash and previous_hash != stored["hash"] and not blob_store.is_referenced(previous_hash):
+        # The overwritten version is gone: drop its thumbnails and bytes
+        thumbnails.invalidate(previous_hash)
+        blob_store.collect_garbage()
+    # A remote storage backend gets a copy to serve presigned downloads from
+    object_store.mirror_later(stored["hash"])
+    if file_path.lower().endswith(".pdf"):
+        thumbnails.prerender(stored["hash"], blob_store.blob_path(stored["hash"]))
+        key = blob_store.ref_key(file_path)
+        search_index.queue_pdf(stored["id"], stored["hash"], blob_store.blob_path(stored["hash"]),
+                               key.split("/", 1)[0] if "/" in key else "", key)
+        if pdf_optimize.wanted(file_path, stored):
+            jobs.enqueue("pdf.optimize", {"document": stored["id"], "hash": stored["hash"]},
+                         jobs.PRIORITY_LOW, max_attempts=1)
+
+def materialize_pdf(file_id, file_path=None):
+    """Bring a PDF's file up to its latest saved version before it is read"""
+    if file_path is None:
+        ref = blob_store.lookup_id(file_id)
+        if ref is None:
+            return
+        file_path = os.path.join(UPLOAD_FOLDER, ref["path"])
+    old_size = existing_file_size(file_path)
+    stored = pdf_versions.materialize(file_id, file_path)
+    if stored is not None:
+        on_file_stored(file_path, stored)
+        key = blob_store.ref_key(file_path)
+        record_file_change(key.split("/", 1)[0] if "/" in key else "", file_path, old_size)
+
+def on_snip_optimized(file_path, stored, old_size):
+    """Account for a snip file replaced by its losslessly optimized encoding"""
+    on_file_stored(file_path, stored)
+    key = blob_store.ref_key(file_path)
+    record_file_change(key.split("/", 1)[0] if "/" in key else "", file_path, old_size)
+
+# Snips are transcoded into display renditions and thumbnails by a worker pool
+snip_images.init_snip_images(on_snip_optimized)
+
+def snip_item(row):
+    """Public form of a snip row with its image URLs"""
+    snip = catalog.snip_from_row(row)
+    renditions = snip.get("renditions") or {}
+    base = f"http://127.0.0.1:5000/snips/{snip['id']}/image"
+    snip["thumbnailUrl"] = f"{base}/thumb?v={renditions['thumb']['hash']}" if "thumb" in renditions else snip["url"]
+    snip["displayUrl"] = f"{base}/display?v={renditions['display']['hash']}" if "display" in renditions else snip["url"]
+    return snip
+
+# Files copied into uploads/ by hand are adopted into the blob store in the background
+folder_stats.start_reconciler(UPLOAD_FOLDER, on_adopted=on_file_stored)
+
+def set_cache_headers(response, content_hash):
+    """Immutable caching for URLs pinned with ?v=<content hash>, revalidation otherwise"""
+    if content_hash and request.args.get("v") == content_hash:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Mutable URL: always revalidate, which costs a 304 when unchanged
+        response.cache_control.no_cache = True
+    return response
+
+def send_stored_file(file_path, stored, **kwargs):
+    """``send_file`` for a stored file, from its precompressed variant when the client accepts one
+
+    Range requests always get the identity bytes so offsets mean the same
+    thing for every client.  Files of archived folders are sent from their
+    rehydrated blob.
+    """
+    source = file_path
+    if stored and not os.path.isfile(file_path):
+        source = blob_store.readable_path(stored["hash"])
+        kwargs.setdefault("mimetype", mimetypes.guess_type(file_path)[0] or "application/octet-stream")
+        kwargs.setdefault("download_name", os.path.basename(file_path))
+    if stored and compression.is_text_name(file_path):
+        variant, encoding = (None, None) if "Range" in request.headers else compression.variant(
+            blob_store.blob_path(stored["hash"]), request.headers.get("Accept-Encoding"))
+        if variant:
+            kwargs.setdefault("mimetype", mimetypes.guess_type(file_path)[0] or "application/octet-stream")
+            kwargs.setdefault("download_name", os.path.basename(file_path))
+            response = send_file(variant, conditional=True, etag=f"{stored['hash']}-{encoding}", **kwargs)
+            response.headers["Content-Encoding"] = encoding
+        else:
+            response = send_file(source, conditional=True, etag=stored["hash"], **kwargs)
+        response.vary.add("Accept-Encoding")
+        return response
+    return send_file(source, conditional=True, etag=stored["hash"] if stored else True, **kwargs)
+
+def record_file_change(folder, file_path, old_size):
+    """Update the owning folder's stored aggregates after a file write or removal"""
+    new_size = os.path.getsize(file_path) if os.path.isfile(file_path) else None
+    catalog.record_file_change(folder, os.path.basename(file_path), old_size, new_size,
+                               datetime.now().isoformat())
+
+def batch_response(apply):
+    """Run a batch of item operations from the request body and answer with a result per item"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "No data provided"}), 400
+    try:
+        batch = apply(data.get("operations"))
+    except batch_ops.BatchError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        print(f"❌ Error applying batch: {str(e)}")
+        return jsonify({"error": f"Failed to apply batch: {str(e)}"}), 500
+    return jsonify(batch), 200
+
+def list_response(table, spec, to_item, where=(), columns="*"):
+    """Stream a catalog listing as JSON: a page object when paginating, the legacy array otherwise"""
+    position = changes.head()
+    rows = catalog.iter_rows(table, spec["sort_column"], spec["descending"], where, spec["after"],
+                             spec["limit"] + 1 if spec["paginated"] else None, columns)
+    records = ((row[spec["sort_column"]], row["id"], to_item(row)) for row in rows)
+    response = Response(stream_with_context(listing.stream_json(records, spec)), mimetype="application/json")
+    # Read before the rows, so following the feed from here may repeat a change but never miss one
+    response.headers["X-Change-Seq"] = str(position)
+    return response
+
+def selected_columns(spec):
+    """Read only the requested columns (plus the keyset) when the public fields are column names"""
+    if not spec["fields"]:
+        return "*"
+    return ", ".join(dict.fromkeys(spec["fields"] + [spec["sort_column"], "id"]))
+
+# ✅ Prometheus metrics
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def folder_item(row):
+    """Public form of a folder row; file aggregates are kept up to date on every write, so no disk walk"""
+    metadata = catalog.folder_from_row(row)
+    metadata["path"] = os.path.join(app.config["UPLOAD_FOLDER"], metadata["name"])
+    metadata["optimizedBytesSaved"] = pdf_optimize.folder_savings(metadata["name"])
+    return metadata
+
+def pdf_item(row, base=""):
+    """Public form of a stored file, named relative to the listed folder ``base``"""
+    # Content hashes let clients cache each version of a PDF forever; a
+    # delta-saved PDF reports its latest version even before it is materialized
+    head = pdf_versions.head(row["id"])
+    content_hash = head["hash"] if head else row["hash"]
+    url = f"http://127.0.0.1:5000/uploads/{row['path']}"
+    return {
+        "id": row["id"],
+        "filename": row["path"][len(base):],
+        "url": f"{url}?v={content_hash}",
+        "sha256": content_hash,
+        "thumbnailUrl": f"http://127.0.0.1:5000/pdfs/{row['id']}/pages/1/thumb?v={content_hash}",
+        "size": head["size"] if head else row["size"],
+        "modified": row["created_at"]
+    }
+
+def change_item(entity, row):
+    """Public form of a changed row, as the matching list endpoint returns it"""
+    if entity == "folder":
+        return folder_item(row)
+    if entity == "file":
+        # Named relative to the top-level folder, like /get-pdfs?folder=<folder>
+        return pdf_item(row, f"{row['folder']}/" if row["folder"] else "")
+    if entity == "snip":
+        return snip_item(row)
+    item = catalog.highlighted_pdf_from_row(row)
+    item.pop("highlighted_content", None)
+    return item
+
+def change_entry(change):
+    entry = {key: change[key] for key in ("seq", "entity", "id", "op", "folder")}
+    if change["row"] is not None:
+        entry["item"] = change_item(change["entity"], change["row"])
+    return entry
+
+# ✅ Get all folders (?limit=&cursor=&sort=name|date|size&order=&prefix=&fields=)
 @app.route("/get-folders", methods=["GET"])
 def get_folders():
-    folders = []
-    for folder_id, metadata in folders_metadata.items():
-        folder_path = os.path.join(app.config["UPLOAD_FOLDER"], metadata["name"])
-        file_count = 0
-        if os.path.exists(folder_path):
-            # Count all files recursively in the folder
-            for root, dirs, files in os.walk(folder_path):
-                file_count += len(files)
-        
-        folders.append({
-            "id": folder_id,
-            "name": metadata["name"],
-            "path": folder_path,
-            "fileCount": file_count,
-            "uploadDate": metadata["uploadDate"]
-        })
-    
-    return jsonify(folders), 200
+    try:
+        spec = listing.parse_args(request.args, FOLDER_SORTS, "date", FOLDER_FIELDS)
+    except listing.ListingError as e:
+        return jsonify({"error": str(e)}), 400
+    where = [catalog.prefix_filter("name", spec["prefix"])] if spec["prefix"] else []
+    return list_response("folders", spec, folder_item, where)
 
 # ✅ Upload folder
 @app.route("/upload-folder", methods=["POST"])
 def upload_folder():
+    # Large folders are sent through /chunked-uploads and committed here by id
+    upload_id = request.form.get("uploadId", "").strip()
+    if upload_id:
+        return finalize_chunked_upload(upload_id)
+
     if "files" not in request.files:
         return jsonify({"error": "No files provided"}), 400
 
@@ -98,71 +324,187 @@ def upload_folder():
         return jsonify({"error": "No files selected"}), 400
 
     try:
-        # Create folder path
-        folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-
-        # Save all files
-        for file in files:
+        # Stage the received files for a background import and answer right away
+        job_id = jobs.new_job_id()
+        os.makedirs(jobs.job_directory(job_id))
+        staged_files = []
+        for index, file in enumerate(files):
             if file.filename:
-                # Preserve folder structure within the uploaded folder
-                relative_path = file.filename
-                file_path = os.path.join(folder_path, relative_path)
-                
-                # Create subdirectories if needed
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                
-                file.save(file_path)
-
-        # Store folder metadata
+                file.save(os.path.join(jobs.job_directory(job_id), str(index)))
+                staged_files.append({"path": file.filename, "staged": str(index)})
+
+        # The folder is listed at once; its files and counts appear as the import runs
         folder_id = str(uuid.uuid4())
-        folders_metadata[folder_id] = {
-            "name": folder_name,
-            "uploadDate": datetime.now().isoformat(),
-            "path": folder_path
-        }
-        
-        # Save metadata to file
-        save_folders_metadata(folders_metadata)
+        folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder_name)
+        os.makedirs(folder_path, exist_ok=True)
+        catalog.add_folder(folder_id, folder_name, folder_path, datetime.now().isoformat())
+        job = jobs.enqueue("folder.import", {"folderId": folder_id, "folderName": folder_name, "files": staged_files},
+                           jobs.PRIORITY_HIGH, job_id=job_id)
 
         return jsonify({
-            "message": "Folder uploaded successfully",
+            "message": "Folder upload accepted",
             "folderId": folder_id,
             "folderName": folder_name,
-            "fileCount": len(files)
-        }), 200
+            "fileCount": len(staged_files),
+            "jobId": job["id"],
+            "statusUrl": f"http://127.0.0.1:5000/jobs/{job['id']}"
+        }), 202
 
     except Exception as e:
         return jsonify({"error": f"Failed to upload folder: {str(e)}"}), 500
 
+def import_folder_job(job):
+    """Move a folder upload's staged files into the blob store and count them"""
+    folder_id = job.payload["folderId"]
+    imported = 0
+    for index, entry in enumerate(job.payload["files"]):
+        job.check_cancelled()
+        folder = catalog.get_folder(folder_id)
+        if folder is None:
+            return {"folderId": folder_id, "skipped": "Folder was deleted"}
+        # Follow renames made while the import runs
+        folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder["name"])
+        file_path = os.path.join(folder_path, entry["path"])
+        staged = os.path.join(job.directory, entry["staged"])
+        if os.path.exists(staged):
+            # Preserve folder structure within the uploaded folder
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            old_size = existing_file_size(file_path)
+            on_file_stored(file_path, blob_store.put(staged, file_path))
+            # Applied per file, so edits made to the folder meanwhile are kept
+            record_file_change(folder["name"], file_path, old_size)
+        elif not os.path.isfile(file_path):
+            continue
+        # Files placed by an earlier attempt were counted then
+        imported += 1
+        job.progress(index + 1, len(job.payload["files"]))
+    return {"folderId": folder_id, "fileCount": imported}
+
+def abandon_folder_import(job):
+    """Move a folder whose import was cancelled or failed to the trash instead of leaving it half empty"""
+    result = batch_ops.apply_folder_batch([{"op": "delete", "id": job.payload["folderId"]}])["results"][0]
+    if result["status"] == 200:
+        print(f"🗑️ Moved folder {job.payload['folderName']} of abandoned import {job.id} to the trash")
+
+jobs.register("folder.import", import_folder_job, on_abandoned=abandon_folder_import)
+
+def optimize_pdf_job(job):
+    """Replace an uploaded PDF by its optimized copy; the upload is kept as the original"""
+    document = job.payload["document"]
+    ref = blob_store.lookup_id(document)
+    if ref is None or ref["hash"] != job.payload["hash"]:
+        return {"document": document, "skipped": "File changed since the upload"}
+    file_path = os.path.join(UPLOAD_FOLDER, ref["path"])
+    result, stored = pdf_optimize.optimize(document, file_path, ref["hash"])
+    if stored is not None:
+        on_file_stored(file_path, stored)
+        record_file_change(ref["path"].split("/", 1)[0] if "/" in ref["path"] else "", file_path, ref["size"])
+    return result
+
+jobs.register("pdf.optimize", optimize_pdf_job)
+
+def import_direct_upload_job(job):
+    """Move a direct upload from storage into its folder through the blob store"""
+    try:
+        row = object_store.get_upload(job.payload["uploadId"])
+    except object_store.ObjectStoreError:
+        return {"uploadId": job.payload["uploadId"], "skipped": "Upload was cancelled"}
+    folder = row["folder"]
+    file_path = os.path.join(UPLOAD_FOLDER, folder, row["path"]) if folder else os.path.join(UPLOAD_FOLDER, row["path"])
+    old_size = existing_file_size(file_path)
+    if row["multipart_id"] is None:
+        stored = blob_store.put_existing(row["sha256"], file_path)
+    else:
+        # Staged in the job directory, so a retry does not fetch the object again
+        os.makedirs(job.directory, exist_ok=True)
+        staged = os.path.join(job.directory, "object")
+        sha256 = object_store.fetch_upload(row, staged)
+        stored = blob_store.put(staged, file_path, sha256)
+    on_file_stored(file_path, stored)
+    record_file_change(folder, file_path, old_size)
+    object_store.discard_upload(row["id"])
+    return {"uploadId": row["id"], "id": stored["id"], "path": blob_store.ref_key(file_path), "sha256": stored["hash"],
+            "size": stored["size"], "deduplicated": stored["deduplicated"]}
+
+jobs.register("upload.import", import_direct_upload_job)
+
 # ✅ Delete folder
 @app.route("/delete-folder/<folder_id>", methods=["DELETE"])
 def delete_folder(folder_id):
-    if folder_id not in folders_metadata:
-        return jsonify({"error": "Folder not found"}), 404
-
     try:
-        folder_metadata = folders_metadata[folder_id]
-        folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder_metadata["name"])
-        
-        # Remove folder from filesystem
-        if os.path.exists(folder_path):
-            shutil.rmtree(folder_path)
-        
-        # Remove from metadata
-        del folders_metadata[folder_id]
-        
-        # Save updated metadata to file
-        save_folders_metadata(folders_metadata)
-        
-        return jsonify({"message": "Folder deleted successfully"}), 200
+        # Move the folder into the trash (a rename) and unlist it; it can be
+        # restored until the reaper purges it
+        result = batch_ops.apply_folder_batch([{"op": "delete", "id": folder_id}])["results"][0]
+        if result["status"] == 404:
+            return jsonify({"error": "Folder not found"}), 404
+        if result["status"] != 200:
+            return jsonify({"error": f"Failed to delete folder: {result['error']}"}), 500
+
+        return jsonify({
+            "message": "Folder moved to the trash",
+            "trashId": result["trashId"],
+            "restoreUrl": result["restoreUrl"]
+        }), 200
 
     except Exception as e:
         return jsonify({"error": f"Failed to delete folder: {str(e)}"}), 500
 
+# ✅ Delete or rename many folders: {"operations": [{"op": "delete"|"retitle", "id", "name"}]}
+@app.route("/folders/batch", methods=["POST"])
+def batch_folders():
+    return batch_response(batch_ops.apply_folder_batch)
+
+# ✅ Delete, move or rename many files by id: {"operations": [{"op": "delete"|"move"|"retitle", "id", ...}]}
+@app.route("/files/batch", methods=["POST"])
+def batch_files():
+    return batch_response(batch_ops.apply_file_batch)
+
+# ✅ Export a folder as a streamed ZIP (?snips=0&highlights=0&manifest=0 leave parts out)
+@app.route("/export/folder/<folder_id>", methods=["GET"])
+def export_folder(folder_id):
+    folder_metadata = catalog.get_folder(folder_id)
+    if folder_metadata is None:
+        return jsonify({"error": "Folder not found"}), 404
+
+    # PDFs saved as deltas are written out before they are archived
+    for ref in blob_store.refs_in_folder(folder_metadata["name"]).values():
+        if pdf_versions.head_hash(ref["id"]) not in (None, ref["hash"]):
+            materialize_pdf(ref["id"])
+
+    entries = export_zip.folder_entries(
+        folder_metadata,
+        include_snips=request.args.get("snips", "1") != "0",
+        include_highlights=request.args.get("highlights", "1") != "0",
+        include_manifest=request.args.get("manifest", "1") != "0"
+    )
+    print(f"📦 Exporting {folder_metadata['name']}: {len(entries)} entries")
+    response = Response(stream_with_context(export_zip.stream_zip(entries)), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="{secure_filename(folder_metadata["name"]) or "folder"}.zip"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+# ✅ Move a folder's files to cold storage now instead of when it goes idle
+@app.route("/folders/<folder_id>/archive", methods=["POST"])
+def archive_folder(folder_id):
+    if catalog.get_folder(folder_id) is None:
+        return jsonify({"error": "Folder not found"}), 404
+
+    job = tiering.queue_archive(folder_id)
+    return jsonify({
+        "message": "Folder archive queued",
+        "folderId": folder_id,
+        "jobId": job["id"],
+        "statusUrl": f"http://127.0.0.1:5000/jobs/{job['id']}"
+    }), 202
+
 # ✅ Upload PDFs
 @app.route("/upload-pdf", methods=["POST"])
 def upload_pdf():
+    # Large PDFs are sent through /chunked-uploads and committed here by id
+    upload_id = request.form.get("uploadId", "").strip()
+    if upload_id:
+        return finalize_chunked_upload(upload_id)
+
     if "file" not in request.files:
         return jsonify({"error": "No file part"}), 400
 
@@ -176,7 +518,9 @@ def upload_pdf():
     os.makedirs(folder_path, exist_ok=True)
 
     file_path = os.path.join(folder_path, file.filename)
-    file.save(file_path)
+    old_size = existing_file_size(file_path)
+    on_file_stored(file_path, blob_store.put(file.stream, file_path))
+    record_file_change(folder, file_path, old_size)
 
     return jsonify({
         "message": "File uploaded successfully",
@@ -184,43 +528,284 @@ def upload_pdf():
         "file_url": f"http://127.0.0.1:5000/uploads/{folder}/{file.filename}" if folder else f"http://127.0.0.1:5000/uploads/{file.filename}"
     }), 200
 
-# ✅ Fetch PDFs
+# ✅ Chunked, resumable uploads: init -> PUT chunks -> finalize
+@app.route("/chunked-uploads", methods=["POST"])
+def init_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        session = chunked_upload.init_upload(
+            data.get("kind", "folder"),
+            (data.get("folder") or data.get("folderName") or "").strip(),
+            data.get("files", [])
+        )
+        return jsonify(session), 201
+    except chunked_upload.ChunkedUploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status
+
+@app.route("/chunked-uploads/<upload_id>", methods=["GET"])
+def get_chunked_upload(upload_id):
+    try:
+        return jsonify(chunked_upload.get_upload(upload_id)), 200
+    except chunked_upload.ChunkedUploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status
+
+@app.route("/chunked-uploads/<upload_id>/files/<file_id>", methods=["PUT"])
+def put_upload_chunk(upload_id, file_id):
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify({"error": "No offset provided"}), 400
+
+    try:
+        # Stream the body straight to disk instead of buffering it in werkzeug
+        new_offset = chunked_upload.write_chunk(upload_id, file_id, offset, request.content_length, request.stream)
+        return jsonify({"fileId": file_id, "offset": new_offset}), 200
+    except chunked_upload.ChunkedUploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status
+
+@app.route("/chunked-uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_chunked_upload(upload_id):
+    try:
+        session, staged_files = chunked_upload.finalize_upload(upload_id)
+    except chunked_upload.ChunkedUploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status
+
+    folder = session["folder"]
+    folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder) if folder else app.config["UPLOAD_FOLDER"]
+
+    try:
+        stats = {"fileCount": 0, "pdfCount": 0, "totalBytes": 0}
+        placed = []
+        for staged in staged_files:
+            relative_path = staged["path"]
+            file_path = os.path.join(folder_path, relative_path)
+            old_size = existing_file_size(file_path)
+            if staged["stagedPath"] is None:
+                stored = blob_store.put_existing(staged["sha256"], file_path)
+            else:
+                stored = blob_store.put(staged["stagedPath"], file_path, staged["sha256"])
+            on_file_stored(file_path, stored)
+            placed.append(relative_path)
+
+            if session["kind"] == "pdf":
+                record_file_change(folder, file_path, old_size)
+            else:
+                stats["fileCount"] += 1
+                stats["totalBytes"] += os.path.getsize(file_path)
+                if file_path.lower().endswith(".pdf"):
+                    stats["pdfCount"] += 1
+
+        chunked_upload.discard_upload(upload_id)
+
+        if session["kind"] == "pdf":
+            file_urls = [
+                f"http://127.0.0.1:5000/uploads/{folder}/{name}" if folder else f"http://127.0.0.1:5000/uploads/{name}"
+                for name in placed
+            ]
+            return jsonify({
+                "message": "File uploaded successfully",
+                "filename": placed[0],
+                "file_url": file_urls[0],
+                "filenames": placed,
+                "file_urls": file_urls
+            }), 200
+
+        folder_id = str(uuid.uuid4())
+        catalog.add_folder(folder_id, folder, folder_path, datetime.now().isoformat(), stats)
+        return jsonify({
+            "message": "Folder uploaded successfully",
+            "folderId": folder_id,
+            "folderName": folder,
+            "fileCount": len(placed)
+        }), 200
+
+    except Exception as e:
+        print(f"❌ Error finalizing upload {upload_id}: {str(e)}")
+        return jsonify({"error": f"Failed to finalize upload: {str(e)}"}), 500
+
+@app.route("/chunked-uploads/<upload_id>", methods=["DELETE"])
+def abort_chunked_upload(upload_id):
+    chunked_upload.discard_upload(upload_id)
+    return jsonify({"message": "Upload cancelled"}), 200
+
+# ✅ Direct uploads: create -> PUT the parts to their presigned URLs in parallel -> complete
+@app.route("/direct-uploads", methods=["POST"])
+def create_direct_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = object_store.create_upload(data.get("folder", ""), data.get("path"), data.get("size"),
+                                            data.get("contentType"), data.get("sha256"))
+        return jsonify(upload), 201
+    except object_store.ObjectStoreError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route("/direct-uploads/<upload_id>/complete", methods=["POST"])
+def complete_direct_upload(upload_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = object_store.complete_upload(upload_id, data.get("parts") or [])
+    except object_store.ObjectStoreError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    # The bytes are checked and moved into the blob store in the background
+    job = jobs.enqueue("upload.import", {"uploadId": upload_id}, jobs.PRIORITY_HIGH)
+    return jsonify({
+        **upload,
+        "message": "Upload complete; importing",
+        "jobId": job["id"],
+        "statusUrl": f"http://127.0.0.1:5000/jobs/{job['id']}"
+    }), 202
+
+@app.route("/direct-uploads/<upload_id>", methods=["DELETE"])
+def discard_direct_upload(upload_id):
+    object_store.discard_upload(upload_id)
+    return jsonify({"message": "Upload cancelled"}), 200
+
+# ✅ Presigned URLs of the local storage backend: part uploads and downloads
+@app.route("/objects/<path:key>", methods=["PUT"])
+def put_object_part(key):
+    try:
+        params = object_store.verify("PUT", key, request.args)
+        # Stream the body straight to disk instead of buffering it in werkzeug
+        etag = object_store.write_local_part(key, params, request.content_length, request.stream)
+    except object_store.ObjectStoreError as e:
+        return jsonify({"error": str(e)}), e.status
+    response = Response(status=200)
+    response.headers["ETag"] = etag
+    return response
+
+@app.route("/objects/<path:key>", methods=["GET"])
+def get_object(key):
+    try:
+        params = object_store.verify("GET", key, request.args)
+    except object_store.ObjectStoreError as e:
+        return jsonify({"error": str(e)}), e.status
+    path = object_store.storage.local_path(key)
+    if path is None:
+        return jsonify({"error": "Object not found"}), 404
+    return send_file(path, mimetype=params.get("type") or None, as_attachment=params.get("download") == "1",
+                     download_name=params.get("name") or None, conditional=True, etag=key.rsplit("/", 1)[-1])
+
+# ✅ Presigned download URL of a stored file (?download=1 for an attachment); bucket URLs skip this process
+@app.route("/files/<file_id>/download-url", methods=["GET"])
+def get_download_url(file_id):
+    materialize_pdf(file_id)
+    ref = blob_store.lookup_id(file_id)
+    if ref is None:
+        return jsonify({"error": "File not found"}), 404
+
+    filename = os.path.basename(ref["path"])
+    url, direct = object_store.download_url(ref["hash"], filename,
+                                            mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                                            request.args.get("download") == "1")
+    if url is None:
+        # Not copied to the bucket yet (it is queued): served by this app meanwhile
+        url = f"http://127.0.0.1:5000/uploads/{ref['path']}?v={ref['hash']}"
+    response = jsonify({"id": file_id, "url": url, "direct": direct, "sha256": ref["hash"], "size": ref["size"],
+                        "expiresIn": object_store.STORAGE_PRESIGN_EXPIRES})
+    response.headers["Cache-Control"] = "no-store"
+    return response, 200
+
+# ✅ Fetch PDFs (?folder=&limit=&cursor=&sort=name|date|size&order=&prefix=&fields=)
 @app.route("/get-pdfs", methods=["GET"])
 def get_pdfs():
-    folder = request.args.get("folder", "").strip()
+    folder = request.args.get("folder", "").strip().replace("\\", "/").strip("/")
     folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder) if folder else app.config["UPLOAD_FOLDER"]
 
+    try:
+        spec = listing.parse_args(request.args, PDF_SORTS, "name", PDF_FIELDS)
+    except listing.ListingError as e:
+        return jsonify({"error": str(e)}), 400
+
     if not os.path.exists(folder_path):
-        return jsonify([]), 200  
-
-    def find_pdf_files(directory):
-        """Recursively find all PDF files in directory and subdirectories"""
-        pdf_files = []
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.lower().endswith('.pdf'):
-                    # Get relative path from the folder root
-                    relative_path = os.path.relpath(os.path.join(root, file), folder_path)
-                    pdf_files.append({
-                        "filename": relative_path,
-                        "url": f"http://127.0.0.1:5000/uploads/{folder}/{relative_path}" if folder else f"http://127.0.0.1:5000/uploads/{relative_path}"
-                    })
-        return pdf_files
-
-    pdf_files = find_pdf_files(folder_path)
-    return jsonify(pdf_files), 200
-
-# ✅ Serve PDFs Properly
+        return jsonify({"items": [], "nextCursor": None} if spec["paginated"] else []), 200
+    if folder:
+        tiering.touch(folder)
+
+    # Listed from the blob store's file index (covering nested folders) instead of walking the disk
+    base = f"{folder}/" if folder else ""
+    where = [("lower(path) LIKE '%.pdf'", ())]
+    if folder:
+        where.append(("folder = ?", (folder.split("/")[0],)))
+    if base or spec["prefix"]:
+        where.append(catalog.prefix_filter("path", base + spec["prefix"]))
+
+    return list_response("file_refs", spec, lambda row: pdf_item(row, base), where)
+
+# ✅ Serve PDFs Properly (byte ranges, strong ETags, conditional GET)
+@app.route("/uploads/<path:filename>", defaults={"folder": ""}, methods=["GET"])
 @app.route("/uploads/<path:folder>/<path:filename>", methods=["GET"])
 def serve_pdf(folder, filename):
-    folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder)
-    
-    if not os.path.exists(os.path.join(folder_path, filename)):
+    folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder) if folder else app.config["UPLOAD_FOLDER"]
+    file_path = safe_join(folder_path, filename)
+
+    if file_path is None:
+        return jsonify({"error": "File not found"}), 404
+
+    # Blob-backed files get their SHA-256 as a strong ETag; conditional sending
+    # answers Range/If-Range with 206 and If-None-Match/If-Modified-Since with 304
+    stored = blob_store.lookup(file_path)
+    # Files of archived folders are extracted on their first read
+    if not os.path.isfile(file_path) and not (stored and tiering.rehydrate(stored["hash"])):
+        return jsonify({"error": "File not found"}), 404
+    tiering.touch(folder or filename)
+    if stored and file_path.lower().endswith(".pdf"):
+        # Delta saves are applied to the file lazily, on its first read
+        materialize_pdf(stored["id"], file_path)
+        stored = blob_store.lookup(file_path)
+    response = send_stored_file(file_path, stored)
+    # Advertise range support up front so pdf.js switches to progressive loading
+    response.headers.setdefault("Accept-Ranges", "bytes")
+
+    return set_cache_headers(response, stored["hash"] if stored else None)
+
+# ✅ Page thumbnails, rasterized once by a worker pool and kept in an LRU disk cache
+@app.route("/pdfs/<file_id>/pages/<int:page>/thumb", methods=["GET"])
+def get_page_thumbnail(file_id, page):
+    materialize_pdf(file_id)
+    stored = blob_store.lookup_id(file_id)
+    if stored is None:
         return jsonify({"error": "File not found"}), 404
 
-    return send_from_directory(folder_path, filename)
+    if not thumbnails.available():
+        return jsonify({"error": "Thumbnail rendering requires PyMuPDF"}), 503
 
-# ✅ Start Snipping Tool & Detect Snip
+    width = thumbnails.normalize_width(request.args.get("w", type=int))
+    try:
+        thumb_path = thumbnails.get_thumbnail(stored["hash"], blob_store.readable_path(stored["hash"]), page, width)
+    except thumbnails.PageNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"❌ Error rendering thumbnail: {str(e)}")
+        return jsonify({"error": f"Failed to render thumbnail: {str(e)}"}), 500
+
+    response = send_file(thumb_path, mimetype="image/png", conditional=True,
+                         etag=f"{stored['hash']}-{page}-{width}")
+    return set_cache_headers(response, stored["hash"])
+
+def store_snip(job, screenshot_path):
+    """Move a screenshot picked up by the watcher into the job's folder
+
+    The capture is a plain folder file, not a snip: the client shows it and
+    posts it to /save-snip with a title, which creates the snip record and
+    queues its renditions.
+    """
+    folder_path = os.path.join(app.config["UPLOAD_FOLDER"], job["folder"])
+    filename = f"snip_{int(time.time() * 1000)}{os.path.splitext(screenshot_path)[1].lower()}"
+    new_path = os.path.join(folder_path, filename)
+    old_size = existing_file_size(new_path)
+    with open(screenshot_path, "rb") as f:
+        stored = blob_store.put(f, new_path)
+    os.remove(screenshot_path)
+    on_file_stored(new_path, stored)
+    record_file_change(job["folder"], new_path, old_size)
+    print(f"✅ Snip saved at: {new_path}")
+    return {"message": "Snip saved successfully",
+            "file_path": f"http://127.0.0.1:5000/uploads/{job['folder']}/{filename}?v={stored['hash']}"}
+
+# New screenshots are detected by a filesystem watcher instead of polling per request
+snip_watcher.start(store_snip)
+
+# ✅ Start Snipping Tool; the snip is delivered through /snip-jobs/<id>
 @app.route("/start-snip", methods=["POST"])
 def start_snip():
     selected_folder = request.form.get("folder", "").strip()
@@ -228,41 +813,73 @@ def start_snip():
     if not selected_folder:
         return jsonify({"error": "No folder selected"}), 400
 
-    folder_path = os.path.join(app.config["UPLOAD_FOLDER"], selected_folder)
+    folder_path = safe_join(app.config["UPLOAD_FOLDER"], selected_folder)
+    if folder_path is None:
+        return jsonify({"error": "Invalid folder"}), 400
     os.makedirs(folder_path, exist_ok=True)
 
     print(f"📂 Selected folder: {folder_path}")
 
-    # ✅ Open Snipping Tool
-    subprocess.run("explorer ms-screenclip:", shell=True)
-
-    # ✅ Wait for user to take a snip (max wait: 20 sec)
-    timeout = 20  
-    start_time = time.time()
-    
-    latest_screenshot = None
-
-    while time.time() - start_time < timeout:
-        time.sleep(3)  # Increased wait time per iteration
-        latest_screenshot = find_latest_snip()
+    job = snip_watcher.create_job(selected_folder)
 
-        if latest_screenshot and time.time() - os.path.getctime(latest_screenshot) < 20:
-            print(f"📸 New snip detected: {latest_screenshot}")
-            break
-
-    if not latest_screenshot:
-        return jsonify({"error": "No new snip detected. Please try again."}), 500
-
-    # ✅ Move snip to selected folder
-    new_path = os.path.join(folder_path, f"snip_{int(time.time())}.png")
+    # ✅ Open Snipping Tool without waiting for it
+    try:
+        subprocess.Popen("explorer ms-screenclip:", shell=True)
+    except OSError as e:
+        print(f"❌ Could not open the snipping tool: {e}")
 
+    return jsonify({
+        "jobId": job["id"],
+        "status": job["status"],
+        "statusUrl": f"http://127.0.0.1:5000/snip-jobs/{job['id']}",
+        "eventsUrl": f"http://127.0.0.1:5000/snip-jobs/{job['id']}/events"
+    }), 202
+
+@contextmanager
+def wait_slot(kind):
+    """Yield whether this request may hold its worker thread waiting for news"""
+    acquired = _wait_slots.acquire(blocking=False)
+    if not acquired:
+        metrics.WAITS_DECLINED.inc(kind=kind)
     try:
-        shutil.move(latest_screenshot, new_path)
-        print(f"✅ Snip saved at: {new_path}")
-        return jsonify({"message": "Snip saved successfully", "file_path": f"http://127.0.0.1:5000/uploads/{selected_folder}/snip_{int(time.time())}.png"}), 200
-    except Exception as e:
-        print(f"❌ Error moving snip: {e}")
-        return jsonify({"error": f"Failed to move snip: {str(e)}"}), 500
+        yield acquired
+    finally:
+        if acquired:
+            _wait_slots.release()
+
+# ✅ Snip job status (?wait=N long-polls up to N seconds for completion)
+@app.route("/snip-jobs/<job_id>", methods=["GET"])
+def get_snip_job(job_id):
+    wait = min(max(request.args.get("wait", 0, type=float), 0), SNIP_LONG_POLL_MAX)
+    with wait_slot("snip-job") as may_wait:
+        job = snip_watcher.get_job(job_id, wait if may_wait else 0)
+    if job is None:
+        return jsonify({"error": "Snip job not found"}), 404
+    return jsonify(job), 200
+
+# ✅ Snip job status as Server-Sent Events, ending when the job finishes
+@app.route("/snip-jobs/<job_id>/events", methods=["GET"])
+def snip_job_events(job_id):
+    if snip_watcher.get_job(job_id) is None:
+        return jsonify({"error": "Snip job not found"}), 404
+
+    def events():
+        with wait_slot("snip-job-events") as may_wait:
+            if not may_wait:
+                # No thread to spare: report the status now and let EventSource reconnect later
+                yield f"retry: {BUSY_STREAM_RETRY_MS}\n\n"
+            while True:
+                job = snip_watcher.get_job(job_id, SNIP_LONG_POLL_MAX if may_wait else 0)
+                if job is None:
+                    return
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+                if job["status"] not in ("pending", "processing") or not may_wait:
+                    return
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 # ✅ Save Edited PDF Properly (Make sure opened PDF gets saved)
 @app.route("/save-current-pdf", methods=["POST"])
@@ -292,16 +909,114 @@ def save_current_pdf():
     print(f"📂 Saving PDF to: {file_path}")
 
     try:
-        file.save(file_path)  # Save the file to the folder
+        previous = blob_store.lookup(file_path)
+        if previous is not None:
+            # Keep the version being replaced in the document's history
+            pdf_versions.record_full_save(previous["id"])
+        old_size = existing_file_size(file_path)
+        stored = blob_store.put(file.stream, file_path)  # Unchanged saves only cost a hash check
+        pdf_versions.record_full_save(stored["id"])
+        on_file_stored(file_path, stored)
+        record_file_change(folder, file_path, old_size)
         print(f"✅ PDF saved at: {file_path}")
         return jsonify({
-            "message": "PDF saved successfully", 
+            "message": "PDF saved successfully",
+            "id": stored["id"],
+            "sha256": stored["hash"],
+            "version": pdf_versions.head(stored["id"])["version"],
             "file_url": f"http://127.0.0.1:5000/uploads/{folder}/{filename}" if folder else f"http://127.0.0.1:5000/uploads/{filename}"
         }), 200
     except Exception as e:
         print(f"❌ Error saving PDF: {str(e)}")
         return jsonify({"error": f"Failed to save PDF: {str(e)}"}), 500
 
+# ✅ Save a PDF as a delta (?base=<sha256 of the current version>&kind=append|bsdiff, body = delta bytes)
+@app.route("/pdfs/<file_id>/versions", methods=["POST"])
+def save_pdf_version(file_id):
+    ref = blob_store.lookup_id(file_id)
+    if ref is None:
+        return jsonify({"error": "File not found"}), 404
+    base_hash = request.args.get("base", "").strip().lower()
+    if not base_hash:
+        return jsonify({"error": "base (the SHA-256 of the version the delta applies to) is required"}), 400
+    if request.content_length is None:
+        return jsonify({"error": "Content-Length is required"}), 411
+    if request.content_length > pdf_versions.MAX_DELTA_BYTES:
+        return jsonify({"error": f"Delta larger than {pdf_versions.MAX_DELTA_BYTES} bytes"}), 413
+
+    staged = blob_store.staging_path()
+    with open(staged, "wb") as f:
+        shutil.copyfileobj(request.stream, f, 1024 * 1024)
+        metrics.BYTES_WRITTEN.inc(f.tell(), kind="delta")
+
+    file_path = os.path.join(UPLOAD_FOLDER, ref["path"])
+    try:
+        saved, due = pdf_versions.save_delta(file_id, base_hash, request.args.get("kind", "append"), staged)
+        if due:
+            old_size = existing_file_size(file_path)
+            stored = pdf_versions.compact(file_id, file_path)
+            if stored is not None:
+                on_file_stored(file_path, stored)
+                record_file_change(ref["path"].split("/", 1)[0] if "/" in ref["path"] else "", file_path, old_size)
+    except pdf_versions.VersionError as e:
+        return jsonify({"error": str(e), **e.details}), e.status
+    except Exception as e:
+        print(f"❌ Error saving PDF version: {str(e)}")
+        return jsonify({"error": f"Failed to save PDF version: {str(e)}"}), 500
+
+    print(f"✅ Saved version {saved['version']} of {ref['path']} ({saved['delta_size']} byte {saved['kind']} delta)")
+    return jsonify({**pdf_versions.version_from_row(saved), "id": file_id, "compacted": due}), 201
+
+# ✅ Version history of a PDF
+@app.route("/pdfs/<file_id>/versions", methods=["GET"])
+def list_pdf_versions(file_id):
+    if blob_store.lookup_id(file_id) is None:
+        return jsonify({"error": "File not found"}), 404
+    versions = pdf_versions.list_versions(file_id)
+    return jsonify({"id": file_id, "head": versions[-1] if versions else None, "versions": versions}), 200
+
+# ✅ Download one saved version of a PDF
+@app.route("/pdfs/<file_id>/versions/<int:version>", methods=["GET"])
+def get_pdf_version(file_id, version):
+    ref = blob_store.lookup_id(file_id)
+    row = pdf_versions.get_version(file_id, version) if ref else None
+    if row is None:
+        return jsonify({"error": "Version not found"}), 404
+
+    filename = os.path.basename(ref["path"])
+    if not blob_store.has_blob(row["hash"], row["size"]):
+        staged = blob_store.staging_path()
+        try:
+            pdf_versions.write_version(file_id, version, staged)
+        except pdf_versions.VersionError as e:
+            return jsonify({"error": str(e)}), e.status
+        response = send_file(staged, mimetype="application/pdf", download_name=filename,
+                             conditional=True, etag=row["hash"])
+        response.call_on_close(lambda: os.remove(staged))
+    else:
+        response = send_file(blob_store.blob_path(row["hash"]), mimetype="application/pdf",
+                             download_name=filename, conditional=True, etag=row["hash"])
+    # A version's bytes never change
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+# ✅ Download a PDF exactly as it was uploaded, before the optimization pass
+@app.route("/pdfs/<file_id>/original", methods=["GET"])
+def get_pdf_original(file_id):
+    ref = blob_store.lookup_id(file_id)
+    if ref is None:
+        return jsonify({"error": "File not found"}), 404
+
+    # Files that were not optimized are their own original
+    optimized = pdf_optimize.get(file_id)
+    content_hash = optimized["original_hash"] if optimized else ref["hash"]
+    response = send_file(blob_store.blob_path(content_hash), mimetype="application/pdf", as_attachment=True,
+                         download_name=os.path.basename(ref["path"]), conditional=True, etag=content_hash)
+    return set_cache_headers(response, content_hash)
+
 # ✅ Save Snip with Metadata
 @app.route("/save-snip", methods=["POST"])
 def save_snip():
@@ -320,6 +1035,9 @@ def save_snip():
     if not timestamp:
         return jsonify({"error": "No timestamp provided"}), 400
 
+    if request.content_length and request.content_length > snip_images.SNIP_MAX_BYTES:
+        return jsonify({"error": f"Snip larger than {snip_images.SNIP_MAX_BYTES} bytes"}), 413
+
     try:
         # Create folder path
         folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder) if folder else app.config["UPLOAD_FOLDER"]
@@ -331,7 +1049,10 @@ def save_snip():
         file_path = os.path.join(folder_path, filename)
 
         # Save the snip file
-        snip_file.save(file_path)
+        old_size = existing_file_size(file_path)
+        stored = blob_store.put(snip_file.stream, file_path)
+        on_file_stored(file_path, stored)
+        record_file_change(folder, file_path, old_size)
 
         # Create metadata for the snip
         snip_metadata = {
@@ -346,21 +1067,10 @@ def save_snip():
             "url": f"http://127.0.0.1:5000/uploads/{folder}/{filename}" if folder else f"http://127.0.0.1:5000/uploads/{filename}"
         }
 
-        # Save metadata to a JSON file (we'll replace this with Supabase later)
-        snips_metadata_file = "snips_metadata.json"
-        snips_metadata = {}
-        
-        if os.path.exists(snips_metadata_file):
-            try:
-                with open(snips_metadata_file, 'r') as f:
-                    snips_metadata = json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                snips_metadata = {}
-
-        snips_metadata[snip_metadata["id"]] = snip_metadata
-
-        with open(snips_metadata_file, 'w') as f:
-            json.dump(snips_metadata, f, indent=2)
+        # Save metadata to the catalog and make it searchable
+        catalog.add_snip(snip_metadata)
+        search_index.index_snip(snip_metadata)
+        snip_images.process(snip_metadata["id"])
 
         print(f"✅ Snip saved: {file_path}")
         print(f"📝 Metadata: {snip_metadata}")
@@ -374,241 +1084,474 @@ def save_snip():
         print(f"❌ Error saving snip: {str(e)}")
         return jsonify({"error": f"Failed to save snip: {str(e)}"}), 500
 
-# ✅ Get all snips
+# ✅ Get all snips (?folder=&limit=&cursor=&sort=name|date&order=&prefix=&fields=)
 @app.route("/get-snips", methods=["GET"])
 def get_snips():
     folder = request.args.get("folder", "").strip()
-    snips_metadata_file = "snips_metadata.json"
-    
-    if not os.path.exists(snips_metadata_file):
-        return jsonify([]), 200
 
     try:
-        with open(snips_metadata_file, 'r') as f:
-            snips_metadata = json.load(f)
-
-        # Filter by folder if specified
-        if folder:
-            filtered_snips = [
-                snip for snip in snips_metadata.values() 
-                if snip.get("folder") == folder
-            ]
-        else:
-            filtered_snips = list(snips_metadata.values())
+        spec = listing.parse_args(request.args, SNIP_SORTS, "date", SNIP_FIELDS)
+    except listing.ListingError as e:
+        return jsonify({"error": str(e)}), 400
 
-        return jsonify(filtered_snips), 200
+    try:
+        # Filter by folder if specified (served from the folder index)
+        where = [("folder = ?", (folder,))] if folder else []
+        if spec["prefix"]:
+            where.append(catalog.prefix_filter("title", spec["prefix"]))
+        return list_response("snips", spec, snip_item, where)
 
     except Exception as e:
         print(f"❌ Error loading snips: {str(e)}")
         return jsonify({"error": f"Failed to load snips: {str(e)}"}), 500
 
+# ✅ Snip image renditions: thumb (grid) or display (AVIF/WebP by Accept header)
+@app.route("/snips/<snip_id>/image/<rendition>", methods=["GET"])
+def get_snip_image(snip_id, rendition):
+    if rendition not in ("thumb", "display"):
+        return jsonify({"error": "Unknown rendition"}), 404
+    snip = catalog.get_snip(snip_id)
+    if snip is None:
+        return jsonify({"error": "Snip not found"}), 404
+
+    renditions = snip.get("renditions") or {}
+    if rendition == "thumb":
+        chosen = renditions.get("thumb")
+    else:
+        chosen = snip_images.choose_display(renditions, request.headers.get("Accept", ""))
+    url_hash = (renditions.get(rendition) or {}).get("hash")
+
+    if chosen is None:
+        # Not processed (yet) or not supported by the client: send the original
+        stored = blob_store.lookup(snip["file_path"]) if snip.get("file_path") else None
+        if not snip.get("file_path") or not (os.path.isfile(snip["file_path"]) or stored):
+            return jsonify({"error": "Snip file not found"}), 404
+        response = send_stored_file(snip["file_path"], stored)
+    else:
+        response = send_file(blob_store.blob_path(chosen["hash"]), mimetype=f"image/{chosen['format']}",
+                             conditional=True, etag=chosen["hash"])
+    response.vary.add("Accept")
+    return set_cache_headers(response, url_hash if chosen is not None else None)
+
 # ✅ Delete snip
 @app.route("/delete-snip/<snip_id>", methods=["DELETE"])
 def delete_snip(snip_id):
-    snips_metadata_file = "snips_metadata.json"
-    
-    if not os.path.exists(snips_metadata_file):
-        return jsonify({"error": "Snip not found"}), 404
-
     try:
-        with open(snips_metadata_file, 'r') as f:
-            snips_metadata = json.load(f)
-
-        if snip_id not in snips_metadata:
+        # Unlisted at once; the file and rendition bytes are purged after the undo window
+        result = batch_ops.apply_snip_batch([{"op": "delete", "id": snip_id}])["results"][0]
+        if result["status"] == 404:
             return jsonify({"error": "Snip not found"}), 404
+        if result["status"] != 200:
+            return jsonify({"error": f"Failed to delete snip: {result['error']}"}), 500
 
-        snip_data = snips_metadata[snip_id]
-        file_path = snip_data.get("file_path")
-
-        # Delete the file
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-
-        # Remove from metadata
-        del snips_metadata[snip_id]
-
-        # Save updated metadata
-        with open(snips_metadata_file, 'w') as f:
-            json.dump(snips_metadata, f, indent=2)
-
-        return jsonify({"message": "Snip deleted successfully"}), 200
+        return jsonify({
+            "message": "Snip moved to the trash",
+            "trashId": result["trashId"],
+            "restoreUrl": result["restoreUrl"]
+        }), 200
 
     except Exception as e:
         print(f"❌ Error deleting snip: {str(e)}")
         return jsonify({"error": f"Failed to delete snip: {str(e)}"}), 500
 
-# ✅ Save Highlighted PDF with Embedded Highlights
+# ✅ Delete, move or retitle many snips: {"operations": [{"op": "delete"|"move"|"retitle", "id", ...}]}
+@app.route("/snips/batch", methods=["POST"])
+def batch_snips():
+    return batch_response(batch_ops.apply_snip_batch)
+
+# ✅ Save Highlighted PDF: {"documentId" (or "folder" + "originalPdf"), "highlights"?, "mode"?, "filename"?}
 @app.route("/save-highlighted-pdf", methods=["POST"])
 def save_highlighted_pdf():
     try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
+        data = request.get_json(silent=True)
 
-        folder = data.get("folder", "").strip()
-        highlights = data.get("highlights", [])
-        filename = data.get("filename", "").strip()
-        original_pdf = data.get("originalPdf", "").strip()
-        highlighted_content = data.get("highlightedContent", "")
-
-        if not folder:
-            return jsonify({"error": "No folder specified"}), 400
+        if not isinstance(data, dict):
+            return jsonify({"error": "No data provided"}), 400
 
-        if not highlights:
+        if not highlight_pdf.available():
+            return jsonify({"error": "Highlight exports need PyMuPDF"}), 503
+
+        # The source is a stored PDF, by file id or by its folder and name
+        document_id = str(data.get("documentId") or "").strip()
+        folder = str(data.get("folder") or "").strip()
+        original_pdf = str(data.get("originalPdf") or "").strip()
+        if not document_id and original_pdf:
+            ref = blob_store.lookup(os.path.join(app.config["UPLOAD_FOLDER"], folder, original_pdf))
+            document_id = ref["id"] if ref else ""
+        ref = blob_store.lookup_id(document_id) if document_id else None
+        if ref is None or not ref["path"].lower().endswith(".pdf"):
+            return jsonify({"error": "Source PDF not found"}), 404
+        folder = ref["path"].split("/", 1)[0] if "/" in ref["path"] else ""
+        original_pdf = ref["path"].rsplit("/", 1)[-1]
+
+        mode = data.get("mode", "annotate")
+        if mode not in highlight_pdf.MODES:
+            return jsonify({"error": f"mode must be one of {', '.join(highlight_pdf.MODES)}"}), 400
+
+        # Only geometry is sent; without it the document's stored annotations are used
+        highlights = data.get("highlights")
+        if highlights is not None:
+            highlights = highlight_pdf.normalize(highlights)
+            if not highlights:
+                return jsonify({"error": "No highlights provided"}), 400
+        elif annotations.document_version(document_id) == 0:
             return jsonify({"error": "No highlights provided"}), 400
 
-        # Create folder path
-        folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder)
-        os.makedirs(folder_path, exist_ok=True)
-
         # Generate unique ID for this highlighted PDF
         highlighted_pdf_id = str(uuid.uuid4())
-        
-        # Create highlighted PDF filename
+        filename = secure_filename(str(data.get("filename") or "")) or original_pdf
+        if not filename.lower().endswith(".pdf"):
+            filename += ".pdf"
         highlighted_filename = f"highlighted_{highlighted_pdf_id}_{filename}"
-        highlighted_pdf_path = os.path.join(folder_path, highlighted_filename)
-
-        # Save the highlighted content as HTML (for now)
-        # In a real implementation, you'd convert this to PDF
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Highlighted PDF</title>
-            <style>
-                .pdf-highlight {{
-                    background-color: rgba(255, 255, 0, 0.4) !important;
-                    border-radius: 2px !important;
-                    padding: 1px 2px !important;
-                    margin: 0 1px !important;
-                    display: inline !important;
-                    position: relative !important;
-                    z-index: 10 !important;
-                }}
-                body {{
-                    font-family: Arial, sans-serif;
-                    margin: 20px;
-                    line-height: 1.6;
-                }}
-            </style>
-        </head>
-        <body>
-            <h1>Highlighted PDF Content</h1>
-            <p><strong>Original PDF:</strong> {original_pdf}</p>
-            <p><strong>Highlights:</strong> {len(highlights)} items</p>
-            <hr>
-            {highlighted_content}
-        </body>
-        </html>
-        """
-        
-        # Save HTML file
-        html_path = highlighted_pdf_path.replace('.pdf', '.html')
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-
-        # Save highlight metadata
-        highlight_metadata = {
+
+        # The export is rendered (or taken from the render cache) and catalogued in the background
+        job = jobs.enqueue("highlight.export", {
             "id": highlighted_pdf_id,
-            "filename": filename,
+            "documentId": document_id,
             "folder": folder,
+            "filename": filename,
+            "highlightedFilename": highlighted_filename,
             "highlights": highlights,
-            "created_at": datetime.now().isoformat(),
-            "file_path": html_path,
-            "original_pdf": original_pdf,
-            "highlighted_content": highlighted_content
-        }
-
-        # Save to highlighted PDFs metadata file
-        highlighted_pdfs_file = "highlighted_pdfs_metadata.json"
-        highlighted_pdfs = {}
-        
-        if os.path.exists(highlighted_pdfs_file):
-            try:
-                with open(highlighted_pdfs_file, 'r') as f:
-                    highlighted_pdfs = json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                highlighted_pdfs = {}
-
-        highlighted_pdfs[highlighted_pdf_id] = highlight_metadata
-
-        with open(highlighted_pdfs_file, 'w') as f:
-            json.dump(highlighted_pdfs, f, indent=2)
+            "mode": mode,
+            "originalPdf": original_pdf
+        })
 
-        print(f"✅ Highlighted PDF saved: {highlighted_pdf_id}")
-        
         return jsonify({
-            "message": "Highlighted PDF saved successfully",
+            "message": "Highlighted PDF export accepted",
             "id": highlighted_pdf_id,
             "filename": highlighted_filename,
-            "highlighted_pdf": highlight_metadata
-        }), 200
+            "jobId": job["id"],
+            "statusUrl": f"http://127.0.0.1:5000/jobs/{job['id']}"
+        }), 202
 
+    except annotations.AnnotationError as e:
+        return jsonify({"error": str(e), **e.details}), e.status
     except Exception as e:
         print(f"❌ Error saving highlighted PDF: {str(e)}")
         return jsonify({"error": f"Failed to save highlighted PDF: {str(e)}"}), 500
 
+def export_highlights_job(job):
+    """Write a PDF with the highlights applied and add it to the catalog and search index"""
+    payload = job.payload
+    document_id, folder = payload["documentId"], payload["folder"]
+    materialize_pdf(document_id)
+    ref = blob_store.lookup_id(document_id)
+    if ref is None:
+        return {"id": payload["id"], "skipped": "Source PDF was deleted"}
+
+    if payload["highlights"] is not None:
+        highlights = payload["highlights"]
+        version = highlight_pdf.inline_version(highlights)
+    else:
+        highlights, version = highlight_pdf.stored_highlights(document_id)
+    export_hash = highlight_pdf.export(ref["hash"], version, highlights, payload["mode"])
+
+    folder_path = os.path.join(app.config["UPLOAD_FOLDER"], folder)
+    highlighted_pdf_path = os.path.join(folder_path, payload["highlightedFilename"])
+    old_size = existing_file_size(highlighted_pdf_path)
+    blob_store.put_existing(export_hash, highlighted_pdf_path)
+    record_file_change(folder, highlighted_pdf_path, old_size)
+
+    # Save highlight metadata
+    highlight_metadata = {
+        "id": payload["id"],
+        "filename": payload["filename"],
+        "folder": folder,
+        "highlights": highlights,
+        "created_at": datetime.now().isoformat(),
+        "file_path": highlighted_pdf_path,
+        "original_pdf": payload["originalPdf"],
+        "highlighted_content": ""
+    }
+
+    # Save to the highlighted PDFs catalog
+    catalog.add_highlighted_pdf(highlight_metadata)
+    search_index.index_highlighted_pdf(highlight_metadata)
+
+    print(f"✅ Highlighted PDF saved: {payload['id']}")
+    return {"id": payload["id"], "filename": payload["highlightedFilename"], "sha256": export_hash,
+            "annotationVersion": version}
+
+jobs.register("highlight.export", export_highlights_job)
+
+# ✅ Background job status (?wait=N long-polls up to N seconds for completion)
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    wait = min(max(request.args.get("wait", 0, type=float), 0), JOB_LONG_POLL_MAX)
+    with wait_slot("job") as may_wait:
+        job = jobs.get_job(job_id, wait if may_wait else 0)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+# ✅ Cancel a background job (queued jobs stop at once, running ones at their next step)
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+# ✅ Recent background jobs (?status=queued|running|succeeded|failed|cancelled&kind=&limit=)
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    limit = min(max(request.args.get("limit", 100, type=int), 1), listing.MAX_PAGE_SIZE)
+    return jsonify(jobs.list_jobs(request.args.get("status"), request.args.get("kind"), limit)), 200
+
+def parse_pages(value):
+    """Parse a page selection such as ``3`` or ``1-4,9`` into a sorted list of page numbers"""
+    pages = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        try:
+            first, last = int(first), int(last or first)
+        except ValueError:
+            raise annotations.AnnotationError(f"Invalid page selection {part!r}")
+        if first < 1 or last < first or last - first > MAX_PAGES_PER_REQUEST:
+            raise annotations.AnnotationError(f"Invalid page range {part!r}")
+        pages.update(range(first, last + 1))
+    if len(pages) > MAX_PAGES_PER_REQUEST:
+        raise annotations.AnnotationError(f"At most {MAX_PAGES_PER_REQUEST} pages per request")
+    return sorted(pages)
+
+# ✅ Annotations of a PDF (?pages=1-3,7 loads only the visible pages)
+@app.route("/documents/<document_id>/annotations", methods=["GET"])
+def get_annotations(document_id):
+    if blob_store.lookup_id(document_id) is None:
+        return jsonify({"error": "Document not found"}), 404
+    try:
+        pages = parse_pages(request.args.get("pages", request.args.get("page", "")))
+    except annotations.AnnotationError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    return jsonify({
+        "document": document_id,
+        "version": annotations.document_version(document_id),
+        "annotations": annotations.list_annotations(document_id, pages or None)
+    }), 200
+
+# ✅ Apply an editing session: {"upsert": [...], "delete": [ids]} in one transaction
+@app.route("/documents/<document_id>/annotations/batch", methods=["POST"])
+def batch_annotations(document_id):
+    if blob_store.lookup_id(document_id) is None:
+        return jsonify({"error": "Document not found"}), 404
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "No data provided"}), 400
+    upserts = data.get("upsert", [])
+    deletes = data.get("delete", [])
+    if not isinstance(upserts, list) or not isinstance(deletes, list):
+        return jsonify({"error": "upsert and delete must be lists"}), 400
+
+    try:
+        result = annotations.apply_batch(document_id, upserts, deletes)
+    except annotations.AnnotationError as e:
+        return jsonify({"error": str(e), **e.details}), e.status
+    except Exception as e:
+        print(f"❌ Error saving annotations: {str(e)}")
+        return jsonify({"error": f"Failed to save annotations: {str(e)}"}), 500
+
+    print(f"✅ Annotations of {document_id} at version {result['version']}: "
+          f"{len(result['upserted'])} saved, {len(result['deleted'])} deleted")
+    return jsonify(result), 200
+
 # ✅ Download Highlighted PDF
 @app.route("/download-highlighted-pdf/<highlighted_pdf_id>", methods=["GET"])
 def download_highlighted_pdf(highlighted_pdf_id):
     try:
-        highlighted_pdfs_file = "highlighted_pdfs_metadata.json"
-        
-        if not os.path.exists(highlighted_pdfs_file):
-            return jsonify({"error": "No highlighted PDFs found"}), 404
-
-        with open(highlighted_pdfs_file, 'r') as f:
-            highlighted_pdfs = json.load(f)
+        highlighted_pdf_data = catalog.get_highlighted_pdf(highlighted_pdf_id)
 
-        if highlighted_pdf_id not in highlighted_pdfs:
+        if highlighted_pdf_data is None:
             return jsonify({"error": "Highlighted PDF not found"}), 404
 
-        highlighted_pdf_data = highlighted_pdfs[highlighted_pdf_id]
         file_path = highlighted_pdf_data.get("file_path")
 
-        if not file_path or not os.path.exists(file_path):
+        stored = blob_store.lookup(file_path) if file_path else None
+        if not file_path or not (os.path.exists(file_path) or stored):
             return jsonify({"error": "Highlighted PDF file not found"}), 404
 
-        return send_file(
+        # Exports made before server-side rendering are HTML pages
+        is_pdf = file_path.lower().endswith(".pdf")
+        response = send_stored_file(
             file_path,
+            stored,
             as_attachment=True,
-            download_name=highlighted_pdf_data.get("filename", "highlighted_pdf.html"),
-            mimetype="text/html"
+            download_name=highlighted_pdf_data.get("filename", "highlighted_pdf.pdf" if is_pdf else "highlighted_pdf.html"),
+            mimetype="application/pdf" if is_pdf else "text/html"
         )
+        return set_cache_headers(response, None)
 
     except Exception as e:
         print(f"❌ Error downloading highlighted PDF: {str(e)}")
         return jsonify({"error": f"Failed to download highlighted PDF: {str(e)}"}), 500
 
-# ✅ Get Highlighted PDFs
+# ✅ Get Highlighted PDFs (?folder=&limit=&cursor=&sort=name|date&order=&prefix=&fields=)
 @app.route("/get-highlighted-pdfs", methods=["GET"])
 def get_highlighted_pdfs():
     folder = request.args.get("folder", "").strip()
-    highlighted_pdfs_file = "highlighted_pdfs_metadata.json"
-    
-    if not os.path.exists(highlighted_pdfs_file):
-        return jsonify([]), 200
 
     try:
-        with open(highlighted_pdfs_file, 'r') as f:
-            highlighted_pdfs = json.load(f)
-
-        # Filter by folder if specified
-        if folder:
-            filtered_pdfs = [
-                pdf for pdf in highlighted_pdfs.values() 
-                if pdf.get("folder") == folder
-            ]
-        else:
-            filtered_pdfs = list(highlighted_pdfs.values())
+        spec = listing.parse_args(request.args, HIGHLIGHTED_PDF_SORTS, "date", catalog.HIGHLIGHTED_PDF_FIELDS)
+    except listing.ListingError as e:
+        return jsonify({"error": str(e)}), 400
 
-        return jsonify(filtered_pdfs), 200
+    try:
+        # Filter by folder if specified (served from the folder index); with
+        # ?fields= the large highlighted_content column is never read
+        where = [("folder = ?", (folder,))] if folder else []
+        if spec["prefix"]:
+            where.append(catalog.prefix_filter("filename", spec["prefix"]))
+        return list_response("highlighted_pdfs", spec, catalog.highlighted_pdf_from_row, where,
+                             selected_columns(spec))
 
     except Exception as e:
         print(f"❌ Error loading highlighted PDFs: {str(e)}")
         return jsonify({"error": f"Failed to load highlighted PDFs: {str(e)}"}), 500
 
+def change_position(value, default):
+    """Parse a change feed position; None when invalid"""
+    if value in (None, ""):
+        return default
+    try:
+        position = int(value)
+    except ValueError:
+        return None
+    return position if position >= 0 else None
+
+# ✅ Change feed deltas (?since=<seq>&limit=&wait=); 410 means reload the lists and resume from "seq"
+@app.route("/changes", methods=["GET"])
+def get_changes():
+    since = change_position(request.args.get("since"), changes.head())
+    if since is None:
+        return jsonify({"error": "since must be a non-negative integer"}), 400
+    limit = min(max(request.args.get("limit", 500, type=int), 1), MAX_CHANGES_PER_REQUEST)
+    wait = min(max(request.args.get("wait", 0, type=float), 0), CHANGES_LONG_POLL_MAX)
+    try:
+        if wait:
+            with wait_slot("changes") as may_wait:
+                if may_wait:
+                    changes.wait(since, wait)
+        delta = changes.read(since, limit)
+    except changes.ChangesExpired as e:
+        return jsonify({"error": str(e), "reset": True, "seq": e.head}), 410
+    return jsonify({
+        "changes": [change_entry(change) for change in delta["changes"]],
+        "seq": delta["seq"],
+        "head": delta["head"],
+        "more": delta["seq"] < delta["head"]
+    }), 200
+
+# ✅ Change feed as Server-Sent Events (?since=<seq> or Last-Event-ID, &timeout=)
+@app.route("/changes/events", methods=["GET"])
+def change_events():
+    since = change_position(request.headers.get("Last-Event-ID") or request.args.get("since"), changes.head())
+    if since is None:
+        return jsonify({"error": "since must be a non-negative integer"}), 400
+    timeout = min(max(request.args.get("timeout", CHANGE_STREAM_MAX, type=float), 0), CHANGE_STREAM_MAX)
+
+    def events(position):
+        with wait_slot("change-events") as may_wait:
+            # Without a free slot the backlog is sent and the stream ends; EventSource
+            # resumes from the last id after a longer delay
+            deadline = time.time() + (timeout if may_wait else 0)
+            yield f"retry: {1000 if may_wait else BUSY_STREAM_RETRY_MS}\n\n"
+            while True:
+                try:
+                    delta = changes.read(position, MAX_CHANGES_PER_REQUEST)
+                except changes.ChangesExpired as e:
+                    # Too far behind: the client reloads its lists and follows from the head
+                    yield f"event: reset\ndata: {json.dumps({'seq': e.head})}\n\n"
+                    return
+                for change in delta["changes"]:
+                    yield f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change_entry(change))}\n\n"
+                position = delta["seq"]
+                if position < delta["head"]:
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                if changes.wait(position, min(remaining, CHANGE_STREAM_KEEPALIVE)) == position:
+                    yield ": keepalive\n\n"
+
+    response = Response(stream_with_context(events(since)), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# ✅ Full-text search over PDF text, snips and highlights
+@app.route("/search", methods=["GET"])
+def search():
+    query = request.args.get("q", "").strip()
+    folder = request.args.get("folder", "").strip()
+    kind = request.args.get("kind", "").strip()
+    limit = request.args.get("limit", search_index.DEFAULT_LIMIT, type=int)
+
+    if not query:
+        return jsonify({"error": "No query provided"}), 400
+
+    try:
+        started = time.perf_counter()
+        hits = search_index.search(query, folder or None, kind or None, limit)
+        results = []
+        for hit in hits:
+            if hit["kind"] == "pdf":
+                url = f"http://127.0.0.1:5000/uploads/{hit['path']}"
+                if hit["page"]:
+                    url += f"#page={hit['page']}"
+            elif hit["kind"] == "snip":
+                url = f"http://127.0.0.1:5000/uploads/{hit['folder']}/{hit['path']}" if hit["folder"] else f"http://127.0.0.1:5000/uploads/{hit['path']}"
+            else:
+                url = f"http://127.0.0.1:5000/download-highlighted-pdf/{hit['ref']}"
+            results.append({
+                "kind": hit["kind"],
+                "id": hit["ref"],
+                "folder": hit["folder"],
+                "title": hit["title"],
+                "page": hit["page"],
+                "snippet": hit["snippet"],
+                "score": hit["score"],
+                "url": url
+            })
+        return jsonify({
+            "query": query,
+            "results": results,
+            "tookMs": round((time.perf_counter() - started) * 1000, 2)
+        }), 200
+
+    except Exception as e:
+        print(f"❌ Error searching: {str(e)}")
+        return jsonify({"error": f"Search failed: {str(e)}"}), 500
+
+# ✅ Deleted folders, files and snips that can still be restored
+@app.route("/trash", methods=["GET"])
+def list_trash():
+    return jsonify(trash.list_entries()), 200
+
+# ✅ Undo a delete: move the item back and list it again
+@app.route("/trash/<entry_id>/restore", methods=["POST"])
+def restore_trash(entry_id):
+    try:
+        return jsonify(trash.restore(entry_id)), 200
+    except trash.TrashError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        print(f"❌ Error restoring from the trash: {str(e)}")
+        return jsonify({"error": f"Failed to restore: {str(e)}"}), 500
+
+# ✅ Purge a trash entry now instead of at the end of its undo window
+@app.route("/trash/<entry_id>", methods=["DELETE"])
+def purge_trash(entry_id):
+    if not trash.purge_now(entry_id):
+        return jsonify({"error": "Trash entry not found"}), 404
+    return jsonify({"message": "Purge scheduled"}), 202
+
+# Job handlers are registered above; start working through the queue
+jobs.start_workers()
+trash.start_reaper()
+tiering.start_scanner()
+
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
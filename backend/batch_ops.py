@@ -0,0 +1,436 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from werkzeug.security import safe_join
+
+import annotations
+import blob_store
+import catalog
+import jobs
+import pdf_optimize
+import pdf_versions
+import search_index
+import tiering
+import trash
+
+# Largest number of operations accepted in one batch
+MAX_BATCH_SIZE = 1000
+# Threads moving files on disk; renames are cheap but each one waits on the filesystem
+BATCH_IO_WORKERS = int(os.environ.get("BATCH_IO_WORKERS", "8"))
+
+SNIP_OPS = ("delete", "move", "retitle")
+FILE_OPS = ("delete", "move", "retitle")
+FOLDER_OPS = ("delete", "retitle")
+
+_executor = None
+_lock = threading.Lock()
+
+
+class BatchError(Exception):
+    """Raised for a malformed batch as a whole; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _Item:
+    """One operation of a batch: its outcome, the renames it needs on disk and its catalog changes"""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.result = {"id": entry.get("id"), "op": entry.get("op"), "status": 200}
+        # (source, target) renames done before the transaction and undone if it fails
+        self.renames = []
+        self.done = []
+        # Callables run inside the shared transaction
+        self.changes = []
+        # Trash entry of a delete
+        self.trash_id = None
+
+    @property
+    def ok(self):
+        return self.result["status"] == 200
+
+    def fail(self, status, error):
+        self.result = {"id": self.result["id"], "op": self.result["op"], "status": status, "error": error}
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BATCH_IO_WORKERS, thread_name_prefix="batch-io")
+        return _executor
+
+
+def _parse(operations, allowed):
+    """Validate the batch shape and turn its entries into items, failing malformed ones individually"""
+    if not isinstance(operations, list):
+        raise BatchError("operations must be a list")
+    if len(operations) > MAX_BATCH_SIZE:
+        raise BatchError(f"A batch may contain at most {MAX_BATCH_SIZE} operations", 413)
+    items = []
+    seen = set()
+    for entry in operations:
+        item = _Item(entry if isinstance(entry, dict) else {})
+        items.append(item)
+        if not isinstance(entry, dict) or not isinstance(entry.get("id"), str):
+            item.fail(400, "Each operation needs an id")
+        elif entry.get("op") not in allowed:
+            item.fail(400, f"op must be one of {', '.join(allowed)}")
+        elif entry["id"] in seen:
+            item.fail(400, "The id appears more than once in the batch")
+        else:
+            seen.add(entry["id"])
+    return items
+
+
+def _valid_name(name):
+    """A single path segment a user may choose for a file or folder"""
+    return isinstance(name, str) and name.strip() == name and name not in ("", ".", "..") \
+        and not name.startswith(".") and "/" not in name and "\\" not in name
+
+
+def _folder_path(folder):
+    """Absolute directory of a (possibly nested) folder name, or None when it is not allowed"""
+    if not isinstance(folder, str):
+        return None
+    folder = folder.strip().strip("/")
+    if not folder:
+        return blob_store.UPLOAD_ROOT
+    if any(part.startswith(".") for part in folder.split("/")):
+        return None
+    return safe_join(blob_store.UPLOAD_ROOT, folder)
+
+
+def _upload_url(folder, filename):
+    return f"http://127.0.0.1:5000/uploads/{folder}/{filename}" if folder else f"http://127.0.0.1:5000/uploads/{filename}"
+
+
+def _claim_target(item, targets, target):
+    """Reserve a destination path so two operations of a batch never write to the same one"""
+    if target in targets:
+        item.fail(409, "Another operation in the batch moves something to the same place")
+        return False
+    targets.add(target)
+    return True
+
+
+def _rename(item):
+    for source, target in item.renames:
+        try:
+            if os.path.lexists(target):
+                raise FileExistsError(f"{blob_store.ref_key(target)} already exists")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(source, target)
+        except OSError as e:
+            item.fail(409 if isinstance(e, FileExistsError) else 500, str(e))
+            _undo(item)
+            return
+        item.done.append((source, target))
+
+
+def _undo(item):
+    for source, target in reversed(item.done):
+        try:
+            os.rename(target, source)
+        except OSError as e:
+            print(f"❌ Could not move {target} back to {source}: {str(e)}")
+    item.done = []
+
+
+def _trash(item, file_path, hold):
+    """Plan a delete: move the item into a trash entry, which ``hold(entry_id)`` records"""
+    entry_id = trash.new_entry_id()
+    if os.path.lexists(file_path):
+        item.renames.append((file_path, trash.trash_path(entry_id, file_path)))
+    item.changes.append(lambda: hold(entry_id))
+    item.trash_id = entry_id
+    item.result["trashId"] = entry_id
+    item.result["restoreUrl"] = f"http://127.0.0.1:5000/trash/{entry_id}/restore"
+
+
+def _execute(items):
+    """Do the planned renames concurrently, then apply every catalog change in one transaction
+
+    Each item's changes run in a savepoint, so an item that fails there is
+    rolled back (on disk too) without affecting the rest.  Deleted items
+    go to the trash, where the reaper purges them after the undo window.
+    """
+    planned = [item for item in items if item.ok]
+    list(_get_executor().map(_rename, planned))
+    applied = [item for item in planned if item.ok]
+
+    failed = []
+    try:
+        with catalog.transaction():
+            for item in applied:
+                try:
+                    with catalog.transaction():
+                        for change in item.changes:
+                            change()
+                except Exception as e:
+                    item.fail(500, str(e))
+                    failed.append(item)
+    except BaseException:
+        list(_get_executor().map(_undo, applied))
+        _discard_trash(items)
+        raise
+    list(_get_executor().map(_undo, failed))
+    _discard_trash(item for item in items if not item.ok)
+
+    results = [item.result for item in items]
+    succeeded = sum(1 for result in results if result["status"] == 200)
+    print(f"📦 Batch applied: {succeeded} succeeded, {len(results) - succeeded} failed")
+    return {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}
+
+
+def _discard_trash(items):
+    """Remove the (emptied) trash directories of deletes that did not happen"""
+    for item in items:
+        if item.trash_id:
+            shutil.rmtree(os.path.join(trash.TRASH_FOLDER, item.trash_id), ignore_errors=True)
+
+
+def remove_deleted(job):
+    """Cleanup job queued by deletes before they went through the trash: remove the files,
+    their annotations and versions, then unreferenced blobs"""
+    documents = job.payload["documents"]
+    shutil.rmtree(job.directory, ignore_errors=True)
+    annotations.remove_documents(documents)
+    pdf_versions.remove_documents(documents)
+    pdf_optimize.remove_documents(documents)
+    blob_store.collect_garbage()
+    return {"deleted": len(job.payload.get("deleted", [job.payload.get("folder")])), "documents": len(documents)}
+
+
+# ---------------------------------------------------------------- snips
+
+def apply_snip_batch(operations):
+    """Delete, move and retitle snips
+
+    ``{"op": "delete", "id"}``, ``{"op": "move", "id", "folder"}`` and
+    ``{"op": "retitle", "id", "title", "description"}`` (either text field
+    may be left out).  Returns a result per operation in request order.
+    """
+    items = _parse(operations, SNIP_OPS)
+    now = datetime.now().isoformat()
+    targets = set()
+    for item in items:
+        if not item.ok:
+            continue
+        snip = catalog.get_snip(item.result["id"])
+        if snip is None:
+            item.fail(404, "Snip not found")
+            continue
+        file_path = snip.get("file_path") or ""
+        op = item.result["op"]
+        if op == "move" and file_path:
+            # Archived files are moved on disk, so they leave the cold tier first
+            tiering.thaw(file_path)
+        size = os.path.getsize(file_path) if os.path.isfile(file_path) else None
+
+        if op == "delete":
+            _trash(item, file_path, lambda entry_id, snip=snip, size=size: trash.trash_snip(entry_id, snip, size))
+
+        elif op == "move":
+            folder_path = _folder_path(item.entry.get("folder", ""))
+            if folder_path is None:
+                item.fail(400, "Invalid target folder")
+                continue
+            folder = item.entry.get("folder", "").strip().strip("/")
+            item.result["folder"] = folder
+            item.result["url"] = _upload_url(folder, snip["filename"])
+            if folder == snip["folder"]:
+                continue
+            new_path = os.path.join(folder_path, snip["filename"])
+            if not _claim_target(item, targets, new_path):
+                continue
+            if size is not None:
+                item.renames.append((file_path, new_path))
+            item.changes.append(lambda snip=snip, folder=folder, new_path=new_path, size=size:
+                                _move_snip(snip, folder, new_path, size, now))
+
+        else:
+            fields = {}
+            for field in ("title", "description"):
+                if field in item.entry:
+                    if not isinstance(item.entry[field], str):
+                        item.fail(400, f"{field} must be a string")
+                        break
+                    fields[field] = item.entry[field].strip()
+            if not item.ok:
+                continue
+            if not fields or fields.get("title", snip["title"]) == "":
+                item.fail(400, "A non-empty title or a description is required")
+                continue
+            item.changes.append(lambda snip=snip, fields=fields: _retitle_snip(snip, fields))
+            item.result.update(fields)
+
+    return _execute(items)
+
+
+def _move_snip(snip, folder, new_path, size, now):
+    blob_store.move(snip["file_path"], new_path)
+    if size is not None:
+        catalog.record_file_change(snip["folder"], snip["filename"], size, None, now)
+        catalog.record_file_change(folder, snip["filename"], None, size, now)
+    catalog.update_snip(snip["id"], folder=folder, file_path=new_path, url=_upload_url(folder, snip["filename"]))
+    search_index.move("snip", snip["id"], folder, snip["filename"])
+
+
+def _retitle_snip(snip, fields):
+    catalog.update_snip(snip["id"], **fields)
+    search_index.index_snip({**snip, **fields})
+
+
+# ---------------------------------------------------------------- files
+
+def _owned_paths(file_paths):
+    """Those of the given files that belong to a snip or highlight export record"""
+    if not file_paths:
+        return set()
+    placeholders = ", ".join("?" * len(file_paths))
+    conn = catalog.get_connection()
+    owned = set()
+    for table in ("snips", "highlighted_pdfs"):
+        owned.update(row["file_path"] for row in conn.execute(
+            f"SELECT file_path FROM {table} WHERE file_path IN ({placeholders})", file_paths
+        ))
+    return owned
+
+
+def apply_file_batch(operations):
+    """Delete, move and rename stored files by their file id
+
+    ``{"op": "delete", "id"}``, ``{"op": "move", "id", "folder"}`` (an
+    existing folder; the path inside the folder is kept) and
+    ``{"op": "retitle", "id", "name"}`` (a new file name in the same
+    directory).  Snip images and highlight exports are changed through
+    their own records instead.
+    """
+    items = _parse(operations, FILE_OPS)
+    now = datetime.now().isoformat()
+    targets = set()
+    refs = {}
+    for item in items:
+        if item.ok:
+            ref = blob_store.lookup_id(item.result["id"])
+            if ref is None:
+                item.fail(404, "File not found")
+            else:
+                refs[item.result["id"]] = ref
+    owned = _owned_paths([os.path.join(blob_store.UPLOAD_ROOT, ref["path"]) for ref in refs.values()])
+    folders = {folder["name"] for folder in catalog.list_folders()}
+
+    for item in items:
+        if not item.ok:
+            continue
+        ref = refs[item.result["id"]]
+        file_path = os.path.join(blob_store.UPLOAD_ROOT, ref["path"])
+        if file_path in owned:
+            item.fail(409, "The file belongs to a snip or highlight export")
+            continue
+        folder, _, inner = ref["path"].partition("/") if "/" in ref["path"] else ("", "", ref["path"])
+        op = item.result["op"]
+        if op != "delete":
+            # Archived files are renamed on disk, so they leave the cold tier first
+            tiering.thaw(file_path)
+
+        if op == "delete":
+            _trash(item, file_path, lambda entry_id, ref=ref, file_path=file_path, folder=folder:
+                   trash.trash_file(entry_id, ref, file_path, folder))
+            continue
+
+        if op == "move":
+            new_folder = item.entry.get("folder")
+            if new_folder not in folders:
+                item.fail(404, "Target folder not found")
+                continue
+            new_key = f"{new_folder}/{inner}"
+        else:
+            name = item.entry.get("name")
+            if not _valid_name(name):
+                item.fail(400, "Invalid file name")
+                continue
+            new_key = "/".join(ref["path"].split("/")[:-1] + [name])
+        if new_key == ref["path"]:
+            item.result["path"] = new_key
+            continue
+        new_path = os.path.join(blob_store.UPLOAD_ROOT, new_key)
+        if not _claim_target(item, targets, new_path):
+            continue
+        item.renames.append((file_path, new_path))
+        item.changes.append(lambda ref=ref, file_path=file_path, new_path=new_path, folder=folder:
+                            _move_file(ref, file_path, folder, new_path, now))
+        item.result["path"] = new_key
+
+    return _execute(items)
+
+
+def _move_file(ref, file_path, folder, new_path, now):
+    new_key = blob_store.ref_key(new_path)
+    new_folder = new_key.split("/", 1)[0] if "/" in new_key else ""
+    blob_store.move(file_path, new_path)
+    catalog.record_file_change(folder, os.path.basename(file_path), ref["size"], None, now)
+    catalog.record_file_change(new_folder, os.path.basename(new_path), None, ref["size"], now)
+    search_index.move("pdf", ref["id"], new_folder, new_key, new_key.rsplit("/", 1)[-1])
+
+
+# ---------------------------------------------------------------- folders
+
+def apply_folder_batch(operations):
+    """Delete and rename folders
+
+    ``{"op": "delete", "id"}`` and ``{"op": "retitle", "id", "name"}``.
+    Deleted folders are moved to the trash at once and purged after the
+    undo window; a rename carries the folder's files, snips, highlight
+    exports and search entries along.
+    """
+    items = _parse(operations, FOLDER_OPS)
+    targets = set()
+    names = {folder["name"] for folder in catalog.list_folders()}
+    for item in items:
+        if not item.ok:
+            continue
+        folder = catalog.get_folder(item.result["id"])
+        if folder is None:
+            item.fail(404, "Folder not found")
+            continue
+        folder_path = os.path.join(blob_store.UPLOAD_ROOT, folder["name"])
+
+        if item.result["op"] == "delete":
+            _trash(item, folder_path, lambda entry_id, folder=folder: trash.trash_folder(entry_id, folder))
+            continue
+
+        name = item.entry.get("name")
+        if not _valid_name(name):
+            item.fail(400, "Invalid folder name")
+            continue
+        item.result["name"] = name
+        if name == folder["name"]:
+            continue
+        new_path = os.path.join(blob_store.UPLOAD_ROOT, name)
+        if name in names:
+            item.fail(409, "A folder with that name already exists")
+            continue
+        if not _claim_target(item, targets, new_path):
+            continue
+        item.renames.append((folder_path, new_path))
+        item.changes.append(lambda folder=folder, name=name, new_path=new_path: _rename_folder(folder, name, new_path))
+
+    return _execute(items)
+
+
+def _rename_folder(folder, name, new_path):
+    blob_store.move_folder(folder["name"], name)
+    search_index.move_folder(folder["name"], name)
+    catalog.rename_folder(folder["id"], name, new_path)
+
+
+jobs.register("folder.delete", remove_deleted)
+jobs.register("files.delete", remove_deleted)
@@ -0,0 +1,705 @@
+"""Load and latency benchmarks for every backend route
+
+    python benchmark.py --folders 4 --pdfs 25 --pdf-size 200000 --snips 40 --highlights 20 \\
+        --clients 8 --requests 200 --output results.json
+
+A synthetic corpus (folders of PDFs, snips and highlight exports) is built
+in a temporary directory that becomes the app's UPLOAD_FOLDER and catalog,
+so nothing outside it is touched and no network access is needed.  The app
+is served by waitress on a free local port and each scenario is driven by
+``--clients`` concurrent keep-alive connections for ``--requests`` requests.
+
+Per scenario the results hold p50/p95/p99 latency, throughput, body bytes
+sent and received, disk bytes read and written by the process and its RSS.  The
+server and the clients share one process, so RSS and disk counters cover
+both; worker pools (thumbnails, snip images) are reported as children.
+Corpus content is derived from ``--seed``, so runs with the same arguments
+are comparable; pass ``--baseline`` an earlier result file to print the
+change in p95 latency and throughput per scenario.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+import hashlib
+from datetime import datetime
+from urllib.parse import urlsplit
+
+WORDS = ("invoice", "contract", "bridge", "tender", "survey", "concrete", "steel", "drainage",
+         "pavement", "budget", "schedule", "inspection", "highway", "tunnel", "permit", "audit")
+
+
+# ---------------------------------------------------------------- synthetic content
+
+def make_pdf(rng, pages, size):
+    """A valid PDF with searchable text on each page, padded to about ``size`` bytes"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for _ in range(pages):
+        text = " ".join(rng.choice(WORDS) for _ in range(12)).encode()
+        content = b"BT /F1 12 Tf 72 720 Td (" + text + b") Tj ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_refs.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(page_refs) + b"] /Count %d >>" % pages
+    # Incompressible filler, like the images in real scans
+    filler = rng.randbytes(max(size - 600 * pages - 400, 0))
+    objects.append(b"<< /Length %d >>\nstream\n" % len(filler) + filler + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def make_png(rng, width, height):
+    """An RGB PNG of flat bands with some noise, roughly like a screenshot"""
+    rows = bytearray()
+    for y in range(height):
+        shade = (y // 16 * 37) % 256
+        rows.append(0)
+        rows += bytes((shade, shade, shade)) * width
+        if y % 8 == 0:
+            rows[-width:] = rng.randbytes(width)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(bytes(rows), 6)) + chunk(b"IEND", b""))
+
+
+def multipart(fields=(), files=()):
+    """Encode form fields and ``(field, filename, bytes)`` files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in fields:
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n').encode()
+    for name, filename, data in files:
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return bytes(body), f"multipart/form-data; boundary={boundary}"
+
+
+# ---------------------------------------------------------------- client and measurements
+
+class Client:
+    """One keep-alive connection; counts request and response body bytes"""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        self.sent = 0
+        self.received = 0
+
+    def request(self, method, path, body=None, headers=None, content_type=None):
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            content_type = content_type or "application/json"
+        if content_type:
+            headers["Content-Type"] = content_type
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # Reconnect once, e.g. after the server closed an idle connection
+            self.connection.close()
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        self.sent += len(body or b"")
+        self.received += len(data)
+        if response.status >= 400 and response.status not in (404, 409, 416):
+            raise RuntimeError(f"{method} {path} -> {response.status}: {data[:200]!r}")
+        return response.status, data
+
+    def json(self, method, path, body=None, **kwargs):
+        return json.loads(self.request(method, path, body, **kwargs)[1])
+
+    def close(self):
+        self.connection.close()
+
+
+def process_counters():
+    """RSS and disk bytes of this process (and peak RSS of its worker processes)"""
+    counters = {
+        "maxRssBytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+        "childrenMaxRssBytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    }
+    try:
+        with open("/proc/self/statm") as f:
+            counters["rssBytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        counters["diskReadBytes"] = int(io["read_bytes"])
+        counters["diskWriteBytes"] = int(io["write_bytes"])
+    except OSError:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        counters["rssBytes"] = counters["maxRssBytes"]
+        counters["diskReadBytes"] = usage.ru_inblock * 512
+        counters["diskWriteBytes"] = usage.ru_oublock * 512
+    return counters
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(port, operation, requests, clients, warmup):
+    """Run ``operation(client, worker, i)`` ``requests`` times over ``clients`` connections"""
+    connections = [Client(port) for _ in range(clients)]
+    for i in range(min(warmup, requests)):
+        operation(connections[0], 0, -1 - i)
+    for connection in connections:
+        connection.sent = connection.received = 0
+
+    latencies = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker(number):
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            try:
+                operation(connections[number], number, i)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    before = process_counters()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    after = process_counters()
+    for connection in connections:
+        connection.close()
+
+    latencies.sort()
+    milliseconds = [latency * 1000 for latency in latencies]
+    return {
+        "requests": requests,
+        "clients": clients,
+        "errors": len(errors),
+        "firstError": errors[0] if errors else None,
+        "durationSeconds": round(duration, 4),
+        "throughputPerSecond": round(len(latencies) / duration, 2) if duration else None,
+        "latencyMs": {
+            "p50": round(percentile(milliseconds, 0.50), 3) if milliseconds else None,
+            "p95": round(percentile(milliseconds, 0.95), 3) if milliseconds else None,
+            "p99": round(percentile(milliseconds, 0.99), 3) if milliseconds else None,
+            "mean": round(sum(milliseconds) / len(milliseconds), 3) if milliseconds else None,
+            "max": round(milliseconds[-1], 3) if milliseconds else None
+        },
+        "bodyBytesSent": sum(connection.sent for connection in connections),
+        "bodyBytesReceived": sum(connection.received for connection in connections),
+        "diskReadBytes": after["diskReadBytes"] - before["diskReadBytes"],
+        "diskWriteBytes": after["diskWriteBytes"] - before["diskWriteBytes"],
+        "rssBytes": after["rssBytes"],
+        "rssDeltaBytes": after["rssBytes"] - before["rssBytes"]
+    }
+
+
+# ---------------------------------------------------------------- corpus
+
+def wait_for_job(client, accepted):
+    """Long-poll the background job behind a 202 response until it finished"""
+    while True:
+        job = client.json("GET", f"/jobs/{accepted['jobId']}?wait=25")
+        if job["status"] not in ("queued", "running"):
+            return job
+
+def build_corpus(client, args, rng, watch_folder):
+    """Create folders of PDFs, snips and highlight exports through the API itself"""
+    corpus = {"folders": [], "pdfs": [], "snips": [], "highlights": [], "jobs": []}
+    pdf_pages = max(1, args.pdf_size // 50000)
+    for number in range(args.folders):
+        name = f"bench-{number:03d}"
+        files = [("files", f"doc-{index:04d}.pdf", make_pdf(rng, pdf_pages, args.pdf_size)) for index in range(args.pdfs)]
+        body, content_type = multipart([("folderName", name)], files)
+        accepted = client.json("POST", "/upload-folder", body, content_type=content_type)
+        corpus["jobs"].append(accepted["jobId"])
+        corpus["folders"].append({"name": name, "id": accepted["folderId"]})
+    for job_id in corpus["jobs"]:
+        wait_for_job(client, {"jobId": job_id})
+    for folder in corpus["folders"]:
+        for item in client.json("GET", f"/get-pdfs?folder={folder['name']}"):
+            corpus["pdfs"].append({"id": item["id"], "folder": folder["name"], "filename": item["filename"],
+                                   "sha256": item["sha256"]})
+
+    for number in range(args.snips):
+        folder = corpus["folders"][number % len(corpus["folders"])]["name"]
+        body, content_type = multipart(
+            [("folder", folder), ("title", f"snip {number} {rng.choice(WORDS)}"),
+             ("description", " ".join(rng.choice(WORDS) for _ in range(6))), ("timestamp", str(number))],
+            [("snip", f"snip-{number}.png", make_png(rng, 800, 450))]
+        )
+        corpus["snips"].append(client.json("POST", "/save-snip", body, content_type=content_type)["snip"]["id"])
+
+    for number in range(args.highlights):
+        pdf = corpus["pdfs"][number % len(corpus["pdfs"])]
+        highlights = [{"page": 1, "type": "highlight", "rects": [[72, 700 - 20 * n, 300, 714 - 20 * n]],
+                       "text": " ".join(rng.choice(WORDS) for _ in range(8))} for n in range(5)]
+        saved = client.json("POST", "/save-highlighted-pdf", {
+            "documentId": pdf["id"], "filename": f"highlight-{number}.pdf", "highlights": highlights,
+            "mode": "flatten" if number % 2 else "annotate"
+        })
+        corpus["highlights"].append(saved["id"])
+        corpus["jobs"].append(saved["jobId"])
+        wait_for_job(client, saved)
+
+    # Give background thumbnailing, indexing and snip transcoding a chance to settle
+    deadline = time.time() + args.settle
+    while time.time() < deadline:
+        snips = client.json("GET", "/get-snips")
+        if all(snip.get("image_status") != "pending" for snip in snips):
+            break
+        time.sleep(0.25)
+    os.makedirs(watch_folder, exist_ok=True)
+    corpus["changeSeq"] = client.json("GET", "/changes")["seq"]
+    return corpus
+
+
+# ---------------------------------------------------------------- scenarios
+
+def scenarios(corpus, rng, watch_folder, args):
+    """``(name, route rules, operation, request count)`` covering every route, writes after reads"""
+    pdfs, folders, snips, highlights = corpus["pdfs"], corpus["folders"], corpus["snips"], corpus["highlights"]
+    job_ids = corpus["jobs"]
+    change_seq = corpus["changeSeq"]
+    requests = args.requests
+    screenshot = make_png(rng, 1280, 720)
+    delta_pdfs = {}
+    delta_lock = threading.Lock()
+
+    def pick(items, i):
+        return items[i % len(items)]
+
+    def pdf_url(i):
+        pdf = pick(pdfs, i)
+        return f"/uploads/{pdf['folder']}/{pdf['filename']}"
+
+    def get(path_for):
+        return lambda client, worker, i: client.request("GET", path_for(i))
+
+    def serve_conditional(client, worker, i):
+        pdf = pick(pdfs, i)
+        client.request("GET", pdf_url(i), headers={"If-None-Match": f'"{pdf["sha256"]}"'})
+
+    def upload_pdf(client, worker, i):
+        body, content_type = multipart([("folder", pick(folders, i)["name"])],
+                                       [("file", f"upload-{worker}-{i}.pdf", make_pdf(random.Random(i), 1, args.pdf_size))])
+        client.request("POST", "/upload-pdf", body, content_type=content_type)
+
+    def chunked(client, worker, i):
+        data = make_pdf(random.Random(10_000 + i), 1, args.pdf_size)
+        session = client.json("POST", "/chunked-uploads", {
+            "kind": "pdf", "folder": pick(folders, i)["name"],
+            "files": [{"path": f"chunked-{worker}-{i}.pdf", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}]
+        })
+        upload_id = session["uploadId"]
+        entry = session["files"][0]
+        client.request("GET", f"/chunked-uploads/{upload_id}")
+        if not entry["deduplicated"]:
+            for offset in range(0, len(data), session["chunkSize"]):
+                client.request("PUT", f"/chunked-uploads/{upload_id}/files/{entry['fileId']}?offset={offset}",
+                               data[offset:offset + session["chunkSize"]], content_type="application/octet-stream")
+        client.request("POST", f"/chunked-uploads/{upload_id}/finalize")
+
+    def aborted_chunked(client, worker, i):
+        session = client.json("POST", "/chunked-uploads", {
+            "kind": "pdf", "folder": pick(folders, i)["name"],
+            "files": [{"path": f"aborted-{worker}-{i}.pdf", "size": 1024}]
+        })
+        client.request("DELETE", f"/chunked-uploads/{session['uploadId']}")
+
+    def local_path(url):
+        # Presigned URLs of the local backend name the default port
+        parts = urlsplit(url)
+        return f"{parts.path}?{parts.query}"
+
+    def direct_upload(client, worker, i):
+        data = make_pdf(random.Random(30_000 + i), 1, args.pdf_size)
+        upload = client.json("POST", "/direct-uploads", {
+            "folder": pick(folders, i)["name"], "path": f"direct-{worker}-{i}.pdf", "size": len(data),
+            "contentType": "application/pdf"
+        })
+        parts = []
+        for part in upload.get("parts", []):
+            body = data[(part["partNumber"] - 1) * upload["partSize"]:part["partNumber"] * upload["partSize"]]
+            client.request("PUT", local_path(part["url"]), body, content_type="application/octet-stream")
+            parts.append({"partNumber": part["partNumber"], "etag": f'"{hashlib.md5(body).hexdigest()}"'})
+        job = client.json("POST", f"/direct-uploads/{upload['uploadId']}/complete", {"parts": parts})
+        client.request("GET", f"/jobs/{job['jobId']}?wait=25")
+
+    def discarded_direct_upload(client, worker, i):
+        upload = client.json("POST", "/direct-uploads", {"path": f"discarded-{worker}-{i}.pdf", "size": 1024})
+        client.request("DELETE", f"/direct-uploads/{upload['uploadId']}")
+
+    def presigned_download(client, worker, i):
+        link = client.json("GET", f"/files/{pick(pdfs, i)['id']}/download-url")
+        client.request("GET", local_path(link["url"]))
+
+    def save_current(client, worker, i):
+        pdf = pick(pdfs, i)
+        body, content_type = multipart([("folder", pdf["folder"])],
+                                       [("pdf", pdf["filename"], make_pdf(random.Random(20_000 + i), 1, args.pdf_size))])
+        client.request("POST", "/save-current-pdf", body, content_type=content_type)
+
+    def save_delta(client, worker, i):
+        # Each client appends to its own document so saves do not conflict
+        pdf = pdfs[worker % len(pdfs)]
+        with delta_lock:
+            base = delta_pdfs.get(pdf["id"])
+        if base is None:
+            base = client.json("GET", f"/pdfs/{pdf['id']}/versions")["head"]
+            base = base["sha256"] if base else client.json("GET", f"/get-pdfs?folder={pdf['folder']}&prefix="
+                                                                f"{pdf['filename']}&limit=1")["items"][0]["sha256"]
+        delta = f"\n% edit {i}\n".encode() + b"%%EOF\n"
+        status, data = client.request("POST", f"/pdfs/{pdf['id']}/versions?base={base}&kind=append", delta,
+                                      content_type="application/octet-stream")
+        with delta_lock:
+            delta_pdfs[pdf["id"]] = json.loads(data)["sha256"] if status == 201 else None
+
+    def annotate(client, worker, i):
+        pdf = pick(pdfs, i)
+        client.request("POST", f"/documents/{pdf['id']}/annotations/batch", {"upsert": [
+            {"page": 1, "type": "highlight", "rects": [[72, 700, 300, 714]], "color": "#ffeb3b",
+             "text": rng.choice(WORDS)}
+        ]})
+
+    def save_snip(client, worker, i):
+        body, content_type = multipart(
+            [("folder", pick(folders, i)["name"]), ("title", f"load {worker}-{i}"), ("timestamp", str(i))],
+            [("snip", "load.png", screenshot)]
+        )
+        client.request("POST", "/save-snip", body, content_type=content_type)
+
+    def save_highlight(client, worker, i):
+        pdf = pick(pdfs, i)
+        client.request("POST", "/save-highlighted-pdf", {
+            "documentId": pdf["id"], "filename": f"load-{worker}-{i}.pdf",
+            "highlights": [{"page": 1, "type": "highlight", "rects": [[72, 700, 300, 714]], "text": "load"}]
+        })
+
+    def snip_job(events):
+        def operation(client, worker, i):
+            body, content_type = multipart([("folder", pick(folders, i)["name"])])
+            job = client.json("POST", "/start-snip", body, content_type=content_type)
+            with open(os.path.join(watch_folder, f"Screenshot {uuid.uuid4().hex}.png"), "wb") as f:
+                f.write(screenshot)
+            if events:
+                client.request("GET", f"/snip-jobs/{job['jobId']}/events")
+            else:
+                client.request("GET", f"/snip-jobs/{job['jobId']}?wait=10")
+        return operation
+
+    def upload_folder(client, worker, i):
+        files = [("files", f"doc-{index}.pdf", make_pdf(random.Random(30_000 + i * 3 + index), 1, args.pdf_size))
+                 for index in range(3)]
+        body, content_type = multipart([("folderName", f"load-{worker}-{i}")], files)
+        client.request("POST", "/upload-folder", body, content_type=content_type)
+
+    def retitle_snips(client, worker, i):
+        client.request("POST", "/snips/batch", {"operations": [
+            {"op": "retitle", "id": pick(snips, i * 10 + n), "title": f"batch {worker}-{i}-{n} {word(n)}"} for n in range(10)
+        ]})
+
+    def rename_file(client, worker, i):
+        # Rename and rename back, so later scenarios still find the file
+        pdf = pick(pdfs, i)
+        for name in (f"renamed-{worker}-{i}.pdf", pdf["filename"].rsplit("/", 1)[-1]):
+            client.request("POST", "/files/batch", {"operations": [{"op": "retitle", "id": pdf["id"], "name": name}]})
+
+    def rename_folder(client, worker, i):
+        folder = pick(folders, i)
+        for name in (f"renamed-{worker}-{i}", folder["name"]):
+            client.request("POST", "/folders/batch", {"operations": [{"op": "retitle", "id": folder["id"], "name": name}]})
+
+    def archive_folder(client, worker, i):
+        # Pack the last folder into cold storage and wait, so the cold read scenario finds it archived
+        job = client.json("POST", f"/folders/{folders[-1]['id']}/archive")
+        client.request("GET", f"/jobs/{job['jobId']}?wait=25")
+
+    cold_pdfs = [pdf for pdf in pdfs if pdf["folder"] == folders[-1]["name"]] if folders else []
+
+    def trash_restore(client, worker, i):
+        # Delete and undo a snip the delete scenarios keep
+        snip = snips[i % max(1, len(snips) // 2)]
+        result = client.json("POST", "/snips/batch", {"operations": [{"op": "delete", "id": snip}]})["results"][0]
+        if result["status"] == 200:
+            client.request("POST", f"/trash/{result['trashId']}/restore")
+
+    trash_entries = []
+
+    def trash_purge(client, worker, i):
+        with delta_lock:
+            if not trash_entries:
+                trash_entries.extend(entry["id"] for entry in client.json("GET", "/trash"))
+        if trash_entries:
+            client.request("DELETE", f"/trash/{pick(trash_entries, i)}")
+
+    def delete_snips(client, worker, i):
+        client.request("POST", "/snips/batch", {"operations": [
+            {"op": "delete", "id": snip} for snip in snips[len(snips) // 2:][i * 10:(i + 1) * 10]
+        ]})
+
+    def delete_snip(client, worker, i):
+        client.request("DELETE", f"/delete-snip/{snips[i]}")
+
+    def delete_folder(client, worker, i):
+        client.request("DELETE", f"/delete-folder/{folders[i]['id']}")
+
+    word = lambda i: WORDS[i % len(WORDS)]
+    return [
+        ("get-folders", "/get-folders", get(lambda i: "/get-folders"), requests),
+        ("get-folders-page", "/get-folders", get(lambda i: "/get-folders?limit=50&sort=size"), requests),
+        ("get-pdfs", "/get-pdfs", get(lambda i: f"/get-pdfs?folder={pick(folders, i)['name']}"), requests),
+        ("get-pdfs-page", "/get-pdfs", get(lambda i: f"/get-pdfs?folder={pick(folders, i)['name']}&limit=20&fields=id,filename"), requests),
+        ("get-snips", "/get-snips", get(lambda i: "/get-snips"), requests),
+        ("get-snips-page", "/get-snips", get(lambda i: "/get-snips?limit=50&sort=date&order=desc"), requests),
+        ("get-snips-compressed", "/get-snips",
+         lambda client, worker, i: client.request("GET", "/get-snips", headers={"Accept-Encoding": "zstd, br, gzip"}),
+         requests),
+        ("get-pdfs-compressed", "/get-pdfs",
+         lambda client, worker, i: client.request("GET", f"/get-pdfs?folder={pick(folders, i)['name']}",
+                                                  headers={"Accept-Encoding": "gzip"}), requests),
+        ("get-highlighted-pdfs", "/get-highlighted-pdfs", get(lambda i: "/get-highlighted-pdfs"), requests),
+        ("serve-pdf", "/uploads/<path:folder>/<path:filename>", get(pdf_url), requests),
+        ("serve-pdf-range", "/uploads/<path:folder>/<path:filename>",
+         lambda client, worker, i: client.request("GET", pdf_url(i), headers={"Range": "bytes=0-65535"}), requests),
+        ("serve-pdf-conditional", "/uploads/<path:folder>/<path:filename>", serve_conditional, requests),
+        ("serve-root-file", "/uploads/<path:filename>", get(lambda i: "/uploads/missing.pdf"), requests),
+        ("page-thumbnail", "/pdfs/<file_id>/pages/<int:page>/thumb",
+         get(lambda i: f"/pdfs/{pick(pdfs, i)['id']}/pages/1/thumb"), requests),
+        ("snip-thumb", "/snips/<snip_id>/image/<rendition>", get(lambda i: f"/snips/{pick(snips, i)}/image/thumb"), requests),
+        ("snip-display", "/snips/<snip_id>/image/<rendition>",
+         lambda client, worker, i: client.request("GET", f"/snips/{pick(snips, i)}/image/display",
+                                                  headers={"Accept": "image/avif,image/webp,*/*"}), requests),
+        ("download-highlighted-pdf", "/download-highlighted-pdf/<highlighted_pdf_id>",
+         get(lambda i: f"/download-highlighted-pdf/{pick(highlights, i)}"), requests),
+        ("search", "/search", get(lambda i: f"/search?q={word(i)}"), requests),
+        ("search-folder", "/search", get(lambda i: f"/search?q={word(i)}&folder={pick(folders, i)['name']}&kind=pdf"), requests),
+        ("annotations-get", "/documents/<document_id>/annotations",
+         get(lambda i: f"/documents/{pick(pdfs, i)['id']}/annotations?pages=1-3"), requests),
+        ("versions-list", "/pdfs/<file_id>/versions", get(lambda i: f"/pdfs/{pick(pdfs, i)['id']}/versions"), requests),
+        ("pdf-original", "/pdfs/<file_id>/original", get(lambda i: f"/pdfs/{pick(pdfs, i)['id']}/original"), requests),
+        ("download-url", "/files/<file_id>/download-url",
+         get(lambda i: f"/files/{pick(pdfs, i)['id']}/download-url"), requests),
+        ("presigned-download", ("/files/<file_id>/download-url", "/objects/<path:key>"), presigned_download, requests),
+        ("metrics", "/metrics", get(lambda i: "/metrics"), requests),
+        ("changes", "/changes", get(lambda i: f"/changes?since={(i * 97) % max(1, change_seq)}&limit=100"), requests),
+        ("change-events", "/changes/events",
+         get(lambda i: f"/changes/events?since={max(0, change_seq - 100)}&timeout=0"), requests),
+        ("job-status", "/jobs/<job_id>", get(lambda i: f"/jobs/{pick(job_ids, i)}"), requests),
+        ("jobs-list", "/jobs", get(lambda i: "/jobs?limit=50"), requests),
+        ("job-cancel-finished", "/jobs/<job_id>",
+         lambda client, worker, i: client.request("DELETE", f"/jobs/{pick(job_ids, i)}"), requests),
+        ("export-folder", "/export/folder/<folder_id>",
+         get(lambda i: f"/export/folder/{pick(folders, i)['id']}"), max(1, requests // 10)),
+        ("annotations-batch", "/documents/<document_id>/annotations/batch", annotate, requests),
+        ("save-pdf-delta", "/pdfs/<file_id>/versions", save_delta, requests),
+        ("version-download", "/pdfs/<file_id>/versions/<int:version>",
+         get(lambda i: f"/pdfs/{pick(pdfs, i)['id']}/versions/1"), requests),
+        ("save-current-pdf", "/save-current-pdf", save_current, requests),
+        ("upload-pdf", "/upload-pdf", upload_pdf, requests),
+        ("upload-folder", "/upload-folder", upload_folder, max(1, requests // 10)),
+        ("chunked-upload", ("/chunked-uploads", "/chunked-uploads/<upload_id>", "/chunked-uploads/<upload_id>/files/<file_id>",
+                            "/chunked-uploads/<upload_id>/finalize"), chunked, max(1, requests // 4)),
+        ("chunked-upload-abort", "/chunked-uploads/<upload_id>", aborted_chunked, max(1, requests // 4)),
+        ("direct-upload", ("/direct-uploads", "/objects/<path:key>", "/direct-uploads/<upload_id>/complete"),
+         direct_upload, max(1, requests // 4)),
+        ("direct-upload-discard", ("/direct-uploads", "/direct-uploads/<upload_id>"), discarded_direct_upload,
+         max(1, requests // 4)),
+        ("save-snip", "/save-snip", save_snip, requests),
+        ("save-highlighted-pdf", "/save-highlighted-pdf", save_highlight, requests),
+        ("snip-job-long-poll", ("/start-snip", "/snip-jobs/<job_id>"), snip_job(False), max(1, requests // 10)),
+        ("snip-job-events", ("/start-snip", "/snip-jobs/<job_id>/events"), snip_job(True), max(1, requests // 10)),
+        ("snips-batch-retitle", "/snips/batch", retitle_snips, requests),
+        ("files-batch-rename", "/files/batch", rename_file, max(1, requests // 4)),
+        ("folders-batch-rename", "/folders/batch", rename_folder, max(1, requests // 10)),
+        ("archive-folder", "/folders/<folder_id>/archive", archive_folder, 1),
+        ("serve-cold-pdf", "/uploads/<path:folder>/<path:filename>",
+         get(lambda i: f"/uploads/{pick(cold_pdfs, i)['folder']}/{pick(cold_pdfs, i)['filename']}"), requests),
+        ("trash-restore", ("/snips/batch", "/trash/<entry_id>/restore"), trash_restore, max(1, requests // 4)),
+        ("delete-snips-batch", "/snips/batch", delete_snips, max(1, (len(snips) - len(snips) // 2 + 9) // 10)),
+        ("delete-snip", "/delete-snip/<snip_id>", delete_snip, len(snips) // 2),
+        ("delete-folder", "/delete-folder/<folder_id>", delete_folder, len(folders)),
+        ("trash-list", "/trash", get(lambda i: "/trash"), requests),
+        ("trash-purge", "/trash/<entry_id>", trash_purge, max(1, requests // 10)),
+    ]
+
+
+# ---------------------------------------------------------------- main
+
+def compare(results, baseline_path):
+    """Print the change in p95 latency and throughput against an earlier result file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["scenarios"]
+    print(f"{'scenario':<28}{'p95 ms':>12}{'change':>10}{'req/s':>12}{'change':>10}", file=sys.stderr)
+    for name, current in results["scenarios"].items():
+        before = baseline.get(name)
+        p95 = current["latencyMs"]["p95"]
+        rate = current["throughputPerSecond"]
+        p95_change = f"{(p95 / before['latencyMs']['p95'] - 1) * 100:+.1f}%" \
+            if before and p95 and before["latencyMs"]["p95"] else "n/a"
+        rate_change = f"{(rate / before['throughputPerSecond'] - 1) * 100:+.1f}%" \
+            if before and rate and before["throughputPerSecond"] else "n/a"
+        print(f"{name:<28}{p95 or 0:>12.2f}{p95_change:>10}{rate or 0:>12.1f}{rate_change:>10}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every backend route against a synthetic corpus")
+    parser.add_argument("--folders", type=int, default=4, help="Folders in the corpus")
+    parser.add_argument("--pdfs", type=int, default=25, help="PDFs per folder")
+    parser.add_argument("--pdf-size", type=int, default=200_000, help="Approximate bytes per PDF")
+    parser.add_argument("--snips", type=int, default=40, help="Snips in the corpus")
+    parser.add_argument("--highlights", type=int, default=20, help="Highlight exports in the corpus")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent connections per scenario")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before each scenario")
+    parser.add_argument("--threads", type=int, default=16, help="Server worker threads")
+    parser.add_argument("--settle", type=float, default=30, help="Seconds to wait for background processing of the corpus")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic corpus")
+    parser.add_argument("--only", help="Comma separated scenario names to run")
+    parser.add_argument("--output", default="-", help="Result file (JSON); - for stdout")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary upload folder")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's log output")
+    args = parser.parse_args()
+    if args.folders < 1 or args.pdfs < 1 or args.snips < 1 or args.highlights < 1:
+        parser.error("The corpus needs at least one folder, PDF, snip and highlight")
+
+    # Paths given on the command line are relative to where the benchmark was started
+    cwd = os.getcwd()
+    args.output = args.output if args.output == "-" else os.path.abspath(args.output)
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = tempfile.mkdtemp(prefix="indinfra-bench-")
+    watch_folder = os.path.join(workdir, "screenshots")
+    os.makedirs(watch_folder)
+    # The app keeps uploads/ and its catalog relative to the working directory
+    os.environ["CATALOG_DB"] = os.path.join(workdir, "catalog.db")
+    os.environ["SNIP_WATCH_FOLDERS"] = watch_folder
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    # The app's prints go to a file; background workers may still print after the run, so stdout stays
+    # redirected.  The JSON access log writes to stderr and is turned off unless --verbose is given
+    stdout = sys.stdout
+    sys.stdout = sys.stderr if args.verbose else open(os.path.join(workdir, "app.log"), "w", buffering=1)
+    if not args.verbose:
+        os.environ.setdefault("BACKEND_ACCESS_LOG", "0")
+
+    try:
+        from waitress import create_server
+        from app import app
+
+        server = create_server(app, host="127.0.0.1", port=0, threads=args.threads,
+                               connection_limit=args.clients * 4 + 100, channel_timeout=120)
+        threading.Thread(target=server.run, daemon=True).start()
+        port = server.effective_port
+        rng = random.Random(args.seed)
+
+        print(f"🏗️ Building corpus in {workdir}", file=sys.stderr)
+        setup_client = Client(port)
+        started = time.perf_counter()
+        corpus = build_corpus(setup_client, args, rng, watch_folder)
+        build_seconds = time.perf_counter() - started
+        setup_client.close()
+
+        results = {
+            "meta": {
+                "startedAt": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpuCount": os.cpu_count(),
+                "arguments": {key: value for key, value in vars(args).items()
+                              if key not in ("output", "baseline", "keep", "verbose")}
+            },
+            "corpus": {
+                "folders": len(corpus["folders"]), "pdfs": len(corpus["pdfs"]), "snips": len(corpus["snips"]),
+                "highlights": len(corpus["highlights"]), "buildSeconds": round(build_seconds, 3),
+                "uploadBytes": sum(os.path.getsize(os.path.join(root, name))
+                                   for root, _, names in os.walk(os.path.join(workdir, "uploads", ".blobs"))
+                                   for name in names)
+            },
+            "scenarios": {}
+        }
+
+        selected = set(args.only.split(",")) if args.only else None
+        covered = set()
+        for name, rules, operation, count in scenarios(corpus, rng, watch_folder, args):
+            rules = (rules,) if isinstance(rules, str) else rules
+            covered.update(rules)
+            if selected is not None and name not in selected:
+                continue
+            print(f"⏱️ {name} ({count} requests)", file=sys.stderr)
+            results["scenarios"][name] = {"routes": list(rules), **run_scenario(
+                port, operation, count, min(args.clients, count), 0 if name.startswith("delete-") else args.warmup
+            )}
+
+        results["process"] = process_counters()
+        results["uncoveredRoutes"] = sorted(
+            rule.rule for rule in app.url_map.iter_rules() if rule.endpoint != "static" and rule.rule not in covered
+        )
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, result in results["scenarios"].items():
+        latency = result["latencyMs"]
+        print(f"{name:<28} p50 {latency['p50'] or 0:>9.2f} ms  p95 {latency['p95'] or 0:>9.2f} ms  "
+              f"p99 {latency['p99'] or 0:>9.2f} ms  {result['throughputPerSecond'] or 0:>8.1f} req/s"
+              f"{'  ' + str(result['errors']) + ' errors' if result['errors'] else ''}", file=sys.stderr)
+    if args.baseline:
+        compare(results, args.baseline)
+
+    output = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(output, file=stdout)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"📄 Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+import os
+import uuid
+import shutil
+import hashlib
+from datetime import datetime
+
+import catalog
+import metrics
+import compression
+
+COPY_BUFFER_SIZE = 1024 * 1024
+# Blobs unlinked per catalog transaction when collecting garbage
+GC_BATCH_SIZE = 500
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_blobs_refcount ON blobs (refcount);
+
+    CREATE TABLE IF NOT EXISTS file_refs (
+        path TEXT PRIMARY KEY,
+        id TEXT,
+        folder TEXT NOT NULL,
+        hash TEXT NOT NULL REFERENCES blobs (hash),
+        size INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_file_refs_folder ON file_refs (folder);
+    CREATE INDEX IF NOT EXISTS idx_file_refs_hash ON file_refs (hash);
+"""
+
+UPLOAD_ROOT = None
+BLOB_FOLDER = None
+
+_restorer = None
+_collected_hooks = []
+
+
+def init_blob_store(upload_root):
+    """Create the blob tables and the sharded blob directory under the upload root"""
+    global UPLOAD_ROOT, BLOB_FOLDER
+    UPLOAD_ROOT = upload_root
+    BLOB_FOLDER = os.path.join(upload_root, ".blobs")
+    os.makedirs(os.path.join(BLOB_FOLDER, "tmp"), exist_ok=True)
+    conn = catalog.get_connection()
+    conn.executescript(SCHEMA)
+    # Stable file ids survive overwrites, so URLs built on them stay valid
+    catalog.add_missing_columns("file_refs", (("id", "TEXT"),))
+    conn.execute("UPDATE file_refs SET id = lower(hex(randomblob(16))) WHERE id IS NULL")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_file_refs_id ON file_refs (id)")
+
+
+def blob_path(blob_hash):
+    """Location of a blob, sharded two levels deep as ab/cd/abcd..."""
+    return os.path.join(BLOB_FOLDER, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+
+def set_restorer(restorer):
+    """Register ``restorer(blob_hash)``, which brings back the bytes of a blob kept outside the store"""
+    global _restorer
+    _restorer = restorer
+
+
+def on_collected(hook):
+    """Register ``hook(hashes)``, called with the blobs ``collect_garbage`` deleted"""
+    _collected_hooks.append(hook)
+
+
+def readable_path(blob_hash):
+    """Location of a blob for reading, restored first if its bytes were moved out (e.g. archived)"""
+    path = blob_path(blob_hash)
+    if _restorer is not None and not os.path.exists(path):
+        _restorer(blob_hash)
+    return path
+
+
+def ref_key(file_path):
+    """Catalog key of a file: its path relative to the upload root with forward slashes"""
+    return os.path.relpath(file_path, UPLOAD_ROOT).replace(os.sep, "/")
+
+
+def _folder_of(key):
+    return key.split("/", 1)[0] if "/" in key else ""
+
+
+def hash_stream(stream):
+    """SHA-256 and length of a binary stream, read from its current position"""
+    digest = hashlib.sha256()
+    size = 0
+    for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b""):
+        digest.update(block)
+        size += len(block)
+    return digest.hexdigest(), size
+
+
+def has_blob(blob_hash, size):
+    """True when a blob with this hash and size is already stored"""
+    row = catalog.get_connection().execute(
+        "SELECT size FROM blobs WHERE hash = ?", (blob_hash,)
+    ).fetchone()
+    return row is not None and row["size"] == size and os.path.exists(blob_path(blob_hash))
+
+
+def lookup(file_path):
+    """Return the blob reference of a stored file as ``{"id", "hash", "size"}``, or None"""
+    row = catalog.get_connection().execute(
+        "SELECT id, hash, size FROM file_refs WHERE path = ?", (ref_key(file_path),)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def lookup_id(file_id):
+    """Return ``{"id", "path", "hash", "size"}`` for a stored file id, or None"""
+    row = catalog.get_connection().execute(
+        "SELECT id, path, hash, size FROM file_refs WHERE id = ?", (file_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def refs_in_folder(folder=None):
+    """Map of ref key to ``{"id", "hash"}`` for a top-level folder, or for every stored file"""
+    conn = catalog.get_connection()
+    if folder is None:
+        rows = conn.execute("SELECT path, id, hash FROM file_refs")
+    else:
+        rows = conn.execute("SELECT path, id, hash FROM file_refs WHERE folder = ?", (folder,))
+    return {row["path"]: {"id": row["id"], "hash": row["hash"]} for row in rows}
+
+
+def is_referenced(blob_hash):
+    """True while any file still points at this blob"""
+    row = catalog.get_connection().execute(
+        "SELECT 1 FROM file_refs WHERE hash = ? LIMIT 1", (blob_hash,)
+    ).fetchone()
+    return row is not None
+
+
+def _unpin(blob_hash):
+    with catalog.transaction() as conn:
+        conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", (blob_hash,))
+
+
+def _pin(blob_hash, size):
+    """Count one more reference to a blob before it is linked anywhere"""
+    with catalog.transaction() as conn:
+        conn.execute(
+            "INSERT INTO blobs (hash, size, refcount, created_at) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT (hash) DO UPDATE SET refcount = refcount + 1",
+            (blob_hash, size, datetime.now().isoformat())
+        )
+
+
+def _write_blob(blob_hash, source):
+    """Place the blob's bytes on disk from a stream or by consuming a staged file"""
+    target = blob_path(blob_hash)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if isinstance(source, str):
+        os.replace(source, target)
+        return
+    temp_path = staging_path()
+    source.seek(0)
+    with open(temp_path, "wb") as f:
+        shutil.copyfileobj(source, f, COPY_BUFFER_SIZE)
+        metrics.BYTES_WRITTEN.inc(f.tell(), kind="upload")
+    os.replace(temp_path, target)
+
+
+def _link(blob_hash, size, file_path, expected_hash=None):
+    """Point ``file_path`` at a pinned blob and record the reference, releasing any previous one
+
+    With ``expected_hash`` the path is only replaced while it still holds
+    that content; otherwise ``FileExistsError`` is raised and nothing changes.
+    Returns the file id and the hash the path referenced before, if any.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(blob_path(blob_hash), temp_path)
+    except OSError:
+        # Filesystems without hard links get a private copy instead
+        shutil.copyfile(blob_path(blob_hash), temp_path)
+
+    key = ref_key(file_path)
+    try:
+        with catalog.transaction() as conn:
+            previous = conn.execute("SELECT id, hash FROM file_refs WHERE path = ?", (key,)).fetchone()
+            if expected_hash is not None and (previous is None or previous["hash"] != expected_hash):
+                raise FileExistsError(f"{key} no longer holds {expected_hash}")
+            # Replace atomically so a shared inode is never truncated in place, and under the
+            # write lock so the file on disk and its row change in the same order for every writer
+            os.replace(temp_path, file_path)
+            file_id = previous["id"] if previous is not None else uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO file_refs (path, id, folder, hash, size, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, file_id, _folder_of(key), blob_hash, size, datetime.now().isoformat())
+            )
+            if previous is not None:
+                conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", (previous["hash"],))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return file_id, previous["hash"] if previous is not None else None
+
+
+def _precompress(blob_hash, file_path):
+    """Keep compressed variants next to text blobs so they are served without compressing per request"""
+    if not compression.is_text_name(file_path):
+        return
+    try:
+        compression.precompress(blob_path(blob_hash))
+    except OSError as e:
+        print(f"❌ Could not precompress {file_path}: {str(e)}")
+
+
+def put(source, file_path, sha256=None, expected_hash=None):
+    """Store ``source`` content-addressed and expose it at ``file_path``
+
+    ``source`` is a seekable binary stream or the path of a staged file,
+    which is consumed.  Bytes already in the store are never written again.
+    With ``expected_hash`` the file is only replaced if it still holds that
+    content (else ``FileExistsError``).  Returns the file id, hash and size,
+    whether the upload was deduplicated and the hash the path held before
+    (``previousHash``).
+    """
+    stored = store_blob(source, sha256)
+    try:
+        file_id, previous_hash = _link(stored["hash"], stored["size"], file_path, expected_hash)
+    except BaseException:
+        _unpin(stored["hash"])
+        raise
+    _precompress(stored["hash"], file_path)
+    return {"id": file_id, "hash": stored["hash"], "size": stored["size"],
+            "deduplicated": stored["deduplicated"], "previousHash": previous_hash}
+
+
+def store_blob(source, sha256=None):
+    """Store bytes that no file exposes, holding one reference until ``release_blob``
+
+    ``source`` is a seekable binary stream or a staged file path, which is
+    consumed.  Returns ``{"hash", "size", "deduplicated"}``.
+    """
+    if isinstance(source, str):
+        if sha256 is None:
+            with open(source, "rb") as f:
+                sha256, size = hash_stream(f)
+        else:
+            size = os.path.getsize(source)
+    else:
+        sha256, size = hash_stream(source)
+
+    _pin(sha256, size)
+    try:
+        deduplicated = os.path.exists(readable_path(sha256))
+        if deduplicated:
+            metrics.BLOB_DEDUPLICATED_BYTES.inc(size)
+            if isinstance(source, str):
+                os.remove(source)
+        else:
+            _write_blob(sha256, source)
+    except BaseException:
+        _unpin(sha256)
+        raise
+    return {"hash": sha256, "size": size, "deduplicated": deduplicated}
+
+
+def retain_blob(blob_hash):
+    """Hold one more reference to a stored blob so it outlives the files that expose it"""
+    row = catalog.get_connection().execute("SELECT size FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+    if row is None:
+        raise FileNotFoundError(f"Blob {blob_hash} is not stored")
+    _pin(blob_hash, row["size"])
+
+
+def release_blob(blob_hash):
+    """Drop a reference taken by ``store_blob`` or ``retain_blob``"""
+    _unpin(blob_hash)
+
+
+def staging_path():
+    """A fresh temp path on the blob store's filesystem, for staging bytes before ``put``"""
+    return os.path.join(BLOB_FOLDER, "tmp", str(uuid.uuid4()))
+
+
+def put_existing(blob_hash, file_path, expected_hash=None):
+    """Expose an already stored blob at ``file_path`` without receiving its bytes
+
+    ``expected_hash`` makes the replacement conditional, as for ``put``.
+    """
+    row = catalog.get_connection().execute("SELECT size FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+    if row is None or not os.path.exists(readable_path(blob_hash)):
+        raise FileNotFoundError(f"Blob {blob_hash} is not stored")
+    _pin(blob_hash, row["size"])
+    try:
+        file_id, previous_hash = _link(blob_hash, row["size"], file_path, expected_hash)
+    except BaseException:
+        _unpin(blob_hash)
+        raise
+    _precompress(blob_hash, file_path)
+    return {"id": file_id, "hash": blob_hash, "size": row["size"], "deduplicated": True,
+            "previousHash": previous_hash}
+
+
+def remove(file_path):
+    """Delete a stored file and drop its blob reference"""
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    key = ref_key(file_path)
+    with catalog.transaction() as conn:
+        row = conn.execute("SELECT hash FROM file_refs WHERE path = ?", (key,)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM file_refs WHERE path = ?", (key,))
+            conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", (row["hash"],))
+
+
+def move(file_path, new_path):
+    """Repoint a stored file's reference after it was renamed on disk; its id and blob stay the same"""
+    key, new_key = ref_key(file_path), ref_key(new_path)
+    with catalog.transaction() as conn:
+        conn.execute("UPDATE file_refs SET path = ?, folder = ? WHERE path = ?", (new_key, _folder_of(new_key), key))
+
+
+def move_folder(folder, new_folder):
+    """Repoint every reference of a top-level folder after the folder was renamed on disk"""
+    with catalog.transaction() as conn:
+        conn.execute(
+            "UPDATE file_refs SET path = ? || substr(path, ?), folder = ? WHERE folder = ?",
+            (new_folder, len(folder) + 1, new_folder, folder)
+        )
+
+
+def release_folder(folder):
+    """Drop every blob reference held by a top-level folder (its files are removed by the caller)"""
+    with catalog.transaction() as conn:
+        counts = conn.execute(
+            "SELECT hash, COUNT(*) AS n FROM file_refs WHERE folder = ? GROUP BY hash", (folder,)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE blobs SET refcount = refcount - ? WHERE hash = ?", [(row["n"], row["hash"]) for row in counts]
+        )
+        conn.execute("DELETE FROM file_refs WHERE folder = ?", (folder,))
+
+
+def reconcile_refs(on_adopted=None, absent=None):
+    """Adopt files placed under the upload root without the store and drop refs to vanished files
+
+    Internal directories (names starting with a dot) and in-flight temp
+    files are skipped.  ``on_adopted(file_path, stored)`` is called for each
+    adopted file, and refs for which ``absent(key)`` is true are kept
+    although their file is missing.  Returns ``(adopted, dropped)`` counts.
+    """
+    known = {row["path"] for row in catalog.get_connection().execute("SELECT path FROM file_refs")}
+    adopted = 0
+    metrics.DISK_WALKS.inc(caller="reconcile_refs")
+    for root, dirs, files in os.walk(UPLOAD_ROOT):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for file in files:
+            file_path = os.path.join(root, file)
+            key = ref_key(file_path)
+            if key in known or file.endswith(".tmp"):
+                known.discard(key)
+                continue
+            try:
+                stored = put(file_path, file_path)
+                adopted += 1
+                if on_adopted is not None:
+                    on_adopted(file_path, stored)
+            except OSError as e:
+                print(f"❌ Could not adopt {file_path}: {str(e)}")
+
+    # Whatever is left in ``known`` was not found on disk
+    dropped = 0
+    for key in known:
+        if not os.path.exists(os.path.join(UPLOAD_ROOT, key)) and not (absent and absent(key)):
+            remove(os.path.join(UPLOAD_ROOT, key))
+            dropped += 1
+    if adopted or dropped:
+        print(f"🔁 Blob store reconciled: {adopted} files adopted, {dropped} missing files dropped")
+        collect_garbage()
+    return adopted, dropped
+
+
+def collect_garbage():
+    """Delete blobs that no file references any more; returns the bytes freed
+
+    Files are unlinked while the catalog write lock is held, so a concurrent
+    ``store_blob`` either pins the blob first (and it is kept) or finds it
+    gone and writes it again.
+    """
+    collected = []
+    freed = 0
+    while True:
+        with catalog.transaction() as conn:
+            orphans = conn.execute("SELECT hash, size FROM blobs WHERE refcount <= 0 LIMIT ?",
+                                   (GC_BATCH_SIZE,)).fetchall()
+            for row in orphans:
+                conn.execute("DELETE FROM blobs WHERE hash = ?", (row["hash"],))
+                try:
+                    os.remove(blob_path(row["hash"]))
+                    freed += row["size"]
+                except FileNotFoundError:
+                    pass
+                compression.remove_variants(blob_path(row["hash"]))
+        collected.extend(row["hash"] for row in orphans)
+        if len(orphans) < GC_BATCH_SIZE:
+            break
+    if collected:
+        print(f"🧹 Removed {len(collected)} unreferenced blobs ({freed} bytes)")
+        for hook in _collected_hooks:
+            hook(collected)
+    return freed
@@ -0,0 +1,447 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+# SQLite catalog that holds folder, snip and highlighted PDF metadata
+CATALOG_DB = os.environ.get("CATALOG_DB", "catalog.db")
+
+# Legacy whole-file JSON stores, imported once on first start
+LEGACY_FOLDERS_FILE = "folders_metadata.json"
+LEGACY_SNIPS_FILE = "snips_metadata.json"
+LEGACY_HIGHLIGHTED_PDFS_FILE = "highlighted_pdfs_metadata.json"
+
+SNIP_FIELDS = ("id", "title", "description", "timestamp", "filename", "folder",
+               "file_path", "created_at", "url")
+HIGHLIGHTED_PDF_FIELDS = ("id", "filename", "folder", "highlights", "created_at",
+                          "file_path", "original_pdf", "highlighted_content")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS folders (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        path TEXT NOT NULL,
+        upload_date TEXT NOT NULL,
+        file_count INTEGER NOT NULL DEFAULT 0,
+        pdf_count INTEGER NOT NULL DEFAULT 0,
+        total_bytes INTEGER NOT NULL DEFAULT 0,
+        last_modified TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_folders_name ON folders (name);
+    CREATE INDEX IF NOT EXISTS idx_folders_upload_date ON folders (upload_date);
+
+    CREATE TABLE IF NOT EXISTS snips (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL DEFAULT '',
+        timestamp TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        folder TEXT NOT NULL DEFAULT '',
+        file_path TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        url TEXT NOT NULL,
+        width INTEGER,
+        height INTEGER,
+        size INTEGER,
+        renditions TEXT NOT NULL DEFAULT '{}',
+        image_status TEXT NOT NULL DEFAULT 'pending'
+    );
+    CREATE INDEX IF NOT EXISTS idx_snips_folder_created ON snips (folder, created_at);
+    CREATE INDEX IF NOT EXISTS idx_snips_created ON snips (created_at);
+    CREATE INDEX IF NOT EXISTS idx_snips_title ON snips (title);
+
+    CREATE TABLE IF NOT EXISTS highlighted_pdfs (
+        id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        highlights TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        original_pdf TEXT NOT NULL DEFAULT '',
+        highlighted_content TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS idx_highlighted_pdfs_folder_created ON highlighted_pdfs (folder, created_at);
+    CREATE INDEX IF NOT EXISTS idx_highlighted_pdfs_created ON highlighted_pdfs (created_at);
+    CREATE INDEX IF NOT EXISTS idx_highlighted_pdfs_filename ON highlighted_pdfs (filename);
+"""
+
+# Columns added after the first release, applied to existing catalogs on start
+ADDED_COLUMNS = {
+    "folders": (
+        ("file_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("pdf_count", "INTEGER NOT NULL DEFAULT 0"),
+        ("total_bytes", "INTEGER NOT NULL DEFAULT 0"),
+        ("last_modified", "TEXT"),
+    ),
+    "snips": (
+        ("width", "INTEGER"),
+        ("height", "INTEGER"),
+        ("size", "INTEGER"),
+        ("renditions", "TEXT NOT NULL DEFAULT '{}'"),
+        ("image_status", "TEXT NOT NULL DEFAULT 'pending'"),
+    ),
+}
+
+_local = threading.local()
+_commit_listeners = []
+
+
+def get_connection():
+    """Return this thread's connection to the catalog database"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CATALOG_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Run a block of statements as one write transaction
+
+    Opened inside another transaction on the same thread it becomes a
+    savepoint of it, so helpers that write on their own can be combined
+    into one atomic batch and a failing part can be rolled back alone.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT nested")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO nested")
+            conn.execute("RELEASE nested")
+            raise
+        conn.execute("RELEASE nested")
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        metrics.CATALOG_TRANSACTIONS.inc(outcome="rollback")
+        raise
+    conn.execute("COMMIT")
+    metrics.CATALOG_TRANSACTIONS.inc(outcome="commit")
+    for listener in _commit_listeners:
+        listener()
+
+
+def on_commit(listener):
+    """Call ``listener()`` after every committed (outermost) transaction"""
+    _commit_listeners.append(listener)
+
+
+def init_catalog():
+    """Create the catalog tables and import the legacy JSON metadata files"""
+    conn = get_connection()
+    conn.executescript(SCHEMA)
+    for table, columns in ADDED_COLUMNS.items():
+        add_missing_columns(table, columns)
+    migrate_legacy_json()
+
+
+def add_missing_columns(table, columns):
+    """Add ``(name, definition)`` columns that an older catalog file does not have yet"""
+    conn = get_connection()
+    existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for column, definition in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _load_legacy_file(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return {}
+
+
+def migrate_legacy_json():
+    """Import records from the old JSON stores, then rename them so this runs once"""
+    folders = _load_legacy_file(LEGACY_FOLDERS_FILE)
+    snips = _load_legacy_file(LEGACY_SNIPS_FILE)
+    highlighted_pdfs = _load_legacy_file(LEGACY_HIGHLIGHTED_PDFS_FILE)
+
+    if folders is None and snips is None and highlighted_pdfs is None:
+        return
+
+    with transaction() as conn:
+        for folder_id, metadata in (folders or {}).items():
+            conn.execute(
+                "INSERT OR IGNORE INTO folders (id, name, path, upload_date) VALUES (?, ?, ?, ?)",
+                (folder_id, metadata["name"], metadata.get("path", ""), metadata["uploadDate"])
+            )
+        for snip in (snips or {}).values():
+            _insert_snip(conn, snip, replace=False)
+        for highlighted_pdf in (highlighted_pdfs or {}).values():
+            _insert_highlighted_pdf(conn, highlighted_pdf, replace=False)
+
+    for path, records in ((LEGACY_FOLDERS_FILE, folders),
+                          (LEGACY_SNIPS_FILE, snips),
+                          (LEGACY_HIGHLIGHTED_PDFS_FILE, highlighted_pdfs)):
+        if records is not None:
+            os.replace(path, path + ".migrated")
+            print(f"📦 Migrated {len(records)} records from {path} into {CATALOG_DB}")
+
+
+def iter_rows(table, sort_column, descending=False, where=(), after=None, limit=None, columns="*"):
+    """Lazily yield rows of ``table`` in ``(sort_column, id)`` keyset order
+
+    ``where`` is a sequence of ``(sql, params)`` filters and ``after`` the
+    ``(sort_value, id)`` pair of the last row of the previous page, so every
+    page costs an index seek instead of an OFFSET scan.
+    """
+    clauses = [sql for sql, _ in where]
+    params = [param for _, group in where for param in group]
+    if after is not None:
+        clauses.append(f"({sort_column}, id) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+    sql = f"SELECT {columns} FROM {table}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    direction = "DESC" if descending else "ASC"
+    sql += f" ORDER BY {sort_column} {direction}, id {direction}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return get_connection().execute(sql, params)
+
+
+def prefix_filter(column, prefix):
+    """Index-friendly ``column LIKE 'prefix%'`` as a range, for use with ``iter_rows``"""
+    return f"{column} >= ? AND {column} < ?", (prefix, prefix + "\U0010ffff")
+
+
+# ---------------------------------------------------------------- folders
+
+def folder_from_row(row):
+    """Public form of a folder row"""
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "path": row["path"],
+        "uploadDate": row["upload_date"],
+        "fileCount": row["file_count"],
+        "pdfCount": row["pdf_count"],
+        "totalBytes": row["total_bytes"],
+        "lastModified": row["last_modified"]
+    }
+
+
+def add_folder(folder_id, name, path, upload_date, stats=None):
+    """Insert a folder record along with its initial file aggregates"""
+    stats = stats or {}
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO folders (id, name, path, upload_date, file_count, pdf_count, total_bytes, last_modified) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (folder_id, name, path, upload_date, stats.get("fileCount", 0), stats.get("pdfCount", 0),
+             stats.get("totalBytes", 0), stats.get("lastModified", upload_date))
+        )
+
+
+def get_folder(folder_id):
+    """Return a folder record by id, or None"""
+    row = get_connection().execute("SELECT * FROM folders WHERE id = ?", (folder_id,)).fetchone()
+    return folder_from_row(row) if row else None
+
+
+def list_folders():
+    """Return all folder records, oldest upload first"""
+    rows = get_connection().execute("SELECT * FROM folders ORDER BY upload_date")
+    return [folder_from_row(row) for row in rows]
+
+
+def list_unscanned_folders():
+    """Return folder records whose aggregates have never been computed"""
+    rows = get_connection().execute("SELECT * FROM folders WHERE last_modified IS NULL")
+    return [folder_from_row(row) for row in rows]
+
+
+def set_folder_stats(folder_id, stats):
+    """Overwrite a folder's file aggregates with freshly scanned values"""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE folders SET file_count = ?, pdf_count = ?, total_bytes = ?, last_modified = ? WHERE id = ?",
+            (stats["fileCount"], stats["pdfCount"], stats["totalBytes"], stats["lastModified"], folder_id)
+        )
+
+
+def record_file_change(folder, filename, old_size, new_size, modified_at):
+    """Apply one file write or removal to the owning folder's aggregates
+
+    ``old_size``/``new_size`` are None when the file did not exist before or
+    does not exist after the change.  Files outside any registered folder
+    are ignored.
+    """
+    folder_name = folder.replace("\\", "/").strip("/").split("/")[0]
+    if not folder_name:
+        return
+    file_delta = (new_size is not None) - (old_size is not None)
+    pdf_delta = file_delta if filename.lower().endswith(".pdf") else 0
+    byte_delta = (new_size or 0) - (old_size or 0)
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE folders SET file_count = file_count + ?, pdf_count = pdf_count + ?, "
+            "total_bytes = total_bytes + ?, last_modified = ? WHERE name = ?",
+            (file_delta, pdf_delta, byte_delta, modified_at, folder_name)
+        )
+
+
+def rename_folder(folder_id, name, path):
+    """Rename a folder record and repoint the snips and highlight exports stored under it"""
+    with transaction() as conn:
+        row = conn.execute("SELECT name, path FROM folders WHERE id = ?", (folder_id,)).fetchone()
+        if row is None:
+            return False
+        old_name, old_path = row["name"], row["path"]
+        conn.execute("UPDATE folders SET name = ?, path = ? WHERE id = ?", (name, path, folder_id))
+        subfolders, params = prefix_filter("folder", old_name + "/")
+        conn.execute(
+            f"UPDATE snips SET url = replace(url, ?, ?) WHERE folder = ? OR ({subfolders})",
+            (f"/uploads/{old_name}/", f"/uploads/{name}/", old_name, *params)
+        )
+        for table in ("snips", "highlighted_pdfs"):
+            conn.execute(
+                f"UPDATE {table} SET folder = ? || substr(folder, ?), file_path = CASE "
+                f"WHEN substr(file_path, 1, ?) = ? THEN ? || substr(file_path, ?) ELSE file_path END "
+                f"WHERE folder = ? OR ({subfolders})",
+                (name, len(old_name) + 1, len(old_path) + 1, old_path + os.sep, path, len(old_path) + 1,
+                 old_name, *params)
+            )
+    return True
+
+
+def delete_folder(folder_id):
+    """Remove a folder record, returning True if it existed"""
+    with transaction() as conn:
+        cursor = conn.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+    return cursor.rowcount > 0
+
+
+# ---------------------------------------------------------------- snips
+
+def _insert_snip(conn, snip, replace=True):
+    verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+    conn.execute(
+        f"{verb} INTO snips ({', '.join(SNIP_FIELDS)}) VALUES ({', '.join('?' * len(SNIP_FIELDS))})",
+        tuple(snip.get(field, "") for field in SNIP_FIELDS)
+    )
+
+
+def add_snip(snip):
+    """Insert or replace a snip record"""
+    with transaction() as conn:
+        _insert_snip(conn, snip)
+
+
+def snip_from_row(row):
+    """Public form of a (possibly partial) snip row"""
+    record = dict(row)
+    if "renditions" in record:
+        record["renditions"] = json.loads(record["renditions"])
+    return record
+
+
+def get_snip(snip_id):
+    """Return a snip record by id, or None"""
+    row = get_connection().execute("SELECT * FROM snips WHERE id = ?", (snip_id,)).fetchone()
+    return snip_from_row(row) if row else None
+
+
+def list_snips(folder=None):
+    """Return snip records, optionally limited to one folder, oldest first"""
+    conn = get_connection()
+    if folder:
+        rows = conn.execute("SELECT * FROM snips WHERE folder = ? ORDER BY created_at", (folder,))
+    else:
+        rows = conn.execute("SELECT * FROM snips ORDER BY created_at")
+    return [snip_from_row(row) for row in rows]
+
+
+def update_snip(snip_id, **fields):
+    """Change some fields of a snip record, returning True if it exists"""
+    unknown = set(fields) - set(SNIP_FIELDS) | set(fields) & {"id"}
+    if unknown:
+        raise ValueError(f"Cannot update snip fields {sorted(unknown)}")
+    with transaction() as conn:
+        cursor = conn.execute(
+            f"UPDATE snips SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?",
+            (*fields.values(), snip_id)
+        )
+    return cursor.rowcount > 0
+
+
+def set_snip_image(snip_id, status, width=None, height=None, size=None, renditions=None):
+    """Record the outcome of processing a snip's image; returns False if the snip is gone"""
+    with transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE snips SET image_status = ?, width = ?, height = ?, size = ?, renditions = ? WHERE id = ?",
+            (status, width, height, size, json.dumps(renditions or {}), snip_id)
+        )
+    return cursor.rowcount > 0
+
+
+def delete_snip(snip_id):
+    """Remove a snip record, returning True if it existed"""
+    with transaction() as conn:
+        cursor = conn.execute("DELETE FROM snips WHERE id = ?", (snip_id,))
+    return cursor.rowcount > 0
+
+
+# ---------------------------------------------------------------- highlighted PDFs
+
+def _insert_highlighted_pdf(conn, highlighted_pdf, replace=True):
+    verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+    values = dict(highlighted_pdf)
+    values["highlights"] = json.dumps(values.get("highlights", []))
+    conn.execute(
+        f"{verb} INTO highlighted_pdfs ({', '.join(HIGHLIGHTED_PDF_FIELDS)}) "
+        f"VALUES ({', '.join('?' * len(HIGHLIGHTED_PDF_FIELDS))})",
+        tuple(values.get(field, "") for field in HIGHLIGHTED_PDF_FIELDS)
+    )
+
+
+def highlighted_pdf_from_row(row):
+    """Public form of a (possibly partial) highlighted PDF row"""
+    record = dict(row)
+    if "highlights" in record:
+        record["highlights"] = json.loads(record["highlights"])
+    return record
+
+
+def add_highlighted_pdf(highlighted_pdf):
+    """Insert or replace a highlighted PDF record"""
+    with transaction() as conn:
+        _insert_highlighted_pdf(conn, highlighted_pdf)
+
+
+def get_highlighted_pdf(highlighted_pdf_id):
+    """Return a highlighted PDF record by id, or None"""
+    row = get_connection().execute(
+        "SELECT * FROM highlighted_pdfs WHERE id = ?", (highlighted_pdf_id,)
+    ).fetchone()
+    return highlighted_pdf_from_row(row) if row else None
+
+
+def list_highlighted_pdfs(folder=None):
+    """Return highlighted PDF records, optionally limited to one folder, oldest first"""
+    conn = get_connection()
+    if folder:
+        rows = conn.execute(
+            "SELECT * FROM highlighted_pdfs WHERE folder = ? ORDER BY created_at", (folder,)
+        )
+    else:
+        rows = conn.execute("SELECT * FROM highlighted_pdfs ORDER BY created_at")
+    return [highlighted_pdf_from_row(row) for row in rows]
@@ -0,0 +1,156 @@
+import os
+import time
+import threading
+
+import catalog
+
+# Changes are kept this long; clients further behind start again from a snapshot
+CHANGE_RETENTION = int(os.environ.get("CHANGE_RETENTION", 7 * 24 * 60 * 60))
+# Most sequence numbers a single read looks at, as a multiple of its limit
+SCAN_FACTOR = 10
+PRUNE_INTERVAL = 3600
+
+# Entity kind -> (table, folder column).  Every row written to these tables is
+# logged by the triggers below inside the writing transaction, so the log
+# cannot miss or invent a change and its sequence numbers follow commit order.
+ENTITIES = {
+    "folder": ("folders", "name"),
+    "file": ("file_refs", "folder"),
+    "snip": ("snips", "folder"),
+    "highlight": ("highlighted_pdfs", "folder"),
+}
+
+# ``seq`` is AUTOINCREMENT so numbers are never reused after pruning
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        op TEXT NOT NULL,
+        folder TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_changes_created ON changes (created_at);
+"""
+
+TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS changes_{table}_{suffix} AFTER {event} ON {table} WHEN {row}.id IS NOT NULL BEGIN
+        INSERT INTO changes (entity, ref, op, folder, created_at)
+        VALUES ('{entity}', {row}.id, '{op}', {row}.{column}, (julianday('now') - 2440587.5) * 86400.0);
+    END;
+"""
+
+_condition = threading.Condition()
+_last_prune = 0
+
+
+class ChangesExpired(Exception):
+    """The requested position is no longer (or not yet) in the log"""
+
+    def __init__(self, head):
+        super().__init__("Changes since this position are no longer available")
+        self.head = head
+
+
+def init_changes():
+    """Create the change log and its triggers, and wake streams on every commit"""
+    global _last_prune
+    script = SCHEMA
+    for entity, (table, column) in ENTITIES.items():
+        for suffix, event, row, op in (("ai", "INSERT", "new", "upsert"), ("au", "UPDATE", "new", "upsert"),
+                                       ("ad", "DELETE", "old", "delete")):
+            script += TRIGGER.format(table=table, suffix=suffix, event=event, row=row, entity=entity,
+                                     column=column, op=op)
+    catalog.get_connection().executescript(script)
+    prune()
+    _last_prune = time.time()
+    catalog.on_commit(_on_commit)
+
+
+def _on_commit():
+    global _last_prune
+    with _condition:
+        _condition.notify_all()
+    if time.time() - _last_prune > PRUNE_INTERVAL:
+        _last_prune = time.time()
+        try:
+            prune()
+        except Exception as e:
+            print(f"❌ Could not prune the change log: {str(e)}")
+
+
+def prune():
+    """Forget changes past the retention period"""
+    with catalog.transaction() as conn:
+        removed = conn.execute("DELETE FROM changes WHERE created_at < ?",
+                               (time.time() - CHANGE_RETENTION,)).rowcount
+    if removed:
+        print(f"🧹 Pruned {removed} change(s) from the log")
+
+
+def head():
+    """Sequence number of the latest change, 0 before the first"""
+    row = catalog.get_connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return row["seq"] if row else 0
+
+
+def floor():
+    """Oldest position a client can resume from without a new snapshot"""
+    row = catalog.get_connection().execute("SELECT MIN(seq) AS seq FROM changes").fetchone()
+    return row["seq"] - 1 if row["seq"] is not None else head()
+
+
+def wait(since, timeout):
+    """Block up to ``timeout`` seconds for a change after ``since``; returns the head"""
+    deadline = time.time() + timeout
+    while True:
+        current = head()
+        remaining = deadline - time.time()
+        if current > since or remaining <= 0:
+            return current
+        with _condition:
+            # Writes outside ``catalog.transaction`` do not notify, so wake up now and then
+            _condition.wait(min(remaining, 5))
+
+
+def read(since, limit):
+    """Changes after ``since``, one per entity, with the entity's current row
+
+    Returns ``{"changes", "seq", "head"}``: each change is ``{"seq", "entity",
+    "id", "op", "folder", "row"}`` with only the latest change of an entity
+    kept, and ``row`` is None for deletions.  Resume from ``seq``.  Raises
+    ``ChangesExpired`` when ``since`` was pruned or lies ahead of the log.
+    """
+    current = head()
+    if since > current or since < floor():
+        raise ChangesExpired(current)
+    upper = min(current, since + limit * SCAN_FACTOR)
+    conn = catalog.get_connection()
+    # SQLite takes the bare columns from the row holding MAX(seq)
+    rows = conn.execute(
+        "SELECT MAX(seq) AS seq, entity, ref, op, folder FROM changes WHERE seq > ? AND seq <= ? "
+        "GROUP BY entity, ref ORDER BY seq LIMIT ?", (since, upper, limit)
+    ).fetchall()
+    position = rows[-1]["seq"] if len(rows) == limit else upper
+
+    current_rows = {}
+    for entity, (table, _column) in ENTITIES.items():
+        refs = [row["ref"] for row in rows if row["entity"] == entity and row["op"] == "upsert"]
+        for start in range(0, len(refs), 500):
+            chunk = refs[start:start + 500]
+            for row in conn.execute(f"SELECT * FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk):
+                current_rows[(entity, row["id"])] = row
+
+    changes = []
+    for row in rows:
+        current_row = current_rows.get((row["entity"], row["ref"]))
+        changes.append({
+            "seq": row["seq"],
+            "entity": row["entity"],
+            "id": row["ref"],
+            # Deleted again after this change was logged; the delete follows later
+            "op": "upsert" if current_row is not None else "delete",
+            "folder": current_row[ENTITIES[row["entity"]][1]] if current_row is not None else row["folder"],
+            "row": current_row
+        })
+    return {"changes": changes, "seq": position, "head": current}
@@ -0,0 +1,265 @@
+import os
+import time
+import uuid
+import shutil
+from datetime import datetime, timedelta
+from werkzeug.security import safe_join
+
+import blob_store
+import catalog
+import metrics
+
+# Largest body accepted for a single PUT chunk
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Chunk size suggested to clients when a session is created
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# How long a PUT may hold a file before another request can take it over
+CHUNK_LEASE_SECONDS = 300
+# Unfinished sessions older than this are discarded on start
+SESSION_TTL = timedelta(days=1)
+COPY_BUFFER_SIZE = 1024 * 1024
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_upload_sessions_created ON upload_sessions (created_at);
+
+    CREATE TABLE IF NOT EXISTS upload_files (
+        id TEXT PRIMARY KEY,
+        upload_id TEXT NOT NULL REFERENCES upload_sessions (id) ON DELETE CASCADE,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT,
+        received INTEGER NOT NULL DEFAULT 0,
+        lease_until REAL,
+        deduplicated INTEGER NOT NULL DEFAULT 0,
+        retained INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_upload_files_upload ON upload_files (upload_id);
+"""
+
+STAGING_FOLDER = None
+
+
+class ChunkedUploadError(Exception):
+    """Raised for protocol errors; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def init_chunked_uploads(upload_root):
+    """Create the session tables and staging area, discarding expired sessions"""
+    global STAGING_FOLDER
+    STAGING_FOLDER = os.path.join(upload_root, ".chunked")
+    os.makedirs(STAGING_FOLDER, exist_ok=True)
+    catalog.get_connection().executescript(SCHEMA)
+    # ``retained`` marks deduplicated files whose blob the session holds a reference on
+    catalog.add_missing_columns("upload_files", (("deduplicated", "INTEGER NOT NULL DEFAULT 0"),
+                                                 ("retained", "INTEGER NOT NULL DEFAULT 0")))
+
+    cutoff = (datetime.now() - SESSION_TTL).isoformat()
+    expired = [row["id"] for row in catalog.get_connection().execute(
+        "SELECT id FROM upload_sessions WHERE created_at < ?", (cutoff,)
+    )]
+    for upload_id in expired:
+        discard_upload(upload_id)
+
+
+def _staged_path(upload_id, file_id):
+    return os.path.join(STAGING_FOLDER, upload_id, file_id)
+
+
+def _clean_relative_path(path):
+    """Normalise a client supplied relative path, rejecting anything that escapes the folder"""
+    path = (path or "").replace("\\", "/").strip()
+    if not path or path.startswith("/") or safe_join("/", path) is None:
+        raise ChunkedUploadError(f"Invalid file path: {path!r}")
+    return path
+
+
+def init_upload(kind, folder, files):
+    """Open an upload session for a list of ``{"path", "size", "sha256"}`` file entries"""
+    if kind not in ("folder", "pdf"):
+        raise ChunkedUploadError("Upload kind must be 'folder' or 'pdf'")
+    if kind == "folder" and not folder:
+        raise ChunkedUploadError("No folder name provided")
+    if not files:
+        raise ChunkedUploadError("No files provided")
+
+    upload_id = str(uuid.uuid4())
+    entries = []
+    for entry in files:
+        size = entry.get("size")
+        if not isinstance(size, int) or size < 0:
+            raise ChunkedUploadError(f"Invalid size for {entry.get('path')!r}")
+        sha256 = (entry.get("sha256") or "").lower() or None
+        entries.append([str(uuid.uuid4()), _clean_relative_path(entry.get("path")), size, sha256, False])
+
+    os.makedirs(os.path.join(STAGING_FOLDER, upload_id), exist_ok=True)
+    with catalog.transaction() as conn:
+        # Content the blob store already holds is acknowledged without a transfer; the
+        # session holds a reference on it until it is discarded, so it cannot be collected
+        for entry in entries:
+            if entry[3] and blob_store.has_blob(entry[3], entry[2]):
+                blob_store.retain_blob(entry[3])
+                entry[4] = True
+        conn.execute(
+            "INSERT INTO upload_sessions (id, kind, folder, created_at) VALUES (?, ?, ?, ?)",
+            (upload_id, kind, folder, datetime.now().isoformat())
+        )
+        conn.executemany(
+            "INSERT INTO upload_files (id, upload_id, path, size, sha256, received, deduplicated, retained) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(file_id, upload_id, path, size, sha256, size if deduplicated else 0, int(deduplicated),
+              int(deduplicated))
+             for file_id, path, size, sha256, deduplicated in entries]
+        )
+    # Create empty staging files up front so zero-byte files need no PUT
+    for file_id, _, _, _, deduplicated in entries:
+        if not deduplicated:
+            open(_staged_path(upload_id, file_id), "wb").close()
+
+    return get_upload(upload_id)
+
+
+def get_upload(upload_id):
+    """Return a session with each file's acknowledged offset, used by clients to resume"""
+    conn = catalog.get_connection()
+    session = conn.execute("SELECT * FROM upload_sessions WHERE id = ?", (upload_id,)).fetchone()
+    if session is None:
+        raise ChunkedUploadError("Upload not found", 404)
+    files = conn.execute(
+        "SELECT id, path, size, sha256, received, deduplicated FROM upload_files WHERE upload_id = ? ORDER BY rowid",
+        (upload_id,)
+    )
+    return {
+        "uploadId": session["id"],
+        "kind": session["kind"],
+        "folder": session["folder"],
+        "createdAt": session["created_at"],
+        "chunkSize": DEFAULT_CHUNK_SIZE,
+        "files": [
+            {"fileId": row["id"], "path": row["path"], "size": row["size"],
+             "sha256": row["sha256"], "offset": row["received"], "deduplicated": bool(row["deduplicated"])}
+            for row in files
+        ]
+    }
+
+
+def write_chunk(upload_id, file_id, offset, length, stream):
+    """Stream one chunk from ``stream`` into the staged file at ``offset``
+
+    A chunk must start at the file's acknowledged offset; anything else is
+    answered with 409 and the offset to resume from.  Chunks for different
+    files of a session may be written in parallel.
+    """
+    if length is None:
+        raise ChunkedUploadError("Content-Length is required", 411)
+    if length > MAX_CHUNK_SIZE:
+        raise ChunkedUploadError(f"Chunk larger than {MAX_CHUNK_SIZE} bytes", 413)
+
+    conn = catalog.get_connection()
+    row = conn.execute(
+        "SELECT size, received, deduplicated FROM upload_files WHERE id = ? AND upload_id = ?",
+        (file_id, upload_id)
+    ).fetchone()
+    if row is None:
+        raise ChunkedUploadError("Upload file not found", 404)
+    if row["deduplicated"]:
+        raise ChunkedUploadError("File content is already stored; no chunks needed", 409, offset=row["received"])
+    if offset != row["received"]:
+        raise ChunkedUploadError("Offset does not match the acknowledged offset", 409, offset=row["received"])
+    if offset + length > row["size"]:
+        raise ChunkedUploadError("Chunk extends past the declared file size", 416, offset=row["received"])
+
+    # Take a short lease on the file so two requests never write it at once
+    now = time.time()
+    with catalog.transaction() as conn:
+        claimed = conn.execute(
+            "UPDATE upload_files SET lease_until = ? WHERE id = ? AND received = ? "
+            "AND (lease_until IS NULL OR lease_until < ?)",
+            (now + CHUNK_LEASE_SECONDS, file_id, offset, now)
+        ).rowcount
+    if not claimed:
+        raise ChunkedUploadError("Another chunk for this file is in progress", 409, offset=row["received"])
+
+    written = 0
+    try:
+        with open(_staged_path(upload_id, file_id), "r+b") as f:
+            # Drop bytes from an earlier chunk that was never acknowledged
+            f.truncate(offset)
+            f.seek(offset)
+            while written < length:
+                block = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        metrics.BYTES_WRITTEN.inc(written, kind="chunk")
+        new_offset = offset + written if written == length else offset
+        with catalog.transaction() as conn:
+            conn.execute(
+                "UPDATE upload_files SET received = ?, lease_until = NULL WHERE id = ?", (new_offset, file_id)
+            )
+
+    if written != length:
+        raise ChunkedUploadError("Chunk body ended early", 400, offset=offset)
+    return new_offset
+
+
+def finalize_upload(upload_id):
+    """Verify every file is complete and matches its hash
+
+    Returns the session along with one ``{"path", "stagedPath", "sha256"}``
+    entry per file for the caller to move into place (``stagedPath`` is None
+    for deduplicated files); call ``discard_upload`` afterwards.
+    """
+    session = get_upload(upload_id)
+    incomplete = [f["path"] for f in session["files"] if f["offset"] != f["size"]]
+    if incomplete:
+        raise ChunkedUploadError("Some files are incomplete", 409, incomplete=incomplete)
+
+    mismatched = []
+    staged = []
+    for entry in session["files"]:
+        if entry["deduplicated"]:
+            staged.append({"path": entry["path"], "stagedPath": None, "sha256": entry["sha256"]})
+            continue
+        staged_path = _staged_path(upload_id, entry["fileId"])
+        with open(staged_path, "rb") as f:
+            sha256, _ = blob_store.hash_stream(f)
+        if entry["sha256"] and sha256 != entry["sha256"]:
+            mismatched.append(entry["path"])
+        staged.append({"path": entry["path"], "stagedPath": staged_path, "sha256": sha256})
+    if mismatched:
+        # Force a re-send of the corrupted files
+        with catalog.transaction() as conn:
+            conn.executemany(
+                "UPDATE upload_files SET received = 0 WHERE upload_id = ? AND path = ?",
+                [(upload_id, path) for path in mismatched]
+            )
+        raise ChunkedUploadError("Hash mismatch", 422, mismatched=mismatched)
+    return session, staged
+
+
+def discard_upload(upload_id):
+    """Forget a finished or cancelled session, dropping its blob references and staged bytes"""
+    with catalog.transaction() as conn:
+        held = [row["sha256"] for row in conn.execute(
+            "SELECT sha256 FROM upload_files WHERE upload_id = ? AND retained = 1", (upload_id,)
+        ).fetchall()]
+        conn.execute("DELETE FROM upload_sessions WHERE id = ?", (upload_id,))
+        for sha256 in held:
+            blob_store.release_blob(sha256)
+    shutil.rmtree(os.path.join(STAGING_FOLDER, upload_id), ignore_errors=True)
+
@@ -0,0 +1,216 @@
+import os
+import uuid
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # br is offered only with the brotli package
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstd is offered only with the zstandard package
+    zstandard = None
+
+# Responses smaller than this are sent as they are
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+# Per-request compression favours speed; stored artifacts are compressed once, as small as possible
+DYNAMIC_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+STORED_LEVELS = {"zstd": 19, "br": 11, "gzip": 9}
+# Preferred first when a client accepts several encodings equally
+PREFERENCE = ("zstd", "br", "gzip")
+# Precompressed variants sit next to their blob with these suffixes
+SUFFIXES = {"zstd": ".zst", "br": ".br", "gzip": ".gz"}
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# PDFs, images and archives are already compressed and never go through here
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/xml", "application/x-ndjson",
+                      "image/svg+xml")
+# Stored files with these extensions get precompressed variants
+TEXT_EXTENSIONS = (".html", ".htm", ".txt", ".md", ".csv", ".tsv", ".json", ".xml", ".svg", ".css", ".js", ".log")
+
+
+def available():
+    """Encodings this process can produce, in order of preference"""
+    installed = {"zstd": zstandard is not None, "br": brotli is not None, "gzip": True}
+    return [encoding for encoding in PREFERENCE if installed[encoding]]
+
+
+def negotiate(accept_encoding, offered=None):
+    """The best encoding the client accepts among ``offered`` (default: all available), or None"""
+    offered = available() if offered is None else offered
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+    best, best_weight = None, 0.0
+    for encoding in offered:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class _Compressor:
+    """Incremental compressor with the same two methods for every encoding"""
+
+    def __init__(self, encoding, level):
+        if encoding == "zstd":
+            self._stream = zstandard.ZstdCompressor(level=level).compressobj()
+            self._finish = self._stream.flush
+        elif encoding == "br":
+            self._stream = brotli.Compressor(quality=level)
+            self._finish = self._stream.finish
+        else:
+            self._stream = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self._finish = self._stream.flush
+        self._compress = self._stream.process if encoding == "br" else self._stream.compress
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def finish(self):
+        return self._finish()
+
+
+def compress_bytes(data, encoding, level=None):
+    compressor = _Compressor(encoding, DYNAMIC_LEVELS[encoding] if level is None else level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def _encoded(chunk):
+    return chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+def _compress_stream(head, chunks, source, encoding):
+    """Compress ``head`` then the rest of ``chunks``; ``source`` is the original iterable, closed at the end"""
+    compressor = _Compressor(encoding, DYNAMIC_LEVELS[encoding])
+    try:
+        data = compressor.compress(b"".join(head))
+        if data:
+            yield data
+        for chunk in chunks:
+            data = compressor.compress(_encoded(chunk))
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+
+
+def is_text_name(file_path):
+    return file_path.lower().endswith(TEXT_EXTENSIONS)
+
+
+def _compressible(mimetype):
+    return (mimetype.startswith("text/") and mimetype != "text/event-stream") or mimetype in COMPRESSIBLE_TYPES
+
+
+# ---------------------------------------------------------------- precompressed artifacts
+
+def precompress(path):
+    """Write compressed variants of a stored text file once, so serving it costs no CPU
+
+    Variants that would not save at least a tenth are not kept.
+    """
+    size = os.path.getsize(path)
+    if size < COMPRESSION_MIN_BYTES:
+        return
+    for encoding in available():
+        target = path + SUFFIXES[encoding]
+        if os.path.exists(target):
+            continue
+        temp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        compressor = _Compressor(encoding, STORED_LEVELS[encoding])
+        try:
+            with open(path, "rb") as source, open(temp_path, "wb") as out:
+                for block in iter(lambda: source.read(COPY_BUFFER_SIZE), b""):
+                    out.write(compressor.compress(block))
+                out.write(compressor.finish())
+            if os.path.getsize(temp_path) > size * 0.9:
+                os.remove(temp_path)
+                return
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def variant(path, accept_encoding):
+    """``(variant path, encoding)`` of the best precompressed variant the client accepts, or ``(None, None)``"""
+    stored = [encoding for encoding in available() if os.path.exists(path + SUFFIXES[encoding])]
+    encoding = negotiate(accept_encoding, stored) if stored else None
+    return (path + SUFFIXES[encoding], encoding) if encoding else (None, None)
+
+
+def remove_variants(path):
+    for suffix in SUFFIXES.values():
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+# ---------------------------------------------------------------- responses
+
+def init_app(app):
+    """Compress JSON and text responses of ``app`` with the best encoding the client accepts
+
+    Files (``send_file``) are left alone: text files are served from their
+    precompressed variants instead, and everything else is already
+    compressed.  Event streams are not compressed so every event is
+    delivered at once.
+    """
+    @app.after_request
+    def compress_response(response):
+        if response.status_code < 200 or response.status_code in (204, 206, 304) or request.method == "HEAD":
+            return response
+        if response.direct_passthrough or "Content-Encoding" in response.headers or not _compressible(response.mimetype):
+            return response
+        # Content-hash ETags name the uncompressed bytes
+        if "ETag" in response.headers:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(request.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            # Read up to the threshold first: a stream that ends before it is sent as is
+            source = response.response
+            chunks = iter(source)
+            head, size = [], 0
+            for chunk in chunks:
+                head.append(_encoded(chunk))
+                size += len(head[-1])
+                if size >= COMPRESSION_MIN_BYTES:
+                    break
+            else:
+                response.set_data(b"".join(head))
+                close = getattr(source, "close", None)
+                if close is not None:
+                    close()
+                return response
+            response.response = _compress_stream(head, chunks, source, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < COMPRESSION_MIN_BYTES:
+                return response
+            response.set_data(compress_bytes(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
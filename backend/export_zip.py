@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import zipfile
+from datetime import datetime
+
+import annotations
+import blob_store
+import catalog
+
+READ_BUFFER_SIZE = 1024 * 1024
+# Formats that are already compressed are stored as is, so exports run at disk speed
+STORED_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".zip", ".gz", ".zst", ".br")
+# ZIP timestamps cannot predate 1980
+EARLIEST_ZIP_TIME = time.mktime((1980, 1, 1, 0, 0, 0, 0, 0, -1))
+
+
+class _ChunkBuffer:
+    """Write-only file object that collects what ZipFile writes until it is drained"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def _zip_info(arcname, size, mtime):
+    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(max(mtime, EARLIEST_ZIP_TIME))[:6])
+    zinfo.file_size = size  # Lets ZipFile pick ZIP64 headers for large members up front
+    zinfo.external_attr = 0o644 << 16
+    zinfo.compress_type = (
+        zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+    )
+    return zinfo
+
+
+def stream_zip(entries):
+    """Yield a ZIP archive chunk by chunk
+
+    ``entries`` is an iterable of ``(arcname, source)`` pairs where
+    ``source`` is a file path or ``bytes``.  Nothing is buffered beyond one
+    read block; sizes and CRCs follow each member in a data descriptor and
+    ZIP64 records are used as soon as sizes or offsets need them.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, "w", allowZip64=True) as archive:
+        for arcname, source in entries:
+            if isinstance(source, bytes):
+                with archive.open(_zip_info(arcname, len(source), time.time()), "w") as member:
+                    member.write(source)
+            else:
+                if not os.path.exists(source):
+                    # Files of archived folders are read back from the cold tier, one at a time
+                    stored = blob_store.lookup(source)
+                    source = blob_store.readable_path(stored["hash"]) if stored else source
+                try:
+                    stat = os.stat(source)
+                    f = open(source, "rb")
+                except OSError as e:
+                    print(f"❌ Skipping {source} in export: {str(e)}")
+                    continue
+                with f, archive.open(_zip_info(arcname, stat.st_size, stat.st_mtime), "w") as member:
+                    for block in iter(lambda: f.read(READ_BUFFER_SIZE), b""):
+                        member.write(block)
+                        yield from buffer.drain()
+            yield from buffer.drain()
+    # The central directory is written on close
+    yield from buffer.drain()
+
+
+def _folder_records(table, from_row, name):
+    """Catalog records of a folder and its subfolders"""
+    subfolders, params = catalog.prefix_filter("folder", name + "/")
+    rows = catalog.get_connection().execute(
+        f"SELECT * FROM {table} WHERE folder = ? OR ({subfolders}) ORDER BY created_at", (name, *params)
+    )
+    return [from_row(row) for row in rows]
+
+
+def folder_entries(folder, include_snips=True, include_highlights=True, include_manifest=True):
+    """Archive members for a folder record: its files, snips, highlight exports and a manifest
+
+    Paths inside the archive are relative to the folder; snips and highlight
+    exports are left out of the plain file list so each option controls them.
+    """
+    name = folder["name"]
+    root = os.path.abspath(os.path.join(blob_store.UPLOAD_ROOT, name))
+
+    def relative(file_path):
+        path = os.path.relpath(os.path.abspath(file_path), root)
+        return None if path.startswith("..") else path.replace(os.sep, "/")
+
+    snips = [snip for snip in _folder_records("snips", catalog.snip_from_row, name)
+             if snip.get("file_path") and relative(snip["file_path"])]
+    highlighted_pdfs = [record for record in _folder_records("highlighted_pdfs", catalog.highlighted_pdf_from_row, name)
+                        if record.get("file_path") and relative(record["file_path"])]
+    separate = {relative(record["file_path"]) for record in snips + highlighted_pdfs}
+
+    files = []
+    for row in catalog.get_connection().execute(
+        "SELECT id, path, hash, size FROM file_refs WHERE folder = ? ORDER BY path", (name,)
+    ):
+        file_path = os.path.join(blob_store.UPLOAD_ROOT, row["path"])
+        path = relative(file_path)
+        if path is not None and path not in separate:
+            files.append({"id": row["id"], "path": path, "source": file_path, "size": row["size"], "sha256": row["hash"]})
+
+    entries = []
+    if include_manifest:
+        manifest = {
+            "folder": {key: folder[key] for key in ("id", "name", "uploadDate", "fileCount", "totalBytes")},
+            "exportedAt": datetime.now().isoformat(),
+            "files": [
+                {"path": entry["path"], "size": entry["size"], "sha256": entry["sha256"],
+                 **({"annotations": annotations.list_annotations(entry["id"])}
+                    if entry["path"].lower().endswith(".pdf") else {})}
+                for entry in files
+            ]
+        }
+        if include_snips:
+            manifest["snips"] = [
+                {**{key: snip.get(key) for key in ("id", "title", "description", "timestamp", "created_at", "width", "height")},
+                 "path": relative(snip["file_path"])}
+                for snip in snips
+            ]
+        if include_highlights:
+            manifest["highlights"] = [
+                {**{key: record.get(key) for key in ("id", "filename", "original_pdf", "created_at", "highlights")},
+                 "path": relative(record["file_path"])}
+                for record in highlighted_pdfs
+            ]
+        entries.append(("manifest.json", json.dumps(manifest, indent=2).encode("utf-8")))
+
+    entries.extend((entry["path"], entry["source"]) for entry in files)
+    if include_snips:
+        entries.extend((relative(snip["file_path"]), snip["file_path"]) for snip in snips)
+    if include_highlights:
+        entries.extend((relative(record["file_path"]), record["file_path"]) for record in highlighted_pdfs)
+    return entries
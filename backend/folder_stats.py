@@ -0,0 +1,80 @@
+import os
+import threading
+from datetime import datetime
+
+import blob_store
+import catalog
+import metrics
+import tiering
+
+# Seconds between background reconcile passes (0 disables the reconciler)
+RECONCILE_INTERVAL = int(os.environ.get("FOLDER_STATS_RECONCILE_INTERVAL", "0"))
+
+
+def scan_folder(folder_path):
+    """Walk a folder on disk and compute its file aggregates"""
+    stats = {"fileCount": 0, "pdfCount": 0, "totalBytes": 0, "lastModified": None}
+    latest_mtime = 0
+    metrics.DISK_WALKS.inc(caller="folder_stats")
+    for root, dirs, files in os.walk(folder_path):
+        for file in files:
+            try:
+                file_stat = os.stat(os.path.join(root, file))
+            except OSError:
+                continue
+            stats["fileCount"] += 1
+            stats["totalBytes"] += file_stat.st_size
+            if file.lower().endswith(".pdf"):
+                stats["pdfCount"] += 1
+            latest_mtime = max(latest_mtime, file_stat.st_mtime)
+    if latest_mtime:
+        stats["lastModified"] = datetime.fromtimestamp(latest_mtime).isoformat()
+    return stats
+
+
+def reconcile(upload_root, folders=None):
+    """Recompute stored aggregates from disk to repair drift from out-of-band edits
+
+    Folders with archived files are skipped: part of their files is not on disk.
+    """
+    archived = tiering.archived_folders()
+    for folder in folders if folders is not None else catalog.list_folders():
+        if folder["name"] in archived:
+            continue
+        stats = scan_folder(os.path.join(upload_root, folder["name"]))
+        stats["lastModified"] = stats["lastModified"] or folder["uploadDate"]
+        drifted = any(stats[key] != folder[key] for key in ("fileCount", "pdfCount", "totalBytes"))
+        if drifted or folder["lastModified"] is None:
+            catalog.set_folder_stats(folder["id"], stats)
+            print(f"🔁 Reconciled stats for folder {folder['name']}: {stats}")
+
+
+def start_reconciler(upload_root, interval=RECONCILE_INTERVAL, on_adopted=None):
+    """Scan never-counted folders now and bring untracked files into the blob store
+
+    The blob store pass runs in the background since it may hash a lot of
+    existing data.  With a positive ``interval`` both passes repeat to pick
+    up out-of-band edits.
+    """
+    reconcile(upload_root, catalog.list_unscanned_folders())
+
+    def run():
+        first_pass = True
+        while True:
+            try:
+                blob_store.reconcile_refs(on_adopted, absent=tiering.is_archived_ref)
+                if not first_pass:
+                    reconcile(upload_root)
+            except Exception as e:
+                print(f"❌ Folder stats reconcile failed: {str(e)}")
+            first_pass = False
+            if interval <= 0:
+                return
+            stop.wait(interval)
+            if stop.is_set():
+                return
+
+    stop = threading.Event()
+    thread = threading.Thread(target=run, name="folder-stats-reconciler", daemon=True)
+    thread.start()
+    return stop
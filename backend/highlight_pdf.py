@@ -0,0 +1,252 @@
+import os
+import json
+import math
+import time
+import hashlib
+import threading
+
+import annotations
+import blob_store
+import catalog
+import metrics
+import process_pool
+
+try:
+    import pymupdf
+except ImportError:  # Highlight exports need PyMuPDF
+    pymupdf = None
+
+# Processes writing highlighted pages (annotating and flattening are CPU bound)
+HIGHLIGHT_WORKERS = int(os.environ.get("HIGHLIGHT_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Documents up to this many pages are written by one process in one pass; longer
+# ones are split into page ranges of about this size and merged
+PAGES_PER_TASK = int(os.environ.get("HIGHLIGHT_PAGES_PER_TASK", "64"))
+# Upper bound for cached exports; least recently used entries go first
+HIGHLIGHT_CACHE_BYTES = int(os.environ.get("HIGHLIGHT_CACHE_BYTES", 1024 * 1024 * 1024))
+RENDER_TIMEOUT = 600
+
+MODES = ("annotate", "flatten")
+DEFAULT_COLOR = (1.0, 0.92, 0.23)
+
+# One row per rendered export, keyed by source content hash, annotation
+# version and mode.  Each row holds one reference on its output blob.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS highlight_renders (
+        key TEXT PRIMARY KEY,
+        source_hash TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_highlight_renders_last_access ON highlight_renders (last_access);
+"""
+
+_executor = None
+_lock = threading.Lock()
+
+
+def init_highlight_pdf():
+    """Create the render cache table"""
+    catalog.get_connection().executescript(SCHEMA)
+
+
+def available():
+    return pymupdf is not None
+
+
+def normalize(highlights):
+    """Validate client supplied highlight geometry; raises ``annotations.AnnotationError``"""
+    if not isinstance(highlights, list):
+        raise annotations.AnnotationError("highlights must be a list")
+    if len(highlights) > annotations.MAX_BATCH_SIZE:
+        raise annotations.AnnotationError(f"At most {annotations.MAX_BATCH_SIZE} highlights per export", 413)
+    normalized = []
+    for entry in highlights:
+        checked = annotations.validate(entry)
+        normalized.append({"page": checked["page"], "type": checked["type"], "rects": json.loads(checked["rects"]),
+                           "color": checked["color"], "text": checked["text"], "author": checked["author"]})
+    return normalized
+
+
+def inline_version(highlights):
+    """Stand-in annotation version for highlights sent with the request instead of stored"""
+    digest = hashlib.sha256(json.dumps(highlights, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"inline-{digest[:16]}"
+
+
+def stored_highlights(document):
+    """A document's stored annotations and the version they belong to, read consistently"""
+    while True:
+        version = annotations.document_version(document)
+        entries = annotations.list_annotations(document)
+        if annotations.document_version(document) == version:
+            return entries, version
+
+
+def _color(value):
+    if isinstance(value, str) and len(value) == 7 and value.startswith("#"):
+        try:
+            return tuple(int(value[i:i + 2], 16) / 255 for i in (1, 3, 5))
+        except ValueError:
+            pass
+    return DEFAULT_COLOR
+
+
+def _annotate(page, entries):
+    """Add one page's highlights as PDF annotations; rects are in PDF user space (origin bottom left)"""
+    for entry in entries:
+        rects = [pymupdf.Rect(rect) * page.transformation_matrix for rect in entry["rects"]]
+        rects = [rect for rect in rects if not rect.is_empty]
+        if not rects:
+            continue
+        if entry["type"] == "highlight":
+            annot = page.add_highlight_annot(rects)
+        elif entry["type"] == "underline":
+            annot = page.add_underline_annot(rects)
+        elif entry["type"] == "strikeout":
+            annot = page.add_strikeout_annot(rects)
+        elif entry["type"] == "note":
+            annot = page.add_text_annot(rects[0].tl, entry.get("text") or "")
+        else:
+            # Ink strokes are not stored as paths; their bounding boxes are framed
+            annot = page.add_rect_annot(_union(rects))
+        annot.set_colors(stroke=_color(entry.get("color")))
+        annot.set_info(content=entry.get("text") or "", title=entry.get("author") or "")
+        annot.update()
+
+
+def _union(rects):
+    union = pymupdf.Rect(rects[0])
+    for rect in rects[1:]:
+        union |= rect
+    return union
+
+
+def render_pages(source_path, pages, highlights, mode, output_path):
+    """Write highlighted pages as a PDF; runs inside a worker process
+
+    ``pages`` is a list of 1-based page numbers to keep, or None for the
+    whole document, and ``highlights`` maps page numbers to their entries.
+    """
+    with pymupdf.open(source_path) as doc:
+        numbers = pages or list(range(1, doc.page_count + 1))
+        if pages is not None:
+            doc.select([number - 1 for number in pages])
+        for index, number in enumerate(numbers):
+            if highlights.get(number):
+                _annotate(doc[index], highlights[number])
+        if mode == "flatten":
+            # Draw the annotations into the page content so every viewer shows them
+            doc.bake(annots=True, widgets=False)
+        doc.save(output_path, garbage=3, deflate=True)
+    return os.path.getsize(output_path)
+
+
+def _merge(parts, source_path, output_path):
+    """Join page range parts in order, keeping the source's metadata and outline"""
+    with pymupdf.open() as out:
+        for part in parts:
+            with pymupdf.open(part) as doc:
+                out.insert_pdf(doc)
+        with pymupdf.open(source_path) as source:
+            out.set_metadata(source.metadata)
+            try:
+                out.set_toc(source.get_toc(simple=False))
+            except Exception as e:
+                print(f"❌ Could not carry the outline into a highlight export: {str(e)}")
+        out.save(output_path, garbage=4, deflate=True)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = process_pool.new_executor(HIGHLIGHT_WORKERS)
+        return _executor
+
+
+def _render(source_path, highlights, mode, output_path):
+    """Write the export, splitting long documents into page ranges rendered in parallel"""
+    by_page = {}
+    for entry in highlights:
+        by_page.setdefault(entry["page"], []).append(entry)
+    with pymupdf.open(source_path) as doc:
+        page_count = doc.page_count
+    tasks = max(1, math.ceil(page_count / PAGES_PER_TASK))
+    executor = _get_executor()
+    if tasks == 1:
+        executor.submit(render_pages, source_path, None, by_page, mode, output_path).result(timeout=RENDER_TIMEOUT)
+        return
+
+    size = math.ceil(page_count / tasks)
+    ranges = [list(range(first, min(first + size, page_count + 1))) for first in range(1, page_count + 1, size)]
+    parts = [f"{output_path}.{index}.part" for index in range(len(ranges))]
+    try:
+        futures = [
+            executor.submit(render_pages, source_path, pages, {n: by_page[n] for n in pages if n in by_page}, mode, part)
+            for pages, part in zip(ranges, parts)
+        ]
+        for future in futures:
+            future.result(timeout=RENDER_TIMEOUT)
+        _merge(parts, source_path, output_path)
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+
+def export(source_hash, version, highlights, mode="annotate"):
+    """Blob hash of the source with ``highlights`` applied, rendered once per (source, version, mode)
+
+    The caller gets no blob reference of its own; expose the result with
+    ``blob_store.put_existing``.
+    """
+    key = f"{source_hash}_{version}_{mode}"
+    row = catalog.get_connection().execute("SELECT hash FROM highlight_renders WHERE key = ?", (key,)).fetchone()
+    if row is not None and os.path.exists(blob_store.blob_path(row["hash"])):
+        with catalog.transaction() as conn:
+            conn.execute("UPDATE highlight_renders SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row["hash"]
+
+    started = time.perf_counter()
+    output_path = blob_store.staging_path()
+    try:
+        _render(blob_store.readable_path(source_hash), highlights, mode, output_path)
+        metrics.BYTES_WRITTEN.inc(os.path.getsize(output_path), kind="highlight")
+        stored = blob_store.store_blob(output_path)
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    with catalog.transaction() as conn:
+        previous = conn.execute("SELECT hash FROM highlight_renders WHERE key = ?", (key,)).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO highlight_renders (key, source_hash, hash, size, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, source_hash, stored["hash"], stored["size"], time.time())
+        )
+    if previous is not None:
+        blob_store.release_blob(previous["hash"])
+    print(f"🖍️ Rendered {len(highlights)} highlights ({mode}) onto {source_hash[:12]} "
+          f"in {time.perf_counter() - started:.2f}s: {stored['size']} bytes")
+    evict()
+    return stored["hash"]
+
+
+def evict(limit=HIGHLIGHT_CACHE_BYTES):
+    """Drop least recently used exports until the cache is below 90% of ``limit``"""
+    conn = catalog.get_connection()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM highlight_renders").fetchone()[0]
+    if total <= limit:
+        return
+    target = limit * 0.9
+    victims = []
+    for row in conn.execute("SELECT key, hash, size FROM highlight_renders ORDER BY last_access").fetchall():
+        if total <= target:
+            break
+        victims.append(row)
+        total -= row["size"]
+    with catalog.transaction() as conn:
+        conn.executemany("DELETE FROM highlight_renders WHERE key = ?", [(row["key"],) for row in victims])
+        for row in victims:
+            blob_store.release_blob(row["hash"])
+    # Exports still exposed in a folder keep their bytes
+    blob_store.collect_garbage()
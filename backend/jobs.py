@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from datetime import datetime
+
+import catalog
+
+# Worker threads running queued jobs; CPU heavy work inside them already goes to process pools
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Attempts before a failing job is given up, and the first retry delay (doubled per attempt)
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", "2"))
+JOB_RETRY_DELAY_MAX = 300
+# Finished jobs are kept this long for status requests
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", 7 * 24 * 60 * 60))
+# Idle workers look for delayed retries this often
+POLL_INTERVAL = 1.0
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+# One row per job.  ``payload`` and ``result`` are JSON; ``run_after`` (epoch
+# seconds) delays retries.  Rows that were running when the process stopped
+# are queued again on the next start.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'queued',
+        priority INTEGER NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        run_after REAL NOT NULL DEFAULT 0,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        progress TEXT,
+        result TEXT,
+        error TEXT,
+        created_at TEXT NOT NULL,
+        started_at TEXT,
+        finished_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority DESC, run_after, created_at);
+"""
+
+JOBS_FOLDER = None
+
+_handlers = {}
+_abandon_handlers = {}
+_condition = threading.Condition()
+_started = False
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler by ``Job.check_cancelled`` once cancellation was requested"""
+
+
+class Job:
+    """What a handler gets: the job's id and payload, a scratch directory and progress reporting"""
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.payload = json.loads(row["payload"])
+        self.attempt = row["attempts"]
+
+    @property
+    def directory(self):
+        """Files staged for this job; removed once the job is finished"""
+        return job_directory(self.id)
+
+    def progress(self, done, total=None):
+        with catalog.transaction() as conn:
+            conn.execute("UPDATE jobs SET progress = ? WHERE id = ?",
+                         (json.dumps({"done": done, "total": total}), self.id))
+
+    def check_cancelled(self):
+        row = catalog.get_connection().execute(
+            "SELECT cancel_requested FROM jobs WHERE id = ?", (self.id,)
+        ).fetchone()
+        if row is None or row["cancel_requested"]:
+            raise JobCancelled()
+
+
+def init_jobs(upload_root):
+    """Create the job table and queue again whatever was running when the process stopped"""
+    global JOBS_FOLDER
+    JOBS_FOLDER = os.path.join(upload_root, ".jobs")
+    os.makedirs(JOBS_FOLDER, exist_ok=True)
+    conn = catalog.get_connection()
+    conn.executescript(SCHEMA)
+    with catalog.transaction() as conn:
+        requeued = conn.execute(
+            "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+        ).rowcount
+    if requeued:
+        print(f"♻️ Requeued {requeued} interrupted job(s)")
+    _prune()
+
+
+def job_directory(job_id):
+    return os.path.join(JOBS_FOLDER, job_id)
+
+
+def register(kind, handler, on_abandoned=None):
+    """Run jobs of ``kind`` with ``handler(job)``; its return value is stored as the result
+
+    ``on_abandoned(job)`` runs once when such a job is cancelled (queued or
+    running) or fails its last attempt, to undo what was set up for it.
+    """
+    _handlers[kind] = handler
+    if on_abandoned is not None:
+        _abandon_handlers[kind] = on_abandoned
+
+
+def job_from_row(row):
+    """Public form of a job row"""
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "priority": row["priority"],
+        "attempts": row["attempts"],
+        "maxAttempts": row["max_attempts"],
+        "progress": json.loads(row["progress"]) if row["progress"] else None,
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "cancelRequested": bool(row["cancel_requested"]),
+        "createdAt": row["created_at"],
+        "startedAt": row["started_at"],
+        "finishedAt": row["finished_at"]
+    }
+
+
+def new_job_id():
+    """An id to stage files under (see ``job_directory``) before the job is enqueued"""
+    return str(uuid.uuid4())
+
+
+def enqueue(kind, payload, priority=PRIORITY_NORMAL, max_attempts=JOB_MAX_ATTEMPTS, job_id=None):
+    """Persist a job and wake a worker; returns the job"""
+    job_id = job_id or new_job_id()
+    with catalog.transaction() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, payload, priority, max_attempts, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), priority, max_attempts, datetime.now().isoformat())
+        )
+    with _condition:
+        _condition.notify()
+    return get_job(job_id)
+
+
+def get_job(job_id, wait=0):
+    """Return a job, waiting up to ``wait`` seconds for it to finish"""
+    deadline = time.time() + wait
+    while True:
+        row = catalog.get_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        remaining = deadline - time.time()
+        if row["status"] in FINISHED or remaining <= 0:
+            return job_from_row(row)
+        with _condition:
+            _condition.wait(min(remaining, POLL_INTERVAL))
+
+
+def list_jobs(status=None, kind=None, limit=100):
+    """Most recent jobs first, optionally filtered"""
+    sql = "SELECT * FROM jobs WHERE 1 = 1"
+    params = []
+    if status:
+        sql += " AND status = ?"
+        params.append(status)
+    if kind:
+        sql += " AND kind = ?"
+        params.append(kind)
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+    return [job_from_row(row) for row in catalog.get_connection().execute(sql, params)]
+
+
+def cancel(job_id):
+    """Cancel a queued job now, or ask a running one to stop at its next check; returns the job"""
+    now = datetime.now().isoformat()
+    with catalog.transaction() as conn:
+        dequeued = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ? "
+            "WHERE id = ? AND status = 'queued'", (now, job_id)
+        ).rowcount
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if dequeued:
+        _abandon(row)
+    job = get_job(job_id)
+    if job is not None and job["status"] == "cancelled":
+        _cleanup(job_id)
+    with _condition:
+        _condition.notify_all()
+    return job
+
+
+# ---------------------------------------------------------------- workers
+
+def start_workers(workers=JOB_WORKERS):
+    """Start the worker threads once per process"""
+    global _started
+    with _condition:
+        if _started:
+            return
+        _started = True
+    for number in range(workers):
+        threading.Thread(target=_work, name=f"job-worker-{number}", daemon=True).start()
+    print(f"🧵 Started {workers} job worker(s)")
+
+
+def _claim():
+    """Mark the most urgent due job as running and return it, or None"""
+    if not _handlers:
+        return None
+    kinds = list(_handlers)
+    with catalog.transaction() as conn:
+        row = conn.execute(
+            f"SELECT * FROM jobs WHERE status = 'queued' AND run_after <= ? "
+            f"AND kind IN ({', '.join('?' * len(kinds))}) ORDER BY priority DESC, created_at LIMIT 1",
+            (time.time(), *kinds)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+            (datetime.now().isoformat(), row["id"])
+        )
+        return conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+
+def _work():
+    last_prune = time.time()
+    while True:
+        try:
+            row = _claim()
+        except Exception as e:
+            print(f"❌ Could not claim a job: {str(e)}")
+            row = None
+        if row is None:
+            with _condition:
+                _condition.wait(POLL_INTERVAL)
+            if time.time() - last_prune > 3600:
+                last_prune = time.time()
+                _prune()
+            continue
+        _run(row)
+
+
+def _run(row):
+    job = Job(row)
+    try:
+        result = _handlers[job.kind](job)
+    except JobCancelled:
+        _abandon(row)
+        _finish(job.id, "cancelled")
+        print(f"🛑 Cancelled job {job.id} ({job.kind})")
+    except Exception as e:
+        if row["attempts"] < row["max_attempts"]:
+            delay = min(JOB_RETRY_DELAY * 2 ** (row["attempts"] - 1), JOB_RETRY_DELAY_MAX)
+            with catalog.transaction() as conn:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', run_after = ?, error = ? WHERE id = ?",
+                    (time.time() + delay, str(e), job.id)
+                )
+            print(f"🔁 Job {job.id} ({job.kind}) failed, retrying in {delay:.0f}s: {str(e)}")
+        else:
+            _abandon(row)
+            _finish(job.id, "failed", error=str(e))
+            print(f"❌ Job {job.id} ({job.kind}) failed: {str(e)}")
+    else:
+        _finish(job.id, "succeeded", result=result)
+        print(f"✅ Job {job.id} ({job.kind}) done")
+    with _condition:
+        _condition.notify_all()
+
+
+def _abandon(row):
+    """Run the kind's ``on_abandoned`` for a job that will not run again"""
+    handler = _abandon_handlers.get(row["kind"])
+    if handler is None:
+        return
+    try:
+        handler(Job(row))
+    except Exception as e:
+        print(f"❌ Could not clean up after job {row['id']} ({row['kind']}): {str(e)}")
+
+
+def _finish(job_id, status, result=None, error=None):
+    with catalog.transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, datetime.now().isoformat(), job_id)
+        )
+    _cleanup(job_id)
+
+
+def _cleanup(job_id):
+    shutil.rmtree(job_directory(job_id), ignore_errors=True)
+
+
+def _prune():
+    """Forget finished jobs past the retention period"""
+    cutoff = datetime.fromtimestamp(time.time() - JOB_RETENTION).isoformat()
+    with catalog.transaction() as conn:
+        conn.execute(
+            f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND finished_at < ?",
+            (*FINISHED, cutoff)
+        )
@@ -0,0 +1,100 @@
+import json
+import base64
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class ListingError(ValueError):
+    """Invalid pagination, sort, filter or field arguments"""
+
+
+def encode_cursor(sort_value, record_id):
+    """Opaque keyset cursor pointing just after ``(sort_value, record_id)``"""
+    raw = json.dumps([sort_value, record_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, record_id = json.loads(base64.urlsafe_b64decode(padded))
+        return sort_value, record_id
+    except (ValueError, TypeError):
+        raise ListingError("Invalid cursor")
+
+
+def parse_args(args, sorts, default_sort, fields):
+    """Validate the common list arguments against an endpoint's sorts and fields
+
+    ``sorts`` maps a public sort name (``name``, ``date``, ``size``) to a
+    column.  Returns a dict with ``paginated``, ``limit``, ``after``,
+    ``sort_column``, ``descending``, ``prefix`` and ``fields``.
+    """
+    sort = args.get("sort", default_sort).strip()
+    descending = sort.startswith("-") or args.get("order", "").lower() == "desc"
+    sort = sort.lstrip("-")
+    if sort not in sorts:
+        raise ListingError(f"Unsupported sort {sort!r}; use one of {', '.join(sorts)}")
+
+    cursor = args.get("cursor", "").strip()
+    limit = args.get("limit", "").strip()
+    paginated = bool(cursor or limit)
+    if limit:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ListingError("limit must be an integer")
+        if limit < 1:
+            raise ListingError("limit must be positive")
+        limit = min(limit, MAX_PAGE_SIZE)
+    else:
+        limit = DEFAULT_PAGE_SIZE if paginated else None
+
+    selected = None
+    if args.get("fields", "").strip():
+        selected = [field.strip() for field in args["fields"].split(",") if field.strip()]
+        unknown = [field for field in selected if field not in fields]
+        if unknown:
+            raise ListingError(f"Unknown fields: {', '.join(unknown)}")
+
+    return {
+        "paginated": paginated,
+        "limit": limit,
+        "after": decode_cursor(cursor) if cursor else None,
+        "sort_column": sorts[sort],
+        "descending": descending,
+        "prefix": args.get("prefix", ""),
+        "fields": selected
+    }
+
+
+def stream_json(records, spec):
+    """Serialize records as a JSON array, or a page object when paginating, one record at a time
+
+    ``records`` is an iterator of ``(sort_value, id, item)`` tuples that
+    yields at most ``limit + 1`` entries; the extra one only signals that
+    another page exists.
+    """
+    fields = spec["fields"]
+
+    def project(item):
+        return {field: item.get(field) for field in fields} if fields else item
+
+    if not spec["paginated"]:
+        yield "["
+        for index, (_, _, item) in enumerate(records):
+            yield ("," if index else "") + json.dumps(project(item))
+        yield "]"
+        return
+
+    yield '{"items":['
+    next_cursor = None
+    last = None
+    for index, record in enumerate(records):
+        if index == spec["limit"]:
+            next_cursor = encode_cursor(last[0], last[1])
+            break
+        yield ("," if index else "") + json.dumps(project(record[2]))
+        last = record
+    yield '],"nextCursor":' + json.dumps(next_cursor) + "}"
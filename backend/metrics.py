@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timezone
+
+from flask import g, got_request_exception, has_request_context, request
+
+# Request access log as one JSON object per line on stderr ("0" turns it off)
+ACCESS_LOG = os.environ.get("BACKEND_ACCESS_LOG", "1") != "0"
+# Latency buckets in seconds; long-polls and large transfers land in the top ones
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864, 268435456)
+
+_started = time.time()
+_lock = threading.Lock()
+_metrics = []
+
+
+class _Metric:
+    """One metric family; samples are kept per label tuple and updated under one lock"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted(self.values.items())
+        lines.extend(self._render_sample(key, value) for key, value in items)
+        return "\n".join(lines)
+
+    def _render_sample(self, key, value):
+        return f"{self.name}{self._label_text(key)} {_number(value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+
+    def render(self):
+        if self.function is not None:
+            value = self.function()
+            if value is None:
+                return ""
+            self.set(value)
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with _lock:
+            sample = self.values.get(key)
+            if sample is None:
+                sample = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def _render_sample(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            lines.append(f"{self.name}_bucket{self._label_text(key, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_number(total)}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return "\n".join(lines)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _resident_memory():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+# ---------------------------------------------------------------- metrics
+
+REQUESTS = Counter("http_requests_total", "Requests handled", ("method", "route", "status"))
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time from request start until the response body was sent",
+                             ("method", "route"))
+REQUEST_BYTES = Counter("http_request_bytes_total", "Request body bytes received", ("route",))
+RESPONSE_BYTES = Counter("http_response_bytes_total", "Response body bytes sent", ("route",))
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Response body sizes", ("route",), SIZE_BUCKETS)
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled, including streamed responses", ("route",))
+
+CATALOG_TRANSACTIONS = Counter("indinfra_catalog_transactions_total",
+                               "Metadata write transactions on the SQLite catalog", ("outcome",))
+DISK_WALKS = Counter("indinfra_disk_walks_total", "Directory tree walks (os.walk) over uploaded files", ("caller",))
+BYTES_WRITTEN = Counter("indinfra_bytes_written_total", "File bytes written by upload and save paths", ("kind",))
+WAITS_DECLINED = Counter("indinfra_waits_declined_total",
+                        "Long-polls and event streams answered at once because every wait slot was taken", ("kind",))
+BLOB_DEDUPLICATED_BYTES = Counter("indinfra_blob_deduplicated_bytes_total",
+                                  "Bytes not written because the blob store already held them")
+
+Gauge("process_resident_memory_bytes", "Resident memory size", function=_resident_memory)
+Gauge("process_open_fds", "Open file descriptors", function=_open_fds)
+Gauge("process_start_time_seconds", "Start time of the process since the Unix epoch", function=lambda: _started)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(text for text in (metric.render() for metric in _metrics) if text) + "\n"
+
+
+# ---------------------------------------------------------------- structured logs
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed with ``extra={"fields": {...}}`` are merged in"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+logger = logging.getLogger("indinfra")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def log(message, level=logging.INFO, **fields):
+    """Emit a structured log line, tagged with the current request id when there is one"""
+    request_id = current_request_id()
+    if request_id is not None:
+        fields.setdefault("requestId", request_id)
+    logger.log(level, message, extra={"fields": fields})
+
+
+# ---------------------------------------------------------------- request instrumentation
+
+def current_request_id():
+    return g.get("request_id") if has_request_context() else None
+
+
+def _count_body(iterable, on_done):
+    """Pass a streamed body through, counting its bytes until it is exhausted or closed"""
+    sent = 0
+    try:
+        for chunk in iterable:
+            sent += len(chunk.encode()) if isinstance(chunk, str) else len(chunk)
+            yield chunk
+    finally:
+        on_done(sent)
+        close = getattr(iterable, "close", None)
+        if close is not None:
+            close()
+
+
+def instrument(app):
+    """Time every request of ``app`` and count its bytes, tag it with a request id and log it
+
+    A client supplied ``X-Request-ID`` is kept, otherwise one is generated;
+    either way it is echoed on the response.  Streamed responses are
+    measured until their last chunk was sent.
+    """
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        g.request_id = (request.headers.get("X-Request-ID") or "")[:64] or uuid.uuid4().hex
+        g.request_route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        IN_FLIGHT.inc(route=g.request_route)
+
+    @app.after_request
+    def finish_request(response):
+        if "request_started" not in g:
+            return response
+        started, route, request_id = g.request_started, g.request_route, g.request_id
+        method, path, status = request.method, request.path, response.status_code
+        received = request.content_length or 0
+        response.headers["X-Request-ID"] = request_id
+
+        finished = []
+
+        def done(sent):
+            if finished:
+                return
+            finished.append(True)
+            duration = time.perf_counter() - started
+            IN_FLIGHT.dec(route=route)
+            REQUESTS.inc(method=method, route=route, status=status)
+            REQUEST_DURATION.observe(duration, method=method, route=route)
+            REQUEST_BYTES.inc(received, route=route)
+            RESPONSE_BYTES.inc(sent, route=route)
+            RESPONSE_SIZE.observe(sent, route=route)
+            if ACCESS_LOG:
+                logger.info("request", extra={"fields": {
+                    "requestId": request_id, "method": method, "route": route, "path": path, "status": status,
+                    "durationMs": round(duration * 1000, 3), "requestBytes": received, "responseBytes": sent
+                }})
+
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = _count_body(response.response, done)
+            return response
+
+        # Buffered bodies and files have a known length and are counted once the server closes them
+        length = 0 if status in (204, 304) or method == "HEAD" else response.content_length or 0
+        response.call_on_close(lambda: done(length))
+        if response.direct_passthrough:
+            # Files go to the server's file wrapper untouched (keeping sendfile), which
+            # bypasses the response's own close
+            close = getattr(response.response, "close", None)
+
+            def close_body():
+                if close is not None:
+                    close()
+                done(length)
+
+            try:
+                response.response.close = close_body
+            except AttributeError:
+                pass
+        return response
+
+    def log_exception(sender, exception, **extra):
+        log("unhandled exception", logging.ERROR, method=request.method, route=g.get("request_route"),
+            path=request.path, error=repr(exception))
+
+    got_request_exception.connect(log_exception, app, weak=False)
+
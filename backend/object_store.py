@@ -0,0 +1,572 @@
+import os
+import hmac
+import math
+import time
+import uuid
+import shutil
+import hashlib
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode
+from werkzeug.security import safe_join
+
+import blob_store
+import catalog
+import jobs
+import metrics
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:  # The S3 backend needs boto3; local storage works without it
+    boto3 = None
+
+# "local" keeps objects under uploads/; "s3" uses an S3-compatible bucket (AWS, MinIO, ...)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+STORAGE_S3_BUCKET = os.environ.get("STORAGE_S3_BUCKET", "")
+# Endpoint of a non-AWS service, e.g. http://127.0.0.1:9000 for MinIO
+STORAGE_S3_ENDPOINT = os.environ.get("STORAGE_S3_ENDPOINT") or None
+STORAGE_S3_REGION = os.environ.get("STORAGE_S3_REGION") or None
+STORAGE_S3_PREFIX = os.environ.get("STORAGE_S3_PREFIX", "")
+# Lifetime of presigned URLs in seconds
+STORAGE_PRESIGN_EXPIRES = int(os.environ.get("STORAGE_PRESIGN_EXPIRES", "3600"))
+# Multipart part size; files with more than MAX_PARTS parts get larger parts
+STORAGE_PART_SIZE = int(os.environ.get("STORAGE_PART_SIZE", 16 * 1024 * 1024))
+# Parts transferred at once when the server itself moves an object
+STORAGE_TRANSFER_WORKERS = int(os.environ.get("STORAGE_TRANSFER_WORKERS", "8"))
+# Key for local URL signatures; a random one is kept under uploads/.objects otherwise
+STORAGE_SIGNING_KEY = os.environ.get("STORAGE_SIGNING_KEY", "")
+MAX_PARTS = 10000
+# Unfinished direct uploads older than this are aborted on start
+SESSION_TTL = timedelta(days=1)
+COPY_BUFFER_SIZE = 1024 * 1024
+BASE_URL = "http://127.0.0.1:5000"
+
+# ``direct_uploads`` are uploads sent by clients straight to storage under
+# ``incoming/<id>``, imported into the blob store once complete.
+# ``mirrored_blobs`` lists blobs copied to a remote backend, which presigned
+# downloads are served from.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS direct_uploads (
+        id TEXT PRIMARY KEY,
+        folder TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT,
+        content_type TEXT NOT NULL,
+        key TEXT NOT NULL,
+        multipart_id TEXT,
+        part_size INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',
+        retained INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_direct_uploads_created ON direct_uploads (created_at);
+
+    CREATE TABLE IF NOT EXISTS mirrored_blobs (
+        hash TEXT PRIMARY KEY,
+        key TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+"""
+
+OBJECT_FOLDER = None
+storage = None
+_signing_key = None
+
+
+class ObjectStoreError(Exception):
+    """Raised for invalid transfers; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# ---------------------------------------------------------------- backends
+
+class LocalStorage:
+    """Objects on the local disk, with the same presigned protocol as S3
+
+    Presigned URLs point at ``/objects/<key>`` of this app and carry an HMAC
+    signature, so clients use one code path for both backends; the bytes
+    still go through this process (or the proxy, with X-Sendfile).
+    """
+    direct = False
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        path = safe_join(self.root, key)
+        if path is None:
+            raise ObjectStoreError("Invalid object key", 404)
+        return path
+
+    def local_path(self, key):
+        """File holding an object, or None"""
+        if key.startswith(_prefixed("blobs/")):
+            path = blob_store.readable_path(key.rsplit("/", 1)[-1])
+        else:
+            path = os.path.join(self._path(key), "object")
+        return path if os.path.isfile(path) else None
+
+    def presign_get(self, key, filename, content_type, attachment=False):
+        return signed_url("GET", key, name=filename, type=content_type, download=int(attachment))
+
+    def create_multipart(self, key, content_type):
+        os.makedirs(os.path.join(self._path(key), "parts"), exist_ok=True)
+        return uuid.uuid4().hex
+
+    def presign_part(self, key, multipart_id, part_number):
+        return signed_url("PUT", key, uploadId=multipart_id, partNumber=part_number)
+
+    def write_part(self, key, part_number, length, stream):
+        """Store one part from ``stream``; returns its ETag (MD5, as S3 does)"""
+        target = os.path.join(self._path(key), "parts", str(part_number))
+        temp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        digest = hashlib.md5()
+        written = 0
+        try:
+            with open(temp_path, "wb") as f:
+                while written < length:
+                    block = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    digest.update(block)
+                    written += len(block)
+            if written != length:
+                raise ObjectStoreError("Part body ended early")
+            os.replace(temp_path, target)
+        finally:
+            metrics.BYTES_WRITTEN.inc(written, kind="direct")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return f'"{digest.hexdigest()}"'
+
+    def complete_multipart(self, key, multipart_id, parts):
+        folder = self._path(key)
+        target = os.path.join(folder, "object")
+        temp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "wb") as out:
+                for part in parts:
+                    part_path = os.path.join(folder, "parts", str(part["PartNumber"]))
+                    if not os.path.isfile(part_path):
+                        raise ObjectStoreError(f"Part {part['PartNumber']} was not uploaded", 409)
+                    digest = hashlib.md5()
+                    with open(part_path, "rb") as f:
+                        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+                            digest.update(block)
+                            out.write(block)
+                    if part["ETag"].strip('"') != digest.hexdigest():
+                        raise ObjectStoreError(f"ETag of part {part['PartNumber']} does not match", 409)
+            os.replace(temp_path, target)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        shutil.rmtree(os.path.join(folder, "parts"), ignore_errors=True)
+
+    def abort_multipart(self, key, multipart_id):
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def size(self, key):
+        path = self.local_path(key)
+        return os.path.getsize(path) if path else None
+
+    def fetch(self, key, target_path):
+        """Move a completed upload to ``target_path`` (a rename on the same disk)"""
+        os.replace(os.path.join(self._path(key), "object"), target_path)
+
+    def upload(self, path, key, content_type):
+        """Blobs are already local"""
+
+    def delete(self, key):
+        if not key.startswith(_prefixed("blobs/")):
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket; presigned URLs go to the bucket, not this app
+
+    Server-side transfers use boto3's managed transfers: multipart uploads
+    and ranged downloads with ``STORAGE_TRANSFER_WORKERS`` parts in flight.
+    """
+    direct = True
+
+    def __init__(self, bucket, endpoint=None, region=None):
+        self.bucket = bucket
+        # MinIO and most other stand-ins only serve path-style URLs
+        self.client = boto3.client("s3", endpoint_url=endpoint, region_name=region, config=Config(
+            signature_version="s3v4", s3={"addressing_style": "path" if endpoint else "auto"}))
+        self.transfer = TransferConfig(multipart_threshold=STORAGE_PART_SIZE, multipart_chunksize=STORAGE_PART_SIZE,
+                                       max_concurrency=STORAGE_TRANSFER_WORKERS)
+
+    def _call(self, method, **params):
+        try:
+            return getattr(self.client, method)(Bucket=self.bucket, **params)
+        except (BotoCoreError, ClientError) as e:
+            raise ObjectStoreError(f"Object storage failed: {str(e)}", 502)
+
+    def local_path(self, key):
+        return None
+
+    def presign_get(self, key, filename, content_type, attachment=False):
+        disposition = f"{'attachment' if attachment else 'inline'}; filename*=UTF-8''{quote(filename)}"
+        return self.client.generate_presigned_url("get_object", ExpiresIn=STORAGE_PRESIGN_EXPIRES, Params={
+            "Bucket": self.bucket, "Key": key, "ResponseContentType": content_type,
+            "ResponseContentDisposition": disposition})
+
+    def create_multipart(self, key, content_type):
+        return self._call("create_multipart_upload", Key=key, ContentType=content_type)["UploadId"]
+
+    def presign_part(self, key, multipart_id, part_number):
+        return self.client.generate_presigned_url("upload_part", ExpiresIn=STORAGE_PRESIGN_EXPIRES, Params={
+            "Bucket": self.bucket, "Key": key, "UploadId": multipart_id, "PartNumber": part_number})
+
+    def complete_multipart(self, key, multipart_id, parts):
+        self._call("complete_multipart_upload", Key=key, UploadId=multipart_id, MultipartUpload={"Parts": parts})
+
+    def abort_multipart(self, key, multipart_id):
+        try:
+            self._call("abort_multipart_upload", Key=key, UploadId=multipart_id)
+        except ObjectStoreError as e:
+            print(f"❌ Could not abort upload {key}: {str(e)}")
+
+    def size(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise ObjectStoreError(f"Object storage failed: {str(e)}", 502)
+
+    def fetch(self, key, target_path):
+        try:
+            self.client.download_file(self.bucket, key, target_path, Config=self.transfer)
+        except (BotoCoreError, ClientError) as e:
+            raise ObjectStoreError(f"Object storage failed: {str(e)}", 502)
+
+    def upload(self, path, key, content_type):
+        try:
+            self.client.upload_file(path, self.bucket, key, ExtraArgs={"ContentType": content_type},
+                                    Config=self.transfer)
+        except (BotoCoreError, ClientError) as e:
+            raise ObjectStoreError(f"Object storage failed: {str(e)}", 502)
+        metrics.BYTES_WRITTEN.inc(os.path.getsize(path), kind="mirror")
+
+    def delete(self, key):
+        self._call("delete_object", Key=key)
+
+
+# ---------------------------------------------------------------- setup
+
+def init_object_store(upload_root):
+    """Create the transfer tables, pick the storage backend and abort expired direct uploads"""
+    global OBJECT_FOLDER, storage
+    OBJECT_FOLDER = os.path.join(upload_root, ".objects")
+    os.makedirs(OBJECT_FOLDER, exist_ok=True)
+    catalog.get_connection().executescript(SCHEMA)
+    # ``retained`` marks deduplicated uploads that hold a reference on their blob until discarded
+    catalog.add_missing_columns("direct_uploads", (("retained", "INTEGER NOT NULL DEFAULT 0"),))
+
+    if STORAGE_BACKEND == "s3" and boto3 is None:
+        print("❌ STORAGE_BACKEND=s3 needs the boto3 package; using local storage")
+    elif STORAGE_BACKEND == "s3" and not STORAGE_S3_BUCKET:
+        print("❌ STORAGE_BACKEND=s3 needs STORAGE_S3_BUCKET; using local storage")
+    if STORAGE_BACKEND == "s3" and boto3 is not None and STORAGE_S3_BUCKET:
+        storage = S3Storage(STORAGE_S3_BUCKET, STORAGE_S3_ENDPOINT, STORAGE_S3_REGION)
+        print(f"🪣 Object storage: bucket {STORAGE_S3_BUCKET}" + (f" at {STORAGE_S3_ENDPOINT}" if STORAGE_S3_ENDPOINT else ""))
+    else:
+        storage = LocalStorage(OBJECT_FOLDER)
+    blob_store.on_collected(forget_blobs)
+
+    cutoff = (datetime.now() - SESSION_TTL).isoformat()
+    expired = [row["id"] for row in catalog.get_connection().execute(
+        "SELECT id FROM direct_uploads WHERE created_at < ?", (cutoff,)
+    )]
+    for upload_id in expired:
+        discard_upload(upload_id)
+
+
+def _prefixed(key):
+    return STORAGE_S3_PREFIX + key if isinstance(storage, S3Storage) else key
+
+
+def blob_key(blob_hash):
+    return _prefixed(f"blobs/{blob_hash[:2]}/{blob_hash[2:4]}/{blob_hash}")
+
+
+def _get_signing_key():
+    global _signing_key
+    if _signing_key is None:
+        if STORAGE_SIGNING_KEY:
+            _signing_key = STORAGE_SIGNING_KEY.encode("utf-8")
+        else:
+            path = os.path.join(OBJECT_FOLDER, "signing.key")
+            if not os.path.exists(path):
+                fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(os.urandom(32))
+                os.replace(f"{path}.tmp", path)
+            with open(path, "rb") as f:
+                _signing_key = f.read()
+    return _signing_key
+
+
+def _signature(method, key, params):
+    message = "\n".join([method, key] + [f"{name}={params[name]}" for name in sorted(params)])
+    return hmac.new(_get_signing_key(), message.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def signed_url(method, key, **params):
+    """URL of ``/objects/<key>`` for ``method`` that stays valid for ``STORAGE_PRESIGN_EXPIRES`` seconds"""
+    params = {name: str(value) for name, value in params.items()}
+    params["expires"] = str(int(time.time()) + STORAGE_PRESIGN_EXPIRES)
+    params["signature"] = _signature(method, key, params)
+    return f"{BASE_URL}/objects/{quote(key)}?{urlencode(params)}"
+
+
+def verify(method, key, args):
+    """Check the signature and expiry of a local object URL; returns its parameters"""
+    params = {name: value for name, value in args.items() if name != "signature"}
+    if not hmac.compare_digest(_signature(method, key, params), args.get("signature", "")):
+        raise ObjectStoreError("Invalid signature", 403)
+    if not params.get("expires", "").isdigit() or int(params["expires"]) < time.time():
+        raise ObjectStoreError("URL expired", 403)
+    return params
+
+
+# ---------------------------------------------------------------- direct uploads
+
+def _clean_path(folder, path):
+    """Normalise a client folder and file path, rejecting anything that escapes the upload root"""
+    folder = (folder or "").replace("\\", "/").strip().strip("/")
+    path = (path or "").replace("\\", "/").strip()
+    parts = [part for part in f"{folder}/{path}".split("/") if part]
+    if not path or path.startswith("/") or any(part.startswith(".") for part in parts) \
+            or safe_join("/", *parts) is None:
+        raise ObjectStoreError(f"Invalid file path: {path!r}")
+    return folder, path
+
+
+def upload_from_row(row, with_urls=False):
+    """Public form of a direct upload; ``with_urls`` adds a presigned URL per part"""
+    upload = {
+        "uploadId": row["id"],
+        "folder": row["folder"],
+        "path": row["path"],
+        "size": row["size"],
+        "sha256": row["sha256"],
+        "status": row["status"],
+        "direct": storage.direct,
+        "deduplicated": row["multipart_id"] is None,
+        "createdAt": row["created_at"]
+    }
+    if with_urls and row["multipart_id"] is not None:
+        count = max(1, math.ceil(row["size"] / row["part_size"]))
+        upload["partSize"] = row["part_size"]
+        upload["parts"] = [{"partNumber": number, "url": storage.presign_part(row["key"], row["multipart_id"], number)}
+                           for number in range(1, count + 1)]
+        upload["expiresAt"] = datetime.fromtimestamp(time.time() + STORAGE_PRESIGN_EXPIRES).isoformat()
+    upload["completeUrl"] = f"{BASE_URL}/direct-uploads/{row['id']}/complete"
+    return upload
+
+
+def get_upload(upload_id):
+    row = catalog.get_connection().execute("SELECT * FROM direct_uploads WHERE id = ?", (upload_id,)).fetchone()
+    if row is None:
+        raise ObjectStoreError("Upload not found", 404)
+    return row
+
+
+def create_upload(folder, path, size, content_type=None, sha256=None):
+    """Open a direct upload of one file; the client PUTs its parts to the returned URLs in parallel
+
+    Content the blob store already holds (by ``sha256``) needs no transfer;
+    the upload keeps a reference on it until it is discarded, so it cannot
+    be collected before the import.
+    """
+    folder, path = _clean_path(folder, path)
+    if not isinstance(size, int) or size < 0:
+        raise ObjectStoreError(f"Invalid size for {path!r}")
+    sha256 = (sha256 or "").lower() or None
+    content_type = content_type or "application/octet-stream"
+    upload_id = str(uuid.uuid4())
+    key = _prefixed(f"incoming/{upload_id}")
+    part_size = max(STORAGE_PART_SIZE, math.ceil(size / MAX_PARTS))
+    retained = False
+    if sha256:
+        with catalog.transaction():
+            if blob_store.has_blob(sha256, size):
+                blob_store.retain_blob(sha256)
+                retained = True
+    multipart_id = None if retained else storage.create_multipart(key, content_type)
+    try:
+        with catalog.transaction() as conn:
+            conn.execute(
+                "INSERT INTO direct_uploads (id, folder, path, size, sha256, content_type, key, multipart_id, "
+                "part_size, retained, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (upload_id, folder, path, size, sha256, content_type, key, multipart_id, part_size, int(retained),
+                 datetime.now().isoformat())
+            )
+    except BaseException:
+        if retained:
+            blob_store.release_blob(sha256)
+        raise
+    return upload_from_row(get_upload(upload_id), with_urls=True)
+
+
+def write_local_part(key, params, length, stream):
+    """Receive a part PUT to a local presigned URL; returns its ETag"""
+    if length is None:
+        raise ObjectStoreError("Content-Length is required", 411)
+    row = catalog.get_connection().execute(
+        "SELECT * FROM direct_uploads WHERE key = ? AND multipart_id = ?", (key, params.get("uploadId"))
+    ).fetchone()
+    if row is None or row["status"] != "open":
+        raise ObjectStoreError("Upload not found", 404)
+    part_number = int(params["partNumber"]) if params.get("partNumber", "").isdigit() else 0
+    if not 1 <= part_number <= max(1, math.ceil(row["size"] / row["part_size"])):
+        raise ObjectStoreError("Invalid part number")
+    if length > row["part_size"]:
+        raise ObjectStoreError(f"Part larger than {row['part_size']} bytes", 413)
+    return storage.write_part(key, part_number, length, stream)
+
+
+def complete_upload(upload_id, parts):
+    """Assemble the uploaded ``[{"partNumber", "etag"}]`` parts; the caller then queues the import"""
+    row = get_upload(upload_id)
+    # Claim the upload so a second complete (e.g. a client retry) neither assembles it again nor queues another import
+    with catalog.transaction() as conn:
+        claimed = conn.execute(
+            "UPDATE direct_uploads SET status = 'completing' WHERE id = ? AND status = 'open'", (upload_id,)
+        ).rowcount
+    if not claimed:
+        raise ObjectStoreError("Upload is already complete", 409)
+    try:
+        if row["multipart_id"] is not None:
+            count = max(1, math.ceil(row["size"] / row["part_size"]))
+            try:
+                parts = sorted(({"PartNumber": int(part["partNumber"]), "ETag": str(part["etag"])} for part in parts),
+                               key=lambda part: part["PartNumber"])
+            except (KeyError, TypeError, ValueError):
+                raise ObjectStoreError("Each part needs a partNumber and an etag")
+            if [part["PartNumber"] for part in parts] != list(range(1, count + 1)):
+                raise ObjectStoreError(f"Expected parts 1 to {count}", 409)
+            storage.complete_multipart(row["key"], row["multipart_id"], parts)
+            if storage.size(row["key"]) != row["size"]:
+                raise ObjectStoreError("Uploaded size does not match the declared size", 409)
+    except BaseException:
+        # The client may fix its part list and complete again
+        with catalog.transaction() as conn:
+            conn.execute("UPDATE direct_uploads SET status = 'open' WHERE id = ? AND status = 'completing'",
+                         (upload_id,))
+        raise
+    with catalog.transaction() as conn:
+        conn.execute("UPDATE direct_uploads SET status = 'completed' WHERE id = ?", (upload_id,))
+    return upload_from_row(get_upload(upload_id))
+
+
+def fetch_upload(row, target_path):
+    """Bring a completed upload to ``target_path`` unless an earlier attempt did; returns its SHA-256
+
+    The content is checked against the declared size and hash.
+    """
+    if not os.path.exists(target_path):
+        storage.fetch(row["key"], target_path)
+    with open(target_path, "rb") as f:
+        sha256, size = blob_store.hash_stream(f)
+    if size != row["size"] or (row["sha256"] and sha256 != row["sha256"]):
+        raise ObjectStoreError("Uploaded content does not match the declared size or hash", 422)
+    return sha256
+
+
+def discard_upload(upload_id):
+    """Forget a finished or cancelled direct upload and delete its parts"""
+    row = catalog.get_connection().execute("SELECT * FROM direct_uploads WHERE id = ?", (upload_id,)).fetchone()
+    if row is None:
+        return
+    if row["multipart_id"] is not None:
+        if row["status"] == "open":
+            storage.abort_multipart(row["key"], row["multipart_id"])
+        else:
+            try:
+                storage.delete(row["key"])
+            except ObjectStoreError as e:
+                print(f"❌ Could not delete upload {row['key']}: {str(e)}")
+    with catalog.transaction() as conn:
+        deleted = conn.execute("DELETE FROM direct_uploads WHERE id = ?", (upload_id,)).rowcount
+        if deleted and row["retained"]:
+            blob_store.release_blob(row["sha256"])
+
+
+# ---------------------------------------------------------------- downloads
+
+def download_url(blob_hash, filename, content_type, attachment=False):
+    """``(url, direct)`` for a presigned download of a blob, or ``(None, False)`` until it is in storage
+
+    A remote backend gets blobs it does not hold yet queued for mirroring.
+    """
+    if storage.direct:
+        row = catalog.get_connection().execute("SELECT key FROM mirrored_blobs WHERE hash = ?", (blob_hash,)).fetchone()
+        if row is None:
+            mirror_later(blob_hash)
+            return None, False
+        return storage.presign_get(row["key"], filename, content_type, attachment), True
+    return storage.presign_get(blob_key(blob_hash), filename, content_type, attachment), False
+
+
+def mirror_later(blob_hash):
+    """Queue copying a blob to a remote backend; nothing to do for local storage"""
+    if not storage.direct:
+        return
+    mirrored = catalog.get_connection().execute(
+        "SELECT 1 FROM mirrored_blobs WHERE hash = ? UNION ALL SELECT 1 FROM jobs WHERE kind = 'blob.mirror' "
+        "AND status IN ('queued', 'running') AND json_extract(payload, '$.hash') = ?", (blob_hash, blob_hash)
+    ).fetchone()
+    if mirrored is None:
+        jobs.enqueue("blob.mirror", {"hash": blob_hash}, jobs.PRIORITY_LOW)
+
+
+def mirror_blob_job(job):
+    """Upload a blob to the bucket with parallel multipart transfers"""
+    blob_hash = job.payload["hash"]
+    if not blob_store.is_referenced(blob_hash):
+        return {"hash": blob_hash, "skipped": "Blob is no longer used"}
+    key = blob_key(blob_hash)
+    started = time.perf_counter()
+    path = blob_store.readable_path(blob_hash)
+    storage.upload(path, key, "application/octet-stream")
+    with catalog.transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO mirrored_blobs (hash, key, created_at) VALUES (?, ?, ?)",
+                     (blob_hash, key, datetime.now().isoformat()))
+    print(f"🪣 Mirrored {blob_hash[:12]} in {time.perf_counter() - started:.2f}s")
+    return {"hash": blob_hash, "key": key}
+
+
+def forget_blobs(hashes):
+    """Queue deleting the mirrored copies of blobs the store collected"""
+    with catalog.transaction() as conn:
+        keys = []
+        for blob_hash in hashes:
+            row = conn.execute("SELECT key FROM mirrored_blobs WHERE hash = ?", (blob_hash,)).fetchone()
+            if row is not None:
+                keys.append(row["key"])
+                conn.execute("DELETE FROM mirrored_blobs WHERE hash = ?", (blob_hash,))
+    if keys:
+        jobs.enqueue("objects.delete", {"keys": keys}, jobs.PRIORITY_LOW)
+
+
+def delete_objects_job(job):
+    for index, key in enumerate(job.payload["keys"]):
+        job.check_cancelled()
+        storage.delete(key)
+        job.progress(index + 1, len(job.payload["keys"]))
+    return {"deleted": len(job.payload["keys"])}
+
+
+jobs.register("blob.mirror", mirror_blob_job)
+jobs.register("objects.delete", delete_objects_job)
@@ -0,0 +1,243 @@
+import os
+import time
+import threading
+from datetime import datetime
+
+import blob_store
+import catalog
+import metrics
+import pdf_versions
+import process_pool
+
+try:
+    import pymupdf
+except ImportError:  # Uploads are stored as they are without PyMuPDF
+    pymupdf = None
+
+try:
+    import pikepdf
+except ImportError:  # Linearization needs pikepdf (qpdf); MuPDF no longer writes linearized files
+    pikepdf = None
+
+# Set to 0 to store uploaded PDFs exactly as they were sent
+PDF_OPTIMIZE = os.environ.get("PDF_OPTIMIZE", "1") != "0"
+# Smaller PDFs are not worth a pass
+PDF_OPTIMIZE_MIN_BYTES = int(os.environ.get("PDF_OPTIMIZE_MIN_BYTES", 1024 * 1024))
+# Processes rewriting PDFs; a large scan needs a few times its size in memory
+PDF_OPTIMIZE_WORKERS = int(os.environ.get("PDF_OPTIMIZE_WORKERS", "1"))
+# Optimized copies must save at least this fraction to replace the upload (a linearized copy always does)
+MIN_SAVING = 0.05
+OPTIMIZE_TIMEOUT = 1800
+
+# One row per optimized upload, keyed by the blob store file id.  ``hash`` is
+# what the file was replaced with and ``original_hash`` the upload, which
+# the row keeps one blob reference on.  Uploads that could not be made
+# smaller are recorded as ``skipped`` with ``hash = original_hash`` and hold
+# no reference, so they are not tried again.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pdf_optimizations (
+        document TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        original_hash TEXT NOT NULL,
+        original_size INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        linearized INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_pdf_optimizations_hash ON pdf_optimizations (hash);
+"""
+
+_executor = None
+_lock = threading.Lock()
+
+
+def init_pdf_optimize():
+    """Create the optimization table"""
+    catalog.get_connection().executescript(SCHEMA)
+
+
+def available():
+    return pymupdf is not None
+
+
+def optimization_from_row(row):
+    """Public form of an optimization row"""
+    return {
+        "status": row["status"],
+        "originalSha256": row["original_hash"],
+        "originalSize": row["original_size"],
+        "sha256": row["hash"],
+        "size": row["size"],
+        "savedBytes": row["original_size"] - row["size"],
+        "linearized": bool(row["linearized"]),
+        "createdAt": row["created_at"]
+    }
+
+
+def get(document):
+    """The optimization row of a file while the file still holds its output, else None"""
+    row = catalog.get_connection().execute(
+        "SELECT o.* FROM pdf_optimizations o JOIN file_refs r ON r.id = o.document AND r.hash = o.hash "
+        "WHERE o.document = ?", (document,)
+    ).fetchone()
+    return row
+
+
+def wanted(file_path, stored):
+    """Whether a freshly stored file should get an optimization pass
+
+    Also drops the record of an earlier pass when the file was overwritten
+    since, releasing the original it kept.
+    """
+    row = catalog.get_connection().execute(
+        "SELECT hash FROM pdf_optimizations WHERE document = ?", (stored["id"],)
+    ).fetchone()
+    if row is not None:
+        if row["hash"] == stored["hash"]:
+            return False
+        remove_documents([stored["id"]])
+    # Edited documents keep their bytes: clients send deltas against the version hash
+    return (PDF_OPTIMIZE and pymupdf is not None and file_path.lower().endswith(".pdf")
+            and stored["size"] >= PDF_OPTIMIZE_MIN_BYTES and pdf_versions.head(stored["id"]) is None)
+
+
+def optimize_file(source_path, output_path):
+    """Rewrite a PDF losslessly; runs inside a worker process
+
+    Unused and duplicate objects (repeated fonts and images included) are
+    dropped, every stream is deflated and, where possible, objects are
+    packed into object streams and the file is linearized for fast first
+    page display.  Returns the page count and whether it was linearized.
+    """
+    with pymupdf.open(source_path) as doc:
+        if doc.needs_pass or doc.is_encrypted:
+            raise ValueError("Encrypted PDFs are stored as they are")
+        page_count = doc.page_count
+        # pikepdf writes object streams itself, together with the linearization
+        doc.save(output_path, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True,
+                 use_objstms=0 if pikepdf is not None else 1)
+    if pikepdf is None:
+        return {"pages": page_count, "linearized": False}
+    linearized_path = f"{output_path}.linear"
+    try:
+        with pikepdf.open(output_path) as pdf:
+            pdf.save(linearized_path, linearize=True, compress_streams=True,
+                     object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        os.replace(linearized_path, output_path)
+    finally:
+        if os.path.exists(linearized_path):
+            os.remove(linearized_path)
+    return {"pages": page_count, "linearized": True}
+
+
+def _page_count(path):
+    with pymupdf.open(path) as doc:
+        return doc.page_count
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = process_pool.new_executor(PDF_OPTIMIZE_WORKERS)
+        return _executor
+
+
+def optimize(document, file_path, source_hash):
+    """Replace a stored PDF by its optimized copy, keeping the upload as the original
+
+    Returns ``(result, stored)``: ``stored`` is the ``blob_store.put``
+    result when the file was replaced, else None.
+    """
+    started = time.perf_counter()
+    changed = {"document": document, "status": "skipped", "reason": "File changed during optimization"}
+    # Hold the original for the whole run: the optimizer reads it, and it is kept once the file
+    # stops referencing it
+    try:
+        blob_store.retain_blob(source_hash)
+    except FileNotFoundError:
+        return changed, None
+    output_path = blob_store.staging_path()
+    try:
+        written = _get_executor().submit(optimize_file, blob_store.blob_path(source_hash), output_path)
+        info = written.result(timeout=OPTIMIZE_TIMEOUT)
+        original_size = os.path.getsize(blob_store.blob_path(source_hash))
+        size = os.path.getsize(output_path)
+        if _page_count(output_path) != info["pages"]:
+            raise ValueError("The optimized copy lost pages")
+        if size > original_size * (1 - MIN_SAVING) and not info["linearized"]:
+            _record(document, "skipped", source_hash, original_size, source_hash, original_size, False)
+            blob_store.release_blob(source_hash)
+            print(f"🗜️ {file_path} is already compact ({size} of {original_size} bytes); kept as uploaded")
+            return {"document": document, "status": "skipped", "size": original_size}, None
+
+        metrics.BYTES_WRITTEN.inc(size, kind="optimize")
+        optimized = blob_store.store_blob(output_path)
+        try:
+            # Swap only if the file still holds the upload and nobody saved a version of it
+            # since; both are checked under the catalog write lock that every save takes
+            with catalog.transaction():
+                if pdf_versions.head(document) is not None:
+                    raise FileExistsError("The document has saved versions")
+                stored = blob_store.put_existing(optimized["hash"], file_path, expected_hash=source_hash)
+        finally:
+            blob_store.release_blob(optimized["hash"])
+        _record(document, "optimized", source_hash, original_size, stored["hash"], stored["size"],
+                info["linearized"])
+    except FileExistsError:
+        blob_store.release_blob(source_hash)
+        blob_store.collect_garbage()
+        return changed, None
+    except BaseException:
+        blob_store.release_blob(source_hash)
+        raise
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    print(f"🗜️ Optimized {file_path} in {time.perf_counter() - started:.2f}s: "
+          f"{original_size} -> {stored['size']} bytes{' (linearized)' if info['linearized'] else ''}")
+    return {"document": document, "status": "optimized", "originalSize": original_size, "size": stored["size"],
+            "savedBytes": original_size - stored["size"], "linearized": info["linearized"]}, stored
+
+
+def _record(document, status, original_hash, original_size, content_hash, size, linearized):
+    with catalog.transaction() as conn:
+        previous = conn.execute("SELECT * FROM pdf_optimizations WHERE document = ?", (document,)).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO pdf_optimizations "
+            "(document, status, original_hash, original_size, hash, size, linearized, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (document, status, original_hash, original_size, content_hash, size, int(linearized),
+             datetime.now().isoformat())
+        )
+    if previous is not None and previous["status"] == "optimized":
+        blob_store.release_blob(previous["original_hash"])
+
+
+def folder_savings(folder):
+    """Bytes saved by optimization across the files a top-level folder holds now"""
+    row = catalog.get_connection().execute(
+        "SELECT COALESCE(SUM(o.original_size - o.size), 0) FROM pdf_optimizations o "
+        "JOIN file_refs r ON r.id = o.document AND r.hash = o.hash WHERE r.folder = ? AND o.status = 'optimized'",
+        (folder,)
+    ).fetchone()
+    return row[0]
+
+
+def remove_documents(documents):
+    """Forget the optimization of deleted or overwritten files and release their originals"""
+    released = []
+    with catalog.transaction() as conn:
+        for document in documents:
+            row = conn.execute("SELECT status, original_hash FROM pdf_optimizations WHERE document = ?",
+                               (document,)).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM pdf_optimizations WHERE document = ?", (document,))
+            if row["status"] == "optimized":
+                released.append(row["original_hash"])
+    for original_hash in released:
+        blob_store.release_blob(original_hash)
+    if released:
+        blob_store.collect_garbage()
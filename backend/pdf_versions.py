@@ -0,0 +1,360 @@
+import os
+import hashlib
+import threading
+from datetime import datetime
+
+import blob_store
+import catalog
+import metrics
+
+try:
+    import bsdiff4
+except ImportError:  # Only PDF incremental updates are accepted without bsdiff4
+    bsdiff4 = None
+
+# Deltas allowed on top of a full snapshot before the chain is compacted
+CHAIN_DEPTH = int(os.environ.get("PDF_VERSION_CHAIN_DEPTH", "8"))
+# Versions kept per document; older ones are pruned on compaction
+HISTORY = int(os.environ.get("PDF_VERSION_HISTORY", "20"))
+MAX_DELTA_BYTES = int(os.environ.get("PDF_MAX_DELTA_BYTES", 256 * 1024 * 1024))
+READ_BUFFER_SIZE = 1024 * 1024
+
+# One row per saved version of a PDF.  Snapshot rows keep a reference on the
+# full content blob; delta rows keep one on the delta blob and are rebuilt
+# from the nearest snapshot before them.  ``document`` is the blob store
+# file id of the PDF.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pdf_versions (
+        document TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        delta_hash TEXT,
+        delta_size INTEGER NOT NULL DEFAULT 0,
+        snapshot INTEGER NOT NULL DEFAULT 0,
+        depth INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (document, version)
+    );
+    CREATE INDEX IF NOT EXISTS idx_pdf_versions_hash ON pdf_versions (document, hash);
+"""
+
+DELTA_KINDS = ("append", "bsdiff")
+
+_materialize_lock = threading.Lock()
+
+
+class VersionError(Exception):
+    """Raised for rejected saves; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def init_pdf_versions():
+    """Create the version chain table"""
+    catalog.get_connection().executescript(SCHEMA)
+
+
+def supported_kinds():
+    return DELTA_KINDS if bsdiff4 is not None else ("append",)
+
+
+def version_from_row(row):
+    """Public form of a version row"""
+    return {
+        "version": row["version"],
+        "sha256": row["hash"],
+        "size": row["size"],
+        "kind": row["kind"],
+        "deltaSize": row["delta_size"],
+        "snapshot": bool(row["snapshot"]),
+        "createdAt": row["created_at"]
+    }
+
+
+def head(document):
+    """Latest version row of a document, or None if it was never saved through the version API"""
+    return catalog.get_connection().execute(
+        "SELECT * FROM pdf_versions WHERE document = ? ORDER BY version DESC LIMIT 1", (document,)
+    ).fetchone()
+
+
+def head_hash(document):
+    row = head(document)
+    return row["hash"] if row else None
+
+
+def list_versions(document):
+    rows = catalog.get_connection().execute(
+        "SELECT * FROM pdf_versions WHERE document = ? ORDER BY version", (document,)
+    )
+    return [version_from_row(row) for row in rows]
+
+
+def get_version(document, version):
+    return catalog.get_connection().execute(
+        "SELECT * FROM pdf_versions WHERE document = ? AND version = ?", (document, version)
+    ).fetchone()
+
+
+def _snapshot(document, version, content_hash, size, kind):
+    """Record a full version whose bytes are already stored as a blob"""
+    blob_store.retain_blob(content_hash)
+    try:
+        with catalog.transaction() as conn:
+            conn.execute(
+                "INSERT INTO pdf_versions (document, version, hash, size, kind, snapshot, depth, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 1, 0, ?)",
+                (document, version, content_hash, size, kind, datetime.now().isoformat())
+            )
+    except BaseException:
+        blob_store.release_blob(content_hash)
+        raise
+
+
+def _known(document, content_hash):
+    return catalog.get_connection().execute(
+        "SELECT 1 FROM pdf_versions WHERE document = ? AND hash = ?", (document, content_hash)
+    ).fetchone() is not None
+
+
+def _adopt_current(document):
+    """Make sure the chain's head is the file as it is on disk
+
+    The first versioned save starts a chain from the current file, and a
+    file overwritten outside the version API (a full save or re-upload)
+    becomes a new snapshot on top of the chain.
+    """
+    ref = blob_store.lookup_id(document)
+    if ref is None:
+        raise VersionError("Document not found", 404)
+    current = head(document)
+    if current is not None and _known(document, ref["hash"]):
+        return ref
+    _snapshot(document, current["version"] + 1 if current else 1, ref["hash"], ref["size"], "full")
+    return ref
+
+
+def record_full_save(document):
+    """Add a file that was just saved in full to its version history"""
+    _adopt_current(document)
+    _prune(document)
+
+
+def record_overwrite(document):
+    """Make a file overwritten in full (e.g. uploaded again) the head of its history, if it has one
+
+    Content matching an earlier version is recorded again, so the file is
+    not mistaken for one that is behind the chain.
+    """
+    current = head(document)
+    ref = blob_store.lookup_id(document)
+    if current is None or ref is None or ref["hash"] == current["hash"]:
+        return
+    _snapshot(document, current["version"] + 1, ref["hash"], ref["size"], "full")
+    _prune(document)
+
+
+# ---------------------------------------------------------------- reconstruction
+
+def _chain(document, version):
+    """Rows from the nearest snapshot up to ``version``"""
+    rows = catalog.get_connection().execute(
+        "SELECT * FROM pdf_versions WHERE document = ? AND version <= ? AND version >= "
+        "(SELECT MAX(version) FROM pdf_versions WHERE document = ? AND version <= ? AND snapshot = 1) "
+        "ORDER BY version",
+        (document, version, document, version)
+    ).fetchall()
+    if not rows or not rows[0]["snapshot"]:
+        raise VersionError(f"Version {version} is no longer available", 410)
+    return rows
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_BUFFER_SIZE), b""):
+            yield block
+
+
+def _content(rows, extra=None):
+    """Yield the bytes of the last version in ``rows``, optionally followed by one more delta
+
+    Incremental updates are streamed; a binary delta needs its base in memory.
+    """
+    segments = [("file", blob_store.readable_path(rows[0]["hash"]))]
+    deltas = [(row["kind"], ("file", blob_store.readable_path(row["delta_hash"]))) for row in rows[1:]]
+    if extra is not None:
+        deltas.append(extra)
+    for kind, delta in deltas:
+        if kind == "append":
+            segments.append(delta)
+        else:
+            base = b"".join(_segment_blocks(segments))
+            patch = b"".join(_segment_blocks([delta]))
+            segments = [("bytes", bsdiff4.patch(base, patch))]
+    return _segment_blocks(segments)
+
+
+def _segment_blocks(segments):
+    for kind, value in segments:
+        if kind == "bytes":
+            yield value
+        else:
+            yield from _read_file(value)
+
+
+def write_version(document, version, target_path):
+    """Rebuild a version's bytes into ``target_path``"""
+    with open(target_path, "wb") as f:
+        for block in _content(_chain(document, version)):
+            f.write(block)
+        metrics.BYTES_WRITTEN.inc(f.tell(), kind="version")
+
+
+# ---------------------------------------------------------------- saves
+
+def save_delta(document, base_hash, kind, staged_path):
+    """Append a delta against ``base_hash`` (which must be the head) to a document's chain
+
+    ``staged_path`` holds the delta bytes and is consumed.  Only the delta is
+    written to disk; the full file is materialized when it is next read, or
+    once the chain reaches ``CHAIN_DEPTH`` and the caller compacts it.
+    Returns the new version row and whether the chain is due for compaction.
+    """
+    try:
+        if kind not in supported_kinds():
+            raise VersionError(f"Unsupported delta kind {kind!r}; use one of {', '.join(supported_kinds())}", 415)
+        delta_size = os.path.getsize(staged_path)
+        if delta_size > MAX_DELTA_BYTES:
+            raise VersionError(f"Delta larger than {MAX_DELTA_BYTES} bytes", 413)
+        if kind == "append":
+            with open(staged_path, "rb") as f:
+                f.seek(max(delta_size - 1024, 0))
+                if b"%%EOF" not in f.read():
+                    raise VersionError("An incremental update must end with %%EOF")
+
+        _adopt_current(document)
+        base = head(document)
+        if base_hash != base["hash"]:
+            raise VersionError("Base is not the current version", 409, headHash=base["hash"],
+                               headVersion=base["version"])
+
+        # Hash the new version by streaming base and delta; nothing is written but the delta
+        digest = hashlib.sha256()
+        size = 0
+        for block in _content(_chain(document, base["version"]), (kind, ("file", staged_path))):
+            digest.update(block)
+            size += len(block)
+    except BaseException:
+        os.remove(staged_path)
+        raise
+
+    delta = blob_store.store_blob(staged_path)
+    try:
+        with catalog.transaction() as conn:
+            latest = conn.execute(
+                "SELECT MAX(version) FROM pdf_versions WHERE document = ?", (document,)
+            ).fetchone()[0]
+            if latest != base["version"]:
+                raise VersionError("Another save landed first", 409, headVersion=latest)
+            conn.execute(
+                "INSERT INTO pdf_versions (document, version, hash, size, kind, delta_hash, delta_size, depth, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (document, base["version"] + 1, digest.hexdigest(), size, kind, delta["hash"], delta["size"],
+                 base["depth"] + 1, datetime.now().isoformat())
+            )
+    except BaseException:
+        blob_store.release_blob(delta["hash"])
+        raise
+
+    saved = get_version(document, base["version"] + 1)
+    return saved, saved["depth"] >= CHAIN_DEPTH
+
+
+# ---------------------------------------------------------------- materialization and compaction
+
+def materialize(document, file_path):
+    """Write the head version to the document's file if the file is behind
+
+    The file is behind only while it holds an earlier version of the chain;
+    a file overwritten in full since is newer and is left alone.  Returns
+    the ``blob_store.put`` result when the file was rewritten, else None.
+    """
+    current = head(document)
+    ref = blob_store.lookup_id(document)
+    if current is None or ref is None or ref["hash"] == current["hash"]:
+        return None
+    with _materialize_lock:
+        ref = blob_store.lookup_id(document)
+        if ref is None or ref["hash"] == current["hash"] or not _known(document, ref["hash"]):
+            return None
+        if blob_store.has_blob(current["hash"], current["size"]):
+            # Versions seen before (e.g. an older one saved again) need no rebuild
+            return blob_store.put_existing(current["hash"], file_path)
+        staged = blob_store.staging_path()
+        try:
+            write_version(document, current["version"], staged)
+            stored = blob_store.put(staged, file_path, sha256=current["hash"])
+        except BaseException:
+            if os.path.exists(staged):
+                os.remove(staged)
+            raise
+    print(f"🧩 Materialized version {current['version']} of {document}")
+    return stored
+
+
+def compact(document, file_path):
+    """Materialize the head and make it a snapshot so later versions start a new chain"""
+    stored = materialize(document, file_path)
+    current = head(document)
+    if not current["snapshot"]:
+        blob_store.retain_blob(current["hash"])
+        with catalog.transaction() as conn:
+            conn.execute(
+                "UPDATE pdf_versions SET snapshot = 1, depth = 0 WHERE document = ? AND version = ?",
+                (document, current["version"])
+            )
+        print(f"🗜️ Compacted {document} at version {current['version']}")
+    _prune(document)
+    return stored
+
+
+def _prune(document):
+    """Forget versions beyond the history limit, keeping the snapshot the oldest kept version needs"""
+    conn = catalog.get_connection()
+    latest = conn.execute("SELECT MAX(version) FROM pdf_versions WHERE document = ?", (document,)).fetchone()[0]
+    if latest is None or latest <= HISTORY:
+        return
+    oldest_kept = latest - HISTORY + 1
+    floor = conn.execute(
+        "SELECT MAX(version) FROM pdf_versions WHERE document = ? AND version <= ? AND snapshot = 1",
+        (document, oldest_kept)
+    ).fetchone()[0]
+    if floor is None:
+        return
+    _drop(document, "version < ?", (floor,))
+
+
+def _drop(document, condition, params):
+    with catalog.transaction() as conn:
+        rows = conn.execute(
+            f"SELECT hash, delta_hash, snapshot FROM pdf_versions WHERE document = ? AND {condition}",
+            (document, *params)
+        ).fetchall()
+        conn.execute(f"DELETE FROM pdf_versions WHERE document = ? AND {condition}", (document, *params))
+    for row in rows:
+        blob_store.release_blob(row["hash"] if row["snapshot"] else row["delta_hash"])
+        if row["snapshot"] and row["delta_hash"]:
+            blob_store.release_blob(row["delta_hash"])
+    if rows:
+        blob_store.collect_garbage()
+
+
+def remove_documents(documents):
+    """Drop the version history of deleted documents"""
+    for document in documents:
+        _drop(document, "1 = 1", ())
@@ -0,0 +1,14 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def new_executor(max_workers):
+    """A process pool for CPU-bound work (rasterizing, transcoding, rewriting PDFs)
+
+    Workers are started with ``spawn``: forking the server, which already
+    runs request, job and watcher threads, can leave a child blocked on a
+    lock another thread held at fork time.  A spawned worker imports only
+    the module of the function it runs (and the main script, which is why
+    ``serve.py`` imports the app inside its ``__main__`` block).
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
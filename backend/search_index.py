@@ -0,0 +1,269 @@
+import re
+import queue
+import threading
+from datetime import datetime
+from html import unescape
+
+import blob_store
+import catalog
+
+try:
+    import pymupdf
+except ImportError:  # PDF text is not indexed without PyMuPDF
+    pymupdf = None
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Title matches outweigh body matches in bm25 ranking
+TITLE_WEIGHT = 5.0
+
+# Searchable rows live in search_entries; search_fts is an external-content
+# FTS5 index over them kept in sync by triggers
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS search_entries (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        folder TEXT NOT NULL DEFAULT '',
+        path TEXT NOT NULL DEFAULT '',
+        page INTEGER,
+        title TEXT NOT NULL DEFAULT '',
+        body TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS idx_search_entries_ref ON search_entries (kind, ref);
+    CREATE INDEX IF NOT EXISTS idx_search_entries_folder ON search_entries (folder);
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+        body,
+        title,
+        content = 'search_entries',
+        content_rowid = 'id',
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS search_entries_ai AFTER INSERT ON search_entries BEGIN
+        INSERT INTO search_fts (rowid, body, title) VALUES (new.id, new.body, new.title);
+    END;
+    CREATE TRIGGER IF NOT EXISTS search_entries_ad AFTER DELETE ON search_entries BEGIN
+        INSERT INTO search_fts (search_fts, rowid, body, title) VALUES ('delete', old.id, old.body, old.title);
+    END;
+    CREATE TRIGGER IF NOT EXISTS search_entries_au AFTER UPDATE OF body, title ON search_entries BEGIN
+        INSERT INTO search_fts (search_fts, rowid, body, title) VALUES ('delete', old.id, old.body, old.title);
+        INSERT INTO search_fts (rowid, body, title) VALUES (new.id, new.body, new.title);
+    END;
+
+    CREATE TABLE IF NOT EXISTS search_sources (
+        kind TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        hash TEXT,
+        indexed_at TEXT NOT NULL,
+        PRIMARY KEY (kind, ref)
+    );
+"""
+
+_tasks = queue.Queue()
+_worker = None
+_TAG_RE = re.compile(r"<[^>]+>")
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def init_search_index():
+    """Create the FTS tables and start the background indexer, backfilling anything missing"""
+    global _worker
+    catalog.get_connection().executescript(SCHEMA)
+    if _worker is None:
+        _worker = threading.Thread(target=_run_worker, name="search-indexer", daemon=True)
+        _worker.start()
+    _tasks.put((backfill, ()))
+
+
+def _run_worker():
+    while True:
+        task, args = _tasks.get()
+        try:
+            task(*args)
+        except Exception as e:
+            print(f"❌ Search indexing failed: {str(e)}")
+        finally:
+            _tasks.task_done()
+
+
+def _replace_entries(kind, ref, content_hash, rows):
+    """Swap the indexed rows of one source in a single transaction"""
+    with catalog.transaction() as conn:
+        conn.execute("DELETE FROM search_entries WHERE kind = ? AND ref = ?", (kind, ref))
+        conn.executemany(
+            "INSERT INTO search_entries (body, title, kind, ref, folder, path, page) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(body, title, kind, ref, folder, path, page) for body, title, folder, path, page in rows]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO search_sources (kind, ref, hash, indexed_at) VALUES (?, ?, ?, ?)",
+            (kind, ref, content_hash, datetime.now().isoformat())
+        )
+
+
+def remove(kind, ref):
+    """Drop one indexed source"""
+    with catalog.transaction() as conn:
+        conn.execute("DELETE FROM search_entries WHERE kind = ? AND ref = ?", (kind, ref))
+        conn.execute("DELETE FROM search_sources WHERE kind = ? AND ref = ?", (kind, ref))
+
+
+def remove_folder(folder):
+    """Drop everything indexed under a top-level folder"""
+    with catalog.transaction() as conn:
+        refs = conn.execute("SELECT DISTINCT kind, ref FROM search_entries WHERE folder = ?", (folder,)).fetchall()
+        conn.execute("DELETE FROM search_entries WHERE folder = ?", (folder,))
+        conn.executemany(
+            "DELETE FROM search_sources WHERE kind = ? AND ref = ?", [(row["kind"], row["ref"]) for row in refs]
+        )
+
+
+def move(kind, ref, folder, path, title=None):
+    """Follow a source that moved to another folder or path, retitling it when given a title"""
+    with catalog.transaction() as conn:
+        if title is None:
+            conn.execute("UPDATE search_entries SET folder = ?, path = ? WHERE kind = ? AND ref = ?",
+                         (folder, path, kind, ref))
+        else:
+            conn.execute("UPDATE search_entries SET folder = ?, path = ?, title = ? WHERE kind = ? AND ref = ?",
+                         (folder, path, title, kind, ref))
+
+
+def move_folder(folder, new_folder):
+    """Follow a renamed top-level folder; file paths inside it are relative to the upload root"""
+    subfolders, params = catalog.prefix_filter("folder", folder + "/")
+    with catalog.transaction() as conn:
+        conn.execute(
+            f"UPDATE search_entries SET path = CASE WHEN substr(path, 1, ?) = ? THEN ? || substr(path, ?) ELSE path END, "
+            f"folder = ? || substr(folder, ?) WHERE folder = ? OR ({subfolders})",
+            (len(folder) + 1, folder + "/", new_folder, len(folder) + 1, new_folder, len(folder) + 1, folder, *params)
+        )
+
+
+def _strip_html(text):
+    return unescape(_TAG_RE.sub(" ", text or ""))
+
+
+# ---------------------------------------------------------------- PDFs
+
+def index_pdf(file_id, content_hash, pdf_path, folder, path):
+    """Extract a PDF's text page by page into the index, unless this version is already indexed"""
+    if pymupdf is None:
+        return
+    row = catalog.get_connection().execute(
+        "SELECT hash FROM search_sources WHERE kind = 'pdf' AND ref = ?", (file_id,)
+    ).fetchone()
+    if row is not None and row["hash"] == content_hash:
+        return
+    # Skip versions that were replaced or deleted while waiting in the queue
+    current = blob_store.lookup_id(file_id)
+    if current is None or current["hash"] != content_hash:
+        return
+    title = path.rsplit("/", 1)[-1]
+    rows = []
+    with pymupdf.open(pdf_path) as doc:
+        for page_number, page in enumerate(doc, start=1):
+            text = page.get_text().strip()
+            if text:
+                rows.append((text, title, folder, path, page_number))
+    # A PDF without a text layer is still findable by name
+    if not rows:
+        rows.append(("", title, folder, path, None))
+    _replace_entries("pdf", file_id, content_hash, rows)
+
+
+def queue_backfill():
+    """Index whatever is missing in the background, e.g. after records were restored"""
+    _tasks.put((backfill, ()))
+
+
+def queue_pdf(file_id, content_hash, pdf_path, folder, path):
+    """Index a PDF in the background after it was uploaded or saved"""
+    _tasks.put((index_pdf, (file_id, content_hash, pdf_path, folder, path)))
+
+
+# ---------------------------------------------------------------- snips and highlights
+
+def index_snip(snip):
+    """Index a snip's title and description"""
+    _replace_entries("snip", snip["id"], None, [
+        (snip.get("description", ""), snip.get("title", ""), snip.get("folder", ""), snip.get("filename", ""), None)
+    ])
+
+
+def _highlight_texts(highlights):
+    for highlight in highlights or []:
+        if isinstance(highlight, str):
+            yield highlight
+        elif isinstance(highlight, dict):
+            for key in ("text", "content", "comment", "note"):
+                value = highlight.get(key)
+                if isinstance(value, str) and value.strip():
+                    yield value
+
+
+def index_highlighted_pdf(highlighted_pdf):
+    """Index the highlighted passages of a highlighted PDF record"""
+    body = "\n".join(_highlight_texts(highlighted_pdf.get("highlights")))
+    if not body:
+        body = _strip_html(highlighted_pdf.get("highlighted_content"))
+    _replace_entries("highlight", highlighted_pdf["id"], None, [
+        (body, highlighted_pdf.get("original_pdf") or highlighted_pdf.get("filename", ""),
+         highlighted_pdf.get("folder", ""), highlighted_pdf.get("filename", ""), None)
+    ])
+
+
+def backfill():
+    """Index records that were stored before the search index existed"""
+    conn = catalog.get_connection()
+    indexed = {(row["kind"], row["ref"]) for row in conn.execute("SELECT kind, ref FROM search_sources")}
+    for snip in catalog.list_snips():
+        if ("snip", snip["id"]) not in indexed:
+            index_snip(snip)
+    for highlighted_pdf in catalog.list_highlighted_pdfs():
+        if ("highlight", highlighted_pdf["id"]) not in indexed:
+            index_highlighted_pdf(highlighted_pdf)
+
+    for row in conn.execute(
+        "SELECT id, path, folder, hash FROM file_refs WHERE lower(path) LIKE '%.pdf'"
+    ).fetchall():
+        if ("pdf", row["id"]) not in indexed:
+            _tasks.put((index_pdf, (row["id"], row["hash"], blob_store.readable_path(row["hash"]),
+                                    row["folder"], row["path"])))
+
+
+# ---------------------------------------------------------------- queries
+
+def _match_expression(query):
+    """Turn free text into a safe FTS5 expression: every word must match, the last as a prefix"""
+    tokens = _TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search(query, folder=None, kind=None, limit=DEFAULT_LIMIT):
+    """Ranked hits with page numbers and highlighted snippets"""
+    expression = _match_expression(query)
+    if expression is None:
+        return []
+    sql = (
+        "SELECT e.kind, e.ref, e.folder, e.path, e.page, e.title, "
+        "snippet(search_fts, 0, '<mark>', '</mark>', '…', 12) AS snippet, "
+        f"bm25(search_fts, 1.0, {TITLE_WEIGHT}) AS score "
+        "FROM search_fts JOIN search_entries AS e ON e.id = search_fts.rowid "
+        "WHERE search_fts MATCH ?"
+    )
+    params = [expression]
+    if folder:
+        sql += " AND e.folder = ?"
+        params.append(folder)
+    if kind:
+        sql += " AND e.kind = ?"
+        params.append(kind)
+    sql += " ORDER BY score LIMIT ?"
+    params.append(min(max(limit, 1), MAX_LIMIT))
+    return [dict(row) for row in catalog.get_connection().execute(sql, params)]
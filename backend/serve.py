@@ -0,0 +1,47 @@
+"""Production entry point: serves the Flask app with waitress
+
+    python serve.py
+
+One process runs a pool of worker threads.  Waitress reads request bodies
+and writes responses (including files sent with ``wsgi.file_wrapper``) in
+its own I/O loop, so slow uploads and large downloads do not hold a worker.
+All metadata lives in the SQLite catalog, which every thread (and any other
+process) reads and writes consistently.  The screenshot watcher and snip
+jobs are kept in memory, which is why the server runs as a single process
+(CPU-bound rendering and transcoding run in spawned worker pools).
+Long-polls and event streams do hold a worker while they wait; the app lets
+only ``BACKEND_WAIT_SLOTS`` of them (a quarter of the pool by default) do so.
+"""
+import os
+
+from waitress import serve
+
+HOST = os.environ.get("BACKEND_HOST", "127.0.0.1")
+PORT = int(os.environ.get("BACKEND_PORT", "5000"))
+# Requests handled at the same time
+THREADS = int(os.environ.get("BACKEND_THREADS", "16"))
+# Largest request body accepted, e.g. a whole folder upload
+MAX_REQUEST_BODY = int(os.environ.get("BACKEND_MAX_REQUEST_BODY", 16 * 1024 * 1024 * 1024))
+# Open connections allowed; long-polls and event streams each hold one
+CONNECTION_LIMIT = int(os.environ.get("BACKEND_CONNECTION_LIMIT", "1000"))
+
+
+if __name__ == "__main__":
+    # Imported here so the spawned render/transcode workers, which re-import
+    # this script, do not start a second copy of the app
+    from app import app
+
+    print(f"🚀 Serving on http://{HOST}:{PORT} with {THREADS} worker threads")
+    serve(
+        app,
+        host=HOST,
+        port=PORT,
+        threads=THREADS,
+        connection_limit=CONNECTION_LIMIT,
+        max_request_body_size=MAX_REQUEST_BODY,
+        # Bodies above 1 MB are spooled to disk instead of memory before dispatch
+        inbuf_overflow=1024 * 1024,
+        # Keep long-polls (up to 30 s) open
+        channel_timeout=120,
+        ident="indinfra"
+    )
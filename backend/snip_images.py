@@ -0,0 +1,181 @@
+import os
+import threading
+
+import blob_store
+import catalog
+import process_pool
+
+try:
+    from PIL import Image, features
+except ImportError:  # Snips are kept as uploaded without Pillow
+    Image = None
+
+# Encoder processes (image transcoding is CPU bound)
+SNIP_IMAGE_WORKERS = int(os.environ.get("SNIP_IMAGE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Largest snip upload accepted
+SNIP_MAX_BYTES = int(os.environ.get("SNIP_MAX_BYTES", 50 * 1024 * 1024))
+# Images above this many pixels are rejected as decompression bombs
+SNIP_MAX_PIXELS = int(os.environ.get("SNIP_MAX_PIXELS", 100_000_000))
+# Longest side of the display rendition and width of grid thumbnails
+DISPLAY_MAX_SIDE = 2048
+THUMBNAIL_WIDTH = 320
+WEBP_QUALITY = 85
+AVIF_QUALITY = 60
+
+_executor = None
+_lock = threading.Lock()
+_on_original_replaced = None
+
+
+def available():
+    return Image is not None
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = process_pool.new_executor(SNIP_IMAGE_WORKERS)
+        return _executor
+
+
+def _save(image, path, image_format, **options):
+    image.save(path, image_format, **options)
+    return {"path": path, "format": image_format.lower(), "width": image.width, "height": image.height}
+
+
+def _save_webp(image, path):
+    """Encode lossy and lossless WebP and keep the smaller; text-heavy screenshots favour lossless"""
+    lossy = _save(image, path, "WEBP", quality=WEBP_QUALITY, method=6)
+    lossy_size = os.path.getsize(path)
+    lossless_path = f"{path}.lossless"
+    _save(image, lossless_path, "WEBP", lossless=True, quality=100, method=4)
+    if os.path.getsize(lossless_path) < lossy_size:
+        os.replace(lossless_path, path)
+    else:
+        os.remove(lossless_path)
+    return lossy
+
+
+def render_renditions(source_path, output_prefix, max_pixels=SNIP_MAX_PIXELS):
+    """Transcode one snip; runs inside a worker process
+
+    Writes a losslessly optimized PNG, WebP (and AVIF where supported)
+    display renditions and a WebP grid thumbnail next to ``output_prefix``
+    and returns their formats, dimensions and paths.
+    """
+    with Image.open(source_path) as image:
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ValueError(f"Image of {width}x{height} pixels exceeds the {max_pixels} pixel limit")
+        image.load()
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    outputs = {"original": _save(image, f"{output_prefix}.png", "PNG", optimize=True)}
+
+    display = image.copy()
+    display.thumbnail((DISPLAY_MAX_SIDE, DISPLAY_MAX_SIDE), Image.LANCZOS)
+    outputs["display"] = _save_webp(display, f"{output_prefix}.display.webp")
+    if features.check("avif"):
+        outputs["displayAvif"] = _save(display, f"{output_prefix}.display.avif", "AVIF", quality=AVIF_QUALITY)
+
+    thumb = image.copy()
+    thumb.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4), Image.LANCZOS)
+    outputs["thumb"] = _save_webp(thumb, f"{output_prefix}.thumb.webp")
+    return {"width": width, "height": height, "outputs": outputs}
+
+
+def init_snip_images(on_original_replaced=None):
+    """Remember the hook for replaced originals and queue snips that were never processed
+
+    ``on_original_replaced(file_path, stored, old_size)`` is called after a
+    snip file was swapped for its optimized encoding.
+    """
+    global _on_original_replaced
+    _on_original_replaced = on_original_replaced
+    if Image is None:
+        return
+    for row in catalog.get_connection().execute(
+        "SELECT id FROM snips WHERE image_status = 'pending'"
+    ).fetchall():
+        process(row["id"])
+
+
+def process(snip_id):
+    """Transcode a snip's image in the background"""
+    snip = catalog.get_snip(snip_id)
+    if Image is None or snip is None or not snip.get("file_path") or not os.path.isfile(snip["file_path"]):
+        return
+    stored = blob_store.lookup(snip["file_path"])
+    source = blob_store.blob_path(stored["hash"]) if stored else snip["file_path"]
+    output_prefix = blob_store.staging_path()
+    try:
+        future = _get_executor().submit(render_renditions, source, output_prefix)
+    except Exception as e:
+        print(f"❌ Could not queue snip {snip_id} for processing: {str(e)}")
+        return
+    future.add_done_callback(lambda done: _record(snip, stored, done))
+
+
+def _discard_outputs(outputs):
+    for output in outputs.values():
+        if os.path.exists(output["path"]):
+            os.remove(output["path"])
+
+
+def _record(snip, source, future):
+    """Store the renditions of a finished job and publish them on the snip"""
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        print(f"❌ Could not process snip {snip['id']}: {future.exception()}")
+        catalog.set_snip_image(snip["id"], "failed")
+        return
+    result = future.result()
+    outputs = result["outputs"]
+    try:
+        original = outputs.pop("original")
+        size = source["size"] if source else os.path.getsize(snip["file_path"])
+        # Keep the optimized encoding only when it is smaller; pixels are identical
+        current = blob_store.lookup(snip["file_path"])
+        if os.path.getsize(original["path"]) < size and current is not None and source is not None \
+                and current["hash"] == source["hash"]:
+            stored = blob_store.put(original["path"], snip["file_path"])
+            if _on_original_replaced is not None:
+                _on_original_replaced(snip["file_path"], stored, size)
+            size = stored["size"]
+        else:
+            os.remove(original["path"])
+
+        renditions = {}
+        for name, output in outputs.items():
+            kept = blob_store.store_blob(output["path"])
+            renditions[name] = {"format": output["format"], "width": output["width"], "height": output["height"],
+                                "size": kept["size"], "hash": kept["hash"]}
+    except BaseException:
+        _discard_outputs(outputs)
+        raise
+
+    previous = snip.get("renditions") or {}
+    if not catalog.set_snip_image(snip["id"], "ready", result["width"], result["height"], size, renditions):
+        # The snip was deleted meanwhile
+        release(renditions)
+    else:
+        release(previous)
+    print(f"🖼️ Processed snip {snip['id']}: {size} bytes, {', '.join(renditions)}")
+
+
+def release(renditions):
+    """Drop the blob references held by a snip's renditions"""
+    for rendition in (renditions or {}).values():
+        blob_store.release_blob(rendition["hash"])
+    if renditions:
+        blob_store.collect_garbage()
+
+
+def choose_display(renditions, accept):
+    """Smallest display rendition the Accept header allows, or None to send the original"""
+    candidates = [renditions[name] for name, mimetype in (("displayAvif", "image/avif"), ("display", "image/webp"))
+                  if name in renditions and mimetype in accept]
+    return min(candidates, key=lambda rendition: rendition["size"]) if candidates else None
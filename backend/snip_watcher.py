@@ -0,0 +1,191 @@
+import os
+import time
+import uuid
+import threading
+from collections import deque
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # Fall back to polling the screenshot folders
+    Observer = None
+    FileSystemEventHandler = object
+
+SNIP_EXTENSIONS = (".png", ".jpg")
+# How long a snip job waits for a screenshot before it expires
+SNIP_TIMEOUT = int(os.environ.get("SNIP_TIMEOUT", "60"))
+# Seconds between scans when no native file watcher is available
+POLL_INTERVAL = float(os.environ.get("SNIP_POLL_INTERVAL", "0.25"))
+# A new file counts as complete once its size stops changing for this long
+SETTLE_INTERVAL = 0.1
+SETTLE_TIMEOUT = 5
+# Finished jobs are kept this long for late status requests
+JOB_TTL = 600
+
+
+def default_folders():
+    """Folders the Windows Snipping Tool saves to, or SNIP_WATCH_FOLDERS (os.pathsep separated)"""
+    if os.environ.get("SNIP_WATCH_FOLDERS"):
+        return [folder for folder in os.environ["SNIP_WATCH_FOLDERS"].split(os.pathsep) if folder]
+    home = os.path.expanduser("~")
+    return [
+        os.path.join(home, "Pictures", "Screenshots"),
+        os.path.join(home, "OneDrive", "Pictures", "Screenshots"),
+        os.path.join(home, "Pictures")
+    ]
+
+
+_jobs = {}
+_pending = deque()
+_condition = threading.Condition()
+_handler = None
+_watching = False
+
+
+def _is_snip(path):
+    return path.lower().endswith(SNIP_EXTENSIONS) and not os.path.basename(path).startswith(".")
+
+
+def _wait_until_stable(path):
+    """Wait until a freshly created file is fully written; False if it vanished"""
+    deadline = time.time() + SETTLE_TIMEOUT
+    last = None
+    while time.time() < deadline:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        current = (stat.st_size, stat.st_mtime)
+        if current == last and stat.st_size > 0:
+            return True
+        last = current
+        time.sleep(SETTLE_INTERVAL)
+    return True
+
+
+def _on_new_file(path):
+    """Hand a new screenshot to the oldest waiting snip job"""
+    if not _is_snip(path) or not _wait_until_stable(path):
+        return
+    with _condition:
+        job = None
+        while _pending:
+            candidate = _jobs.get(_pending.popleft())
+            if candidate is not None and candidate["status"] == "pending":
+                job = candidate
+                job["status"] = "processing"
+                break
+    if job is None:
+        return
+
+    print(f"📸 New snip detected: {path}")
+    try:
+        result = _handler(job, path)
+        _finish(job["id"], "done", **result)
+    except Exception as e:
+        print(f"❌ Error moving snip: {e}")
+        _finish(job["id"], "failed", error=f"Failed to move snip: {str(e)}")
+
+
+def _finish(job_id, status, **fields):
+    with _condition:
+        job = _jobs[job_id]
+        job.update(fields, status=status, finishedAt=time.time())
+        _condition.notify_all()
+
+
+class _SnipEventHandler(FileSystemEventHandler):
+    def on_created(self, event):
+        if not event.is_directory:
+            threading.Thread(target=_on_new_file, args=(event.src_path,), daemon=True).start()
+
+    def on_moved(self, event):
+        # Some tools write to a temp name and rename it into place
+        if not event.is_directory:
+            threading.Thread(target=_on_new_file, args=(event.dest_path,), daemon=True).start()
+
+
+def _snapshot(folders):
+    entries = set()
+    for folder in folders:
+        try:
+            with os.scandir(folder) as scan:
+                entries.update(entry.path for entry in scan if entry.is_file() and _is_snip(entry.name))
+        except OSError:
+            continue
+    return entries
+
+
+def _poll(folders):
+    known = _snapshot(folders)
+    while True:
+        time.sleep(POLL_INTERVAL)
+        current = _snapshot(folders)
+        for path in sorted(current - known):
+            threading.Thread(target=_on_new_file, args=(path,), daemon=True).start()
+        known = current
+
+
+def _expire_jobs():
+    """Fail jobs nobody answered in time and forget old finished ones"""
+    while True:
+        time.sleep(1)
+        now = time.time()
+        with _condition:
+            for job in list(_jobs.values()):
+                if job["status"] == "pending" and now - job["createdAt"] > SNIP_TIMEOUT:
+                    job.update(status="expired", error="No new snip detected. Please try again.", finishedAt=now)
+                    _condition.notify_all()
+                elif job.get("finishedAt") and now - job["finishedAt"] > JOB_TTL:
+                    del _jobs[job["id"]]
+
+
+def start(handler, folders=None):
+    """Start watching the screenshot folders once per process
+
+    ``handler(job, screenshot_path)`` stores a detected screenshot for a job
+    and returns the fields to publish on it (for example ``file_path``).
+    """
+    global _handler, _watching
+    _handler = handler
+    if _watching:
+        return
+    _watching = True
+    folders = folders or default_folders()
+    existing = [folder for folder in folders if os.path.isdir(folder)]
+
+    if Observer is not None and existing:
+        observer = Observer()
+        for folder in existing:
+            observer.schedule(_SnipEventHandler(), folder, recursive=False)
+        observer.daemon = True
+        observer.start()
+        print(f"👀 Watching for snips in {', '.join(existing)}")
+    else:
+        threading.Thread(target=_poll, args=(folders,), name="snip-poller", daemon=True).start()
+        print(f"👀 Polling for snips every {POLL_INTERVAL}s in {', '.join(folders)}")
+    threading.Thread(target=_expire_jobs, name="snip-job-expiry", daemon=True).start()
+
+
+def create_job(folder):
+    """Register a snip job that the next new screenshot will complete"""
+    job_id = str(uuid.uuid4())
+    with _condition:
+        _jobs[job_id] = {"id": job_id, "folder": folder, "status": "pending", "createdAt": time.time()}
+        _pending.append(job_id)
+    return dict(_jobs[job_id])
+
+
+def get_job(job_id, wait=0):
+    """Return a job, blocking up to ``wait`` seconds while it is still in progress"""
+    deadline = time.time() + wait
+    with _condition:
+        while True:
+            job = _jobs.get(job_id)
+            if job is None or job["status"] not in ("pending", "processing"):
+                return dict(job) if job else None
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return dict(job)
+            _condition.wait(remaining)
+
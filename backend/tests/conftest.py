@@ -0,0 +1,74 @@
+import io
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+# The app keeps its uploads and catalog relative to the working directory and
+# starts its workers on import, so it is imported once into a scratch directory
+WORKDIR = tempfile.mkdtemp(prefix="indinfra-tests-")
+os.makedirs(os.path.join(WORKDIR, "snips"), exist_ok=True)
+os.chdir(WORKDIR)
+os.environ["CATALOG_DB"] = os.path.join(WORKDIR, "catalog.db")
+os.environ["SNIP_WATCH_FOLDERS"] = os.path.join(WORKDIR, "snips")
+os.environ.setdefault("PDF_OPTIMIZE", "0")
+
+import app as backend  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    return backend
+
+
+@pytest.fixture
+def client():
+    return backend.app.test_client()
+
+
+@pytest.fixture
+def folder():
+    """A folder name no other test uses"""
+    return f"test-{uuid.uuid4().hex[:10]}"
+
+
+def make_pdf(text):
+    """Bytes of a one-page PDF showing ``text``"""
+    import pymupdf
+    document = pymupdf.open()
+    document.new_page().insert_text((72, 72), text)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def upload(client, folder, name, data, route="/upload-pdf", field="file"):
+    return client.post(route, data={"folder": folder, field: (io.BytesIO(data), name)},
+                       content_type="multipart/form-data")
+
+
+def wait_for_job(client, job_id):
+    response = client.get(f"/jobs/{job_id}?wait=10")
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def create_folder(client, name, files):
+    """Upload ``{relative path: bytes}`` as a new folder through a chunked upload; returns the folder id"""
+    session = client.post("/chunked-uploads", json={
+        "kind": "folder", "folder": name,
+        "files": [{"path": path, "size": len(data)} for path, data in files.items()]
+    }).get_json()
+    for entry in session["files"]:
+        data = files[entry["path"]]
+        if data:
+            response = client.put(f"/chunked-uploads/{session['uploadId']}/files/{entry['fileId']}?offset=0", data=data)
+            assert response.status_code == 200, response.get_json()
+    response = client.post(f"/chunked-uploads/{session['uploadId']}/finalize")
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["folderId"]
@@ -0,0 +1,25 @@
+import pytest
+
+import annotations
+
+
+@pytest.mark.parametrize("rect", [
+    [True, 0, 10, 10],
+    [0, 0, float("nan"), 10],
+    [0, 0, 10, float("inf")],
+    [0, 0, 10, "10"],
+])
+def test_rects_must_be_finite_numbers(rect):
+    with pytest.raises(annotations.AnnotationError):
+        annotations.validate({"page": 1, "rects": [rect]})
+
+
+def test_version_must_not_be_a_bool():
+    with pytest.raises(annotations.AnnotationError):
+        annotations.validate({"page": 1, "version": True})
+
+
+def test_valid_annotation_is_normalised():
+    entry = annotations.validate({"page": 2, "rects": [[0, 0.5, 10, 20]], "version": 3})
+    assert entry["rects"] == "[[0, 0.5, 10, 20]]"
+    assert entry["expected_version"] == 3
@@ -0,0 +1,83 @@
+import io
+import os
+import threading
+import time
+import uuid
+
+import blob_store
+
+
+def unique_bytes():
+    return f"blob {uuid.uuid4()}".encode() * 100
+
+
+def refcount(blob_hash):
+    row = blob_store.catalog.get_connection().execute(
+        "SELECT refcount FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+    return row["refcount"] if row else None
+
+
+def test_identical_files_share_one_blob(app_module, folder):
+    data = unique_bytes()
+    first_path = os.path.join(app_module.UPLOAD_FOLDER, folder, "a.bin")
+    second_path = os.path.join(app_module.UPLOAD_FOLDER, folder, "b.bin")
+
+    first = blob_store.put(io.BytesIO(data), first_path)
+    second = blob_store.put(io.BytesIO(data), second_path)
+
+    assert not first["deduplicated"] and second["deduplicated"]
+    assert first["hash"] == second["hash"]
+    assert refcount(first["hash"]) == 2
+    assert os.stat(first_path).st_ino == os.stat(second_path).st_ino == os.stat(blob_store.blob_path(first["hash"])).st_ino
+
+
+def test_unreferenced_blobs_are_collected(app_module, folder):
+    path = os.path.join(app_module.UPLOAD_FOLDER, folder, "a.bin")
+    old = blob_store.put(io.BytesIO(unique_bytes()), path)
+    new = blob_store.put(io.BytesIO(unique_bytes()), path)
+    assert new["previousHash"] == old["hash"]
+
+    blob_store.collect_garbage()
+    assert refcount(old["hash"]) is None
+    assert not os.path.exists(blob_store.blob_path(old["hash"]))
+
+    blob_store.remove(path)
+    blob_store.collect_garbage()
+    assert refcount(new["hash"]) is None
+    assert not os.path.exists(blob_store.blob_path(new["hash"]))
+
+
+def test_store_during_collection_keeps_its_blob(monkeypatch):
+    data = unique_bytes()
+    orphan = blob_store.store_blob(io.BytesIO(data))
+    blob_store.release_blob(orphan["hash"])
+
+    # Hold the collector just before it unlinks the orphan
+    collecting, proceed = threading.Event(), threading.Event()
+    remove = os.remove
+
+    def paused_remove(path, *args, **kwargs):
+        if path == blob_store.blob_path(orphan["hash"]):
+            collecting.set()
+            proceed.wait(10)
+        remove(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "remove", paused_remove)
+    collector = threading.Thread(target=blob_store.collect_garbage)
+    collector.start()
+    assert collecting.wait(10)
+
+    stored = {}
+    writer = threading.Thread(target=lambda: stored.update(blob_store.store_blob(io.BytesIO(data))))
+    writer.start()
+    time.sleep(0.2)
+    proceed.set()
+    collector.join(10)
+    writer.join(10)
+
+    assert stored["hash"] == orphan["hash"]
+    assert not stored["deduplicated"]
+    assert refcount(orphan["hash"]) == 1
+    with open(blob_store.blob_path(orphan["hash"]), "rb") as f:
+        assert f.read() == data
+    blob_store.release_blob(orphan["hash"])
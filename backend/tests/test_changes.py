@@ -0,0 +1,73 @@
+import threading
+import time
+
+import changes
+from conftest import make_pdf, upload
+
+
+def head(client):
+    return client.get("/changes?limit=1").get_json()["head"]
+
+
+def test_changes_resume_from_the_last_seq(client, folder):
+    since = head(client)
+    upload(client, folder, "doc.pdf", make_pdf("doc"))
+
+    delta = client.get(f"/changes?since={since}").get_json()
+    files = [change for change in delta["changes"] if change["entity"] == "file" and change["folder"] == folder]
+    assert [change["op"] for change in files] == ["upsert"]
+    assert files[0]["item"]["filename"] == "doc.pdf"
+    assert delta["seq"] == delta["head"] > since
+
+    assert client.get(f"/changes?since={delta['seq']}").get_json()["changes"] == []
+
+
+def test_change_stream_resumes_from_last_event_id(client, folder):
+    since = head(client)
+    upload(client, folder, "a.pdf", make_pdf("a"))
+    upload(client, folder, "b.pdf", make_pdf("b"))
+
+    body = client.get("/changes/events?timeout=0", headers={"Last-Event-ID": str(since)}).get_data(as_text=True)
+    ids = [int(line[4:]) for line in body.splitlines() if line.startswith("id: ")]
+    assert ids and min(ids) > since
+    assert f"{folder}/a.pdf" in body and f"{folder}/b.pdf" in body
+
+    body = client.get("/changes/events?timeout=0", headers={"Last-Event-ID": str(max(ids))}).get_data(as_text=True)
+    assert "event: change" not in body
+
+
+def test_expired_positions_ask_for_a_reset(client, folder, monkeypatch):
+    upload(client, folder, "doc.pdf", make_pdf("doc"))
+    monkeypatch.setattr(changes, "CHANGE_RETENTION", -1)
+    changes.prune()
+    upload(client, folder, "later.pdf", make_pdf("later"))
+
+    response = client.get("/changes?since=0")
+    assert response.status_code == 410
+    assert response.get_json()["reset"] is True
+    assert response.get_json()["seq"] == head(client)
+    body = client.get("/changes/events?since=0&timeout=0").get_data(as_text=True)
+    assert "event: reset" in body
+
+
+def test_long_poll_wakes_on_a_change(client, folder, app_module):
+    since = head(client)
+    timer = threading.Timer(0.3, lambda: upload(app_module.app.test_client(), folder, "doc.pdf", make_pdf("doc")))
+    timer.start()
+    started = time.time()
+    delta = client.get(f"/changes?since={since}&wait=10").get_json()
+    timer.join()
+    assert delta["head"] > since
+    assert time.time() - started < 5
+
+
+def test_waits_beyond_the_slots_are_answered_at_once(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "_wait_slots", threading.BoundedSemaphore(1))
+    app_module._wait_slots.acquire()
+    since = head(client)
+
+    started = time.time()
+    assert client.get(f"/changes?since={since}&wait=10").status_code == 200
+    body = client.get(f"/changes/events?since={since}&timeout=10").get_data(as_text=True)
+    assert time.time() - started < 2
+    assert body.startswith(f"retry: {app_module.BUSY_STREAM_RETRY_MS}")
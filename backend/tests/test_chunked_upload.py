@@ -0,0 +1,93 @@
+import hashlib
+import os
+import uuid
+
+import blob_store
+from conftest import make_pdf, upload
+
+
+def test_resumed_folder_upload_is_finalized(client, app_module, folder):
+    data = uuid.uuid4().bytes * 1000
+    session = client.post("/chunked-uploads", json={
+        "kind": "folder", "folder": folder,
+        "files": [{"path": "docs/big.bin", "size": len(data)}, {"path": "empty.txt", "size": 0}]
+    }).get_json()
+    upload_id = session["uploadId"]
+    big = next(entry for entry in session["files"] if entry["path"] == "docs/big.bin")
+
+    assert client.put(f"/chunked-uploads/{upload_id}/files/{big['fileId']}?offset=0", data=data[:6000]).status_code == 200
+    assert client.post(f"/chunked-uploads/{upload_id}/finalize").status_code == 409
+    # A client that lost track asks where to resume
+    offsets = {entry["path"]: entry["offset"] for entry in client.get(f"/chunked-uploads/{upload_id}").get_json()["files"]}
+    assert offsets == {"docs/big.bin": 6000, "empty.txt": 0}
+    assert client.put(f"/chunked-uploads/{upload_id}/files/{big['fileId']}?offset=0", data=data[:10]).status_code == 409
+    assert client.put(f"/chunked-uploads/{upload_id}/files/{big['fileId']}?offset=6000", data=data[6000:]).status_code == 200
+
+    finalized = client.post(f"/chunked-uploads/{upload_id}/finalize").get_json()
+    assert finalized["fileCount"] == 2
+    assert client.get(f"/uploads/{folder}/docs/big.bin").data == data
+    assert os.path.getsize(os.path.join(app_module.UPLOAD_FOLDER, folder, "empty.txt")) == 0
+    assert client.get(f"/chunked-uploads/{upload_id}").status_code == 404
+    folders = client.get("/get-folders").get_json()
+    assert any(item["id"] == finalized["folderId"] for item in folders)
+
+
+def test_known_content_needs_no_transfer(client, folder):
+    data = uuid.uuid4().bytes * 100
+    upload(client, folder, "first.bin", data)
+    session = client.post("/chunked-uploads", json={
+        "kind": "pdf", "folder": folder,
+        "files": [{"path": "second.bin", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}]
+    }).get_json()
+    assert session["files"][0]["deduplicated"] and session["files"][0]["offset"] == len(data)
+
+    assert client.post(f"/chunked-uploads/{session['uploadId']}/finalize").status_code == 200
+    assert client.get(f"/uploads/{folder}/second.bin").data == data
+
+
+def test_corrupted_upload_is_rejected(client, folder):
+    data = b"expected bytes"
+    session = client.post("/chunked-uploads", json={
+        "kind": "pdf", "folder": folder,
+        "files": [{"path": "doc.bin", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}]
+    }).get_json()
+    entry = session["files"][0]
+    client.put(f"/chunked-uploads/{session['uploadId']}/files/{entry['fileId']}?offset=0", data=b"X" * len(data))
+
+    assert client.post(f"/chunked-uploads/{session['uploadId']}/finalize").status_code == 422
+    assert client.get(f"/uploads/{folder}/doc.bin").status_code == 404
+
+
+def test_finalize_replaces_a_versioned_pdf(client, folder):
+    upload(client, folder, "doc.pdf", make_pdf("one"), route="/save-current-pdf", field="pdf")
+    upload(client, folder, "doc.pdf", make_pdf("two"), route="/save-current-pdf", field="pdf")
+    newest = make_pdf("three")
+    session = client.post("/chunked-uploads", json={
+        "kind": "pdf", "folder": folder, "files": [{"path": "doc.pdf", "size": len(newest)}]
+    }).get_json()
+    entry = session["files"][0]
+    client.put(f"/chunked-uploads/{session['uploadId']}/files/{entry['fileId']}?offset=0", data=newest)
+    response = client.post("/upload-pdf", data={"uploadId": session["uploadId"]})
+    assert response.status_code == 200
+
+    assert client.get(f"/uploads/{folder}/doc.pdf").data == newest
+
+
+def test_known_content_survives_collection_before_finalize(client, folder):
+    data = uuid.uuid4().bytes * 100
+    upload(client, folder, "first.bin", data)
+    session = client.post("/chunked-uploads", json={
+        "kind": "pdf", "folder": folder,
+        "files": [{"path": "second.bin", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}]
+    }).get_json()
+    assert session["files"][0]["deduplicated"]
+    # The only file exposing the content goes away before the session is finalized
+    blob_store.remove(os.path.join(blob_store.UPLOAD_ROOT, folder, "first.bin"))
+    blob_store.collect_garbage()
+
+    assert client.post(f"/chunked-uploads/{session['uploadId']}/finalize").status_code == 200
+    assert client.get(f"/uploads/{folder}/second.bin").data == data
+    # Once placed, the session's hold is gone and the file's reference is the only one
+    blob_store.remove(os.path.join(blob_store.UPLOAD_ROOT, folder, "second.bin"))
+    blob_store.collect_garbage()
+    assert not os.path.exists(blob_store.blob_path(hashlib.sha256(data).hexdigest()))
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import threading
+import uuid
+
+import blob_store
+import object_store
+from conftest import upload, wait_for_job
+
+
+def local(url):
+    return url.replace("http://127.0.0.1:5000", "", 1)
+
+
+def test_parts_are_assembled_and_imported(client, folder):
+    data = uuid.uuid4().bytes * 1000
+    created = client.post("/direct-uploads", json={"folder": folder, "path": "big.bin", "size": len(data)}).get_json()
+    assert not created["deduplicated"]
+    parts = []
+    for part in created["parts"]:
+        start = (part["partNumber"] - 1) * created["partSize"]
+        response = client.put(local(part["url"]), data=data[start:start + created["partSize"]])
+        assert response.status_code == 200
+        parts.append({"partNumber": part["partNumber"], "etag": response.headers["ETag"]})
+
+    completed = client.post(f"/direct-uploads/{created['uploadId']}/complete", json={"parts": parts})
+    assert completed.status_code == 202
+    assert wait_for_job(client, completed.get_json()["jobId"])["status"] == "succeeded"
+    assert client.get(f"/uploads/{folder}/big.bin").data == data
+
+
+def test_known_content_survives_collection_before_import(client, folder):
+    data = uuid.uuid4().bytes * 100
+    upload(client, folder, "first.bin", data)
+    created = client.post("/direct-uploads", json={
+        "folder": folder, "path": "second.bin", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()
+    }).get_json()
+    assert created["deduplicated"]
+    blob_store.remove(os.path.join(blob_store.UPLOAD_ROOT, folder, "first.bin"))
+    blob_store.collect_garbage()
+
+    completed = client.post(f"/direct-uploads/{created['uploadId']}/complete", json={})
+    assert wait_for_job(client, completed.get_json()["jobId"])["status"] == "succeeded"
+    assert client.get(f"/uploads/{folder}/second.bin").data == data
+
+
+def test_cancelled_upload_releases_known_content(client, folder):
+    data = uuid.uuid4().bytes * 100
+    blob_hash = hashlib.sha256(data).hexdigest()
+    upload(client, folder, "first.bin", data)
+    created = client.post("/direct-uploads", json={
+        "folder": folder, "path": "second.bin", "size": len(data), "sha256": blob_hash
+    }).get_json()
+    assert client.delete(f"/direct-uploads/{created['uploadId']}").status_code == 200
+    assert client.delete(f"/direct-uploads/{created['uploadId']}").status_code == 200
+
+    blob_store.remove(os.path.join(blob_store.UPLOAD_ROOT, folder, "first.bin"))
+    blob_store.collect_garbage()
+    assert not os.path.exists(blob_store.blob_path(blob_hash))
+
+
+def test_concurrent_completes_import_once(app_module, folder, monkeypatch):
+    client = app_module.app.test_client()
+    data = uuid.uuid4().bytes * 100
+    created = client.post("/direct-uploads", json={"folder": folder, "path": "doc.bin", "size": len(data)}).get_json()
+    response = client.put(local(created["parts"][0]["url"]), data=data)
+    parts = [{"partNumber": 1, "etag": response.headers["ETag"]}]
+
+    # Hold the first complete while it assembles the parts
+    assembling, proceed = threading.Event(), threading.Event()
+    complete_multipart = object_store.storage.complete_multipart
+
+    def paused(*args):
+        assembling.set()
+        proceed.wait(10)
+        return complete_multipart(*args)
+
+    monkeypatch.setattr(object_store.storage, "complete_multipart", paused)
+    statuses = []
+    first = threading.Thread(target=lambda: statuses.append(app_module.app.test_client().post(
+        f"/direct-uploads/{created['uploadId']}/complete", json={"parts": parts}).status_code))
+    first.start()
+    assert assembling.wait(10)
+    second = client.post(f"/direct-uploads/{created['uploadId']}/complete", json={"parts": parts})
+    proceed.set()
+    first.join(10)
+
+    assert second.status_code == 409
+    assert statuses == [202]
@@ -0,0 +1,58 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+
+import catalog
+import jobs
+from conftest import make_pdf, upload
+
+
+def queued_import(app_module, folder, files):
+    """A folder and its import job, held in the queue for an hour; returns (folder id, job id)"""
+    folder_id = str(uuid.uuid4())
+    folder_path = os.path.join(app_module.UPLOAD_FOLDER, folder)
+    os.makedirs(folder_path, exist_ok=True)
+    catalog.add_folder(folder_id, folder, folder_path, datetime.now().isoformat())
+    job_id = jobs.new_job_id()
+    os.makedirs(jobs.job_directory(job_id))
+    staged_files = []
+    for index, (path, data) in enumerate(files.items()):
+        with open(os.path.join(jobs.job_directory(job_id), str(index)), "wb") as f:
+            f.write(data)
+        staged_files.append({"path": path, "staged": str(index)})
+    payload = {"folderId": folder_id, "folderName": folder, "files": staged_files}
+    with catalog.transaction() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, payload, run_after, created_at) VALUES (?, 'folder.import', ?, ?, ?)",
+            (job_id, json.dumps(payload), time.time() + 3600, datetime.now().isoformat())
+        )
+    return folder_id, job_id
+
+
+def test_import_keeps_files_added_while_it_runs(client, app_module, folder):
+    folder_id, job_id = queued_import(app_module, folder, {"a.txt": b"a" * 10, "b.pdf": make_pdf("b")})
+    assert upload(client, folder, "c.pdf", make_pdf("c")).status_code == 200
+
+    row = catalog.get_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    app_module.import_folder_job(jobs.Job(row))
+    with catalog.transaction() as conn:
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    stats = catalog.get_folder(folder_id)
+    assert stats["fileCount"] == 3
+    assert stats["pdfCount"] == 2
+    assert stats["totalBytes"] == sum(
+        os.path.getsize(os.path.join(app_module.UPLOAD_FOLDER, folder, name)) for name in ("a.txt", "b.pdf", "c.pdf")
+    )
+
+
+def test_cancelled_queued_import_trashes_its_folder(client, app_module, folder):
+    folder_id, job_id = queued_import(app_module, folder, {"a.txt": b"a"})
+
+    response = client.delete(f"/jobs/{job_id}")
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["status"] == "cancelled"
+    assert catalog.get_folder(folder_id) is None
+    assert any(entry["name"] == folder for entry in client.get("/trash").get_json())
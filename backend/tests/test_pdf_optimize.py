@@ -0,0 +1,62 @@
+import os
+
+import pymupdf
+
+import blob_store
+import pdf_optimize
+from conftest import make_pdf, upload
+
+
+def bulky_pdf():
+    """An uncompressed PDF that optimization shrinks"""
+    document = pymupdf.open()
+    for number in range(20):
+        page = document.new_page()
+        for line in range(40):
+            page.insert_text((36, 36 + line * 18), f"page {number} line {line} " * 4, fontsize=8)
+    data = document.tobytes(deflate=False, garbage=0)
+    document.close()
+    return data
+
+
+def optimize_uploaded(client, app_module, folder, during=None, monkeypatch=None):
+    """Upload a bulky PDF and optimize it, running ``during`` while the copy is checked"""
+    upload(client, folder, "doc.pdf", bulky_pdf())
+    ref = blob_store.lookup_id(blob_store.lookup(os.path.join(app_module.UPLOAD_FOLDER, folder, "doc.pdf"))["id"])
+    if during is not None:
+        page_count = pdf_optimize._page_count
+
+        def interfere(path):
+            during(ref)
+            return page_count(path)
+
+        monkeypatch.setattr(pdf_optimize, "_page_count", interfere)
+    file_path = os.path.join(app_module.UPLOAD_FOLDER, ref["path"])
+    result, stored = pdf_optimize.optimize(ref["id"], file_path, ref["hash"])
+    return ref, result, stored
+
+
+def test_optimized_copy_replaces_the_upload(client, app_module, folder):
+    ref, result, stored = optimize_uploaded(client, app_module, folder)
+    assert result["status"] == "optimized"
+    assert blob_store.lookup_id(ref["id"])["hash"] == stored["hash"] != ref["hash"]
+    assert client.get(f"/pdfs/{ref['id']}/original").status_code == 200
+
+
+def test_upload_during_optimization_wins(client, app_module, folder, monkeypatch):
+    newer = make_pdf("newer")
+    ref, result, stored = optimize_uploaded(
+        client, app_module, folder, lambda ref: upload(client, folder, "doc.pdf", newer), monkeypatch)
+    assert result["status"] == "skipped" and stored is None
+    assert client.get(f"/uploads/{folder}/doc.pdf").data == newer
+
+
+def test_version_saved_during_optimization_wins(client, app_module, folder, monkeypatch):
+    def save_delta(ref):
+        response = client.post(f"/pdfs/{ref['id']}/versions?base={ref['hash']}&kind=append",
+                               data=b"\n% note\n%%EOF\n")
+        assert response.status_code == 201, response.get_json()
+
+    ref, result, stored = optimize_uploaded(client, app_module, folder, save_delta, monkeypatch)
+    assert result["status"] == "skipped" and stored is None
+    assert client.get(f"/uploads/{folder}/doc.pdf").data.endswith(b"% note\n%%EOF\n")
@@ -0,0 +1,46 @@
+import hashlib
+
+from conftest import make_pdf, upload
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def listed_hash(client, folder, name):
+    items = client.get(f"/get-pdfs?folder={folder}").get_json()
+    return next(item for item in items if item["filename"] == name)["sha256"]
+
+
+def test_reupload_replaces_a_versioned_pdf(client, folder):
+    v1, v2, v3 = make_pdf("one"), make_pdf("two"), make_pdf("three")
+    assert upload(client, folder, "doc.pdf", v1).status_code == 200
+    assert upload(client, folder, "doc.pdf", v2, route="/save-current-pdf", field="pdf").status_code == 200
+    assert upload(client, folder, "doc.pdf", v3).status_code == 200
+
+    response = client.get(f"/uploads/{folder}/doc.pdf")
+    assert response.status_code == 200
+    assert response.data == v3
+    assert listed_hash(client, folder, "doc.pdf") == sha256(v3)
+
+
+def test_reupload_of_an_earlier_version_is_kept(client, folder):
+    v1, v2 = make_pdf("one"), make_pdf("two")
+    upload(client, folder, "doc.pdf", v1, route="/save-current-pdf", field="pdf")
+    upload(client, folder, "doc.pdf", v2, route="/save-current-pdf", field="pdf")
+    upload(client, folder, "doc.pdf", v1)
+
+    assert client.get(f"/uploads/{folder}/doc.pdf").data == v1
+    assert listed_hash(client, folder, "doc.pdf") == sha256(v1)
+
+
+def test_delta_saves_are_materialized_on_read(client, folder):
+    base = make_pdf("base")
+    saved = upload(client, folder, "doc.pdf", base, route="/save-current-pdf", field="pdf").get_json()
+    update = b"\n% note\n%%EOF\n"
+    response = client.post(f"/pdfs/{saved['id']}/versions?base={saved['sha256']}&kind=append", data=update)
+    assert response.status_code == 201, response.get_json()
+
+    assert client.get(f"/uploads/{folder}/doc.pdf").data == base + update
+    versions = client.get(f"/pdfs/{saved['id']}/versions").get_json()
+    assert [version["version"] for version in versions["versions"]] == [1, 2]
@@ -0,0 +1,27 @@
+import io
+
+import pymupdf
+
+
+def png_bytes():
+    pixmap = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, 32, 24), False)
+    pixmap.clear_with(200)
+    return pixmap.tobytes("png")
+
+
+def test_saved_snips_refresh_derived_artifacts(client, app_module, folder, monkeypatch):
+    stored_paths = []
+    on_file_stored = app_module.on_file_stored
+    monkeypatch.setattr(app_module, "on_file_stored",
+                        lambda file_path, stored: stored_paths.append(file_path) or on_file_stored(file_path, stored))
+
+    response = client.post("/save-snip", data={
+        "snip": (io.BytesIO(png_bytes()), "snip.png"), "folder": folder, "title": "Bridge",
+        "timestamp": "00:01"
+    }, content_type="multipart/form-data")
+    assert response.status_code == 200
+    snip = response.get_json()["snip"]
+
+    # Processing may replace the original with its optimized encoding right after
+    assert stored_paths[0] == snip["file_path"]
+    assert client.get(f"/uploads/{folder}/{snip['filename']}").status_code == 200
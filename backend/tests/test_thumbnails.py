@@ -0,0 +1,39 @@
+import threading
+import time
+
+import catalog
+import thumbnails
+from conftest import make_pdf, upload
+
+
+def test_cache_hits_only_write_when_stale(client, folder, monkeypatch):
+    saved = upload(client, folder, "doc.pdf", make_pdf("doc"), route="/save-current-pdf", field="pdf").get_json()
+    url = f"/pdfs/{saved['id']}/pages/1/thumb"
+    assert client.get(url).status_code == 200
+    # Renders are recorded in the cache table from a callback once the file is written
+    deadline = time.time() + 10
+    while catalog.get_connection().execute(
+            "SELECT 1 FROM thumbnail_cache WHERE hash = ?", (saved["sha256"],)).fetchone() is None:
+        assert time.time() < deadline
+        time.sleep(0.02)
+
+    # Background workers write too; only count the request's own transactions
+    opened = []
+    transaction = catalog.transaction
+    request_thread = threading.current_thread()
+
+    def counted():
+        if threading.current_thread() is request_thread:
+            opened.append(1)
+        return transaction()
+
+    monkeypatch.setattr(catalog, "transaction", counted)
+    assert client.get(url).status_code == 200
+    assert opened == []
+
+    catalog.get_connection().execute("UPDATE thumbnail_cache SET last_access = 0 WHERE hash = ?", (saved["sha256"],))
+    assert client.get(url).status_code == 200
+    assert opened == [1]
+    row = catalog.get_connection().execute(
+        "SELECT last_access FROM thumbnail_cache WHERE hash = ?", (saved["sha256"],)).fetchone()
+    assert row["last_access"] > thumbnails.TOUCH_INTERVAL
@@ -0,0 +1,44 @@
+import hashlib
+import os
+import uuid
+
+import blob_store
+import tiering
+from conftest import create_folder, make_pdf, wait_for_job
+
+
+def archive(client, folder_id):
+    response = client.post(f"/folders/{folder_id}/archive")
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()["jobId"])
+    assert job["status"] == "succeeded", job
+    return job
+
+
+def test_archived_files_are_rehydrated_on_read(client, app_module, folder):
+    text = uuid.uuid4().hex.encode() * 500
+    pdf = make_pdf(f"cold {uuid.uuid4()}")
+    folder_id = create_folder(client, folder, {"notes.txt": text, "docs/doc.pdf": pdf})
+    archive(client, folder_id)
+
+    for name, data in (("notes.txt", text), ("docs/doc.pdf", pdf)):
+        blob_hash = hashlib.sha256(data).hexdigest()
+        assert tiering.is_archived(blob_hash)
+        assert not os.path.exists(os.path.join(app_module.UPLOAD_FOLDER, folder, name))
+        assert not os.path.exists(blob_store.blob_path(blob_hash))
+
+    # Still listed while cold, and served from the archive on the first read
+    assert [item["filename"] for item in client.get(f"/get-pdfs?folder={folder}").get_json()] == ["docs/doc.pdf"]
+    assert client.get(f"/uploads/{folder}/docs/doc.pdf").data == pdf
+    assert client.get(f"/uploads/{folder}/notes.txt").data == text
+    assert os.path.exists(blob_store.blob_path(hashlib.sha256(pdf).hexdigest()))
+
+
+def test_shared_content_stays_on_disk(client, app_module, folder):
+    shared = uuid.uuid4().bytes * 100
+    folder_id = create_folder(client, folder, {"shared.bin": shared})
+    create_folder(client, f"{folder}-other", {"copy.bin": shared})
+    archive(client, folder_id)
+
+    assert not tiering.is_archived(hashlib.sha256(shared).hexdigest())
+    assert os.path.exists(os.path.join(app_module.UPLOAD_FOLDER, folder, "shared.bin"))
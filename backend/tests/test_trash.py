@@ -0,0 +1,54 @@
+import hashlib
+import os
+import time
+import uuid
+
+import blob_store
+from conftest import create_folder
+
+
+def wait_until_purged(client, entry_id):
+    deadline = time.time() + 10
+    while any(entry["id"] == entry_id for entry in client.get("/trash").get_json()):
+        assert time.time() < deadline, "the reaper did not purge the entry"
+        time.sleep(0.05)
+
+
+def test_deleted_folder_is_restored(client, app_module, folder):
+    data = uuid.uuid4().bytes * 100
+    folder_id = create_folder(client, folder, {"notes/a.txt": data})
+
+    deleted = client.delete(f"/delete-folder/{folder_id}").get_json()
+    assert not os.path.exists(os.path.join(app_module.UPLOAD_FOLDER, folder))
+    assert all(item["id"] != folder_id for item in client.get("/get-folders").get_json())
+    assert any(entry["id"] == deleted["trashId"] for entry in client.get("/trash").get_json())
+
+    assert client.post(f"/trash/{deleted['trashId']}/restore").status_code == 200
+    assert any(item["id"] == folder_id for item in client.get("/get-folders").get_json())
+    assert client.get(f"/uploads/{folder}/notes/a.txt").data == data
+    assert client.post(f"/trash/{deleted['trashId']}/restore").status_code == 404
+
+
+def test_purged_folder_releases_its_blobs(client, app_module, folder):
+    data = uuid.uuid4().bytes * 100
+    blob_hash = hashlib.sha256(data).hexdigest()
+    folder_id = create_folder(client, folder, {"a.txt": data})
+    deleted = client.delete(f"/delete-folder/{folder_id}").get_json()
+    # Held by the entry for the undo window
+    assert os.path.exists(blob_store.blob_path(blob_hash))
+
+    assert client.delete(f"/trash/{deleted['trashId']}").status_code == 202
+    wait_until_purged(client, deleted["trashId"])
+
+    assert not os.path.exists(blob_store.blob_path(blob_hash))
+    assert client.post(f"/trash/{deleted['trashId']}/restore").status_code == 404
+    assert client.delete(f"/trash/{deleted['trashId']}").status_code == 404
+
+
+def test_restore_does_not_replace_a_new_folder_of_the_same_name(client, folder):
+    folder_id = create_folder(client, folder, {"a.txt": b"old"})
+    deleted = client.delete(f"/delete-folder/{folder_id}").get_json()
+    create_folder(client, folder, {"a.txt": b"new"})
+
+    assert client.post(f"/trash/{deleted['trashId']}/restore").status_code == 409
+    assert client.get(f"/uploads/{folder}/a.txt").data == b"new"
@@ -0,0 +1,194 @@
+import os
+import time
+import threading
+
+import catalog
+import metrics
+import process_pool
+
+try:
+    import pymupdf
+except ImportError:  # Thumbnails are disabled without PyMuPDF
+    pymupdf = None
+
+# Rasterizer processes (MuPDF rendering is CPU bound)
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Upper bound for the on-disk thumbnail cache; least recently used entries go first
+THUMBNAIL_CACHE_BYTES = int(os.environ.get("THUMBNAIL_CACHE_BYTES", 512 * 1024 * 1024))
+DEFAULT_WIDTH = 256
+MIN_WIDTH = 64
+MAX_WIDTH = 2048
+# Widths are rounded up to a multiple of this so arbitrary ?w= values share cache entries
+WIDTH_STEP = 64
+# Cache hits only refresh their LRU timestamp this often, to keep reads write-free
+TOUCH_INTERVAL = 60
+RENDER_TIMEOUT = 120
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS thumbnail_cache (
+        key TEXT PRIMARY KEY,
+        hash TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_thumbnail_cache_hash ON thumbnail_cache (hash);
+    CREATE INDEX IF NOT EXISTS idx_thumbnail_cache_last_access ON thumbnail_cache (last_access);
+"""
+
+CACHE_FOLDER = None
+_executor = None
+_in_flight = {}
+_lock = threading.Lock()
+
+
+class PageNotFound(ValueError):
+    """Requested page number is outside the document"""
+
+
+def init_thumbnails(upload_root):
+    """Create the cache table and directory"""
+    global CACHE_FOLDER
+    CACHE_FOLDER = os.path.join(upload_root, ".thumbnails")
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    catalog.get_connection().executescript(SCHEMA)
+
+
+def available():
+    return pymupdf is not None
+
+
+def normalize_width(width):
+    """Clamp and quantize a requested thumbnail width"""
+    width = width or DEFAULT_WIDTH
+    width = min(max(width, MIN_WIDTH), MAX_WIDTH)
+    return -(-width // WIDTH_STEP) * WIDTH_STEP
+
+
+def _cache_key(content_hash, page, width):
+    return f"{content_hash}_{page}_{width}"
+
+
+def cache_path(content_hash, page, width):
+    return os.path.join(CACHE_FOLDER, content_hash[:2], _cache_key(content_hash, page, width) + ".png")
+
+
+def render_page(pdf_path, page, width, output_path):
+    """Rasterize one page to PNG; runs inside a worker process"""
+    with pymupdf.open(pdf_path) as doc:
+        if page < 1 or page > doc.page_count:
+            raise PageNotFound(f"Page {page} is out of range (document has {doc.page_count} pages)")
+        pdf_page = doc[page - 1]
+        zoom = width / pdf_page.rect.width
+        pixmap = pdf_page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        data = pixmap.tobytes("png")
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, output_path)
+    return len(data)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = process_pool.new_executor(THUMBNAIL_WORKERS)
+        return _executor
+
+
+def _record(key, content_hash, future):
+    """Register a finished render in the LRU index and evict if over budget"""
+    with _lock:
+        _in_flight.pop(key, None)
+    if future.cancelled() or future.exception() is not None:
+        return
+    metrics.BYTES_WRITTEN.inc(future.result(), kind="thumbnail")
+    with catalog.transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO thumbnail_cache (key, hash, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, content_hash, future.result(), time.time())
+        )
+    evict()
+
+
+def _submit(content_hash, pdf_path, page, width):
+    """Start rendering a page unless the same render is already running"""
+    key = _cache_key(content_hash, page, width)
+    executor = _get_executor()
+    with _lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future
+        future = executor.submit(render_page, pdf_path, page, width, cache_path(content_hash, page, width))
+        _in_flight[key] = future
+    future.add_done_callback(lambda done: _record(key, content_hash, done))
+    return future
+
+
+def get_thumbnail(content_hash, pdf_path, page, width):
+    """Return the path of a cached page thumbnail, rendering it on a miss"""
+    key = _cache_key(content_hash, page, width)
+    path = cache_path(content_hash, page, width)
+    if os.path.exists(path):
+        now = time.time()
+        # Most hits are recent enough: check with a plain read before taking the write lock
+        row = catalog.get_connection().execute(
+            "SELECT last_access FROM thumbnail_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and row["last_access"] < now - TOUCH_INTERVAL:
+            with catalog.transaction() as conn:
+                conn.execute(
+                    "UPDATE thumbnail_cache SET last_access = ? WHERE key = ? AND last_access < ?",
+                    (now, key, now - TOUCH_INTERVAL)
+                )
+        return path
+    _submit(content_hash, pdf_path, page, width).result(timeout=RENDER_TIMEOUT)
+    return path
+
+
+def prerender(content_hash, pdf_path):
+    """Render page 1 at the default width in the background after an upload"""
+    if pymupdf is None or os.path.exists(cache_path(content_hash, 1, DEFAULT_WIDTH)):
+        return
+    try:
+        _submit(content_hash, pdf_path, 1, DEFAULT_WIDTH)
+    except Exception as e:
+        print(f"❌ Could not queue thumbnail for {content_hash}: {str(e)}")
+
+
+def invalidate(content_hash):
+    """Drop every cached thumbnail of a content hash"""
+    with catalog.transaction() as conn:
+        keys = [row["key"] for row in conn.execute(
+            "SELECT key FROM thumbnail_cache WHERE hash = ?", (content_hash,)
+        )]
+        conn.execute("DELETE FROM thumbnail_cache WHERE hash = ?", (content_hash,))
+    for key in keys:
+        try:
+            os.remove(os.path.join(CACHE_FOLDER, content_hash[:2], key + ".png"))
+        except FileNotFoundError:
+            pass
+
+
+def evict(limit=THUMBNAIL_CACHE_BYTES):
+    """Remove least recently used thumbnails until the cache is below 90% of ``limit``"""
+    conn = catalog.get_connection()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM thumbnail_cache").fetchone()[0]
+    if total <= limit:
+        return
+    target = limit * 0.9
+    victims = []
+    for row in conn.execute("SELECT key, hash, size FROM thumbnail_cache ORDER BY last_access").fetchall():
+        if total <= target:
+            break
+        victims.append(row)
+        total -= row["size"]
+    with catalog.transaction() as conn:
+        conn.executemany("DELETE FROM thumbnail_cache WHERE key = ?", [(row["key"],) for row in victims])
+    for row in victims:
+        try:
+            os.remove(os.path.join(CACHE_FOLDER, row["hash"][:2], row["key"] + ".png"))
+        except FileNotFoundError:
+            pass
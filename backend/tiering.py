@@ -0,0 +1,462 @@
+import os
+import time
+import uuid
+import zlib
+import struct
+import zipfile
+import threading
+from datetime import datetime
+
+import blob_store
+import catalog
+import compression
+import jobs
+import metrics
+
+# Folders nobody read or wrote for this long are packed into a cold archive
+TIER_COLD_AFTER = int(os.environ.get("TIER_COLD_AFTER", 90 * 24 * 60 * 60))
+# Upper bound for archived files read back into the blob store; least recently used go first
+TIER_CACHE_BYTES = int(os.environ.get("TIER_CACHE_BYTES", 2 * 1024 * 1024 * 1024))
+# Seconds between passes looking for idle folders
+TIER_SCAN_INTERVAL = int(os.environ.get("TIER_SCAN_INTERVAL", "3600"))
+# Access times are written at most this often per folder or cached file
+TOUCH_INTERVAL = 60
+COPY_BUFFER_SIZE = 1024 * 1024
+# Formats that are already compressed are stored as is; others are deflated
+# when a sample of their first block shrinks by at least this fraction
+STORED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".zip", ".gz", ".zst", ".br")
+MIN_SAMPLE_SAVING = 0.05
+
+# Only blobs that belong to one folder and nothing else are archived: the
+# folder's links and the blob file are removed, so their disk space is
+# freed.  ``cold_blobs`` is the random-access index, with the offset of each
+# member's local header and its compressed size.  ``cold_cache`` lists
+# archived blobs that were read back into the blob store.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS folder_access (
+        folder_id TEXT PRIMARY KEY,
+        last_access REAL NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS cold_archives (
+        id TEXT PRIMARY KEY,
+        folder_id TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS cold_blobs (
+        hash TEXT PRIMARY KEY,
+        archive TEXT NOT NULL REFERENCES cold_archives (id),
+        header_offset INTEGER NOT NULL,
+        compressed_size INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        method INTEGER NOT NULL,
+        crc INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_cold_blobs_archive ON cold_blobs (archive);
+
+    CREATE TABLE IF NOT EXISTS cold_cache (
+        hash TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_cold_cache_last_access ON cold_cache (last_access);
+"""
+
+# References a blob is expected to have when only its files hold it; deleted
+# files keep theirs through the trash entry until it is purged
+_FILE_HOLDS = ("(SELECT COUNT(*) FROM file_refs x WHERE x.hash = {0}) + "
+               "(SELECT COUNT(*) FROM trash t, json_each(t.hashes) j WHERE j.value = {0})")
+
+COLD_READS = metrics.Counter("indinfra_cold_reads_total", "Reads of files in archived folders", ("outcome",))
+
+COLD_FOLDER = None
+
+_condition = threading.Condition()
+_started = False
+_touched = {}
+_touch_lock = threading.Lock()
+_extract_locks = {}
+_extract_lock = threading.Lock()
+
+
+def init_tiering(upload_root):
+    """Create the tiering tables and let blob store readers bring archived blobs back"""
+    global COLD_FOLDER
+    COLD_FOLDER = os.path.join(upload_root, ".cold")
+    os.makedirs(COLD_FOLDER, exist_ok=True)
+    catalog.get_connection().executescript(SCHEMA)
+    blob_store.set_restorer(rehydrate)
+
+
+def _due(key):
+    """True at most once per ``TOUCH_INTERVAL`` for a key, so reads do not write on every request"""
+    now = time.time()
+    with _touch_lock:
+        if now - _touched.get(key, 0) < TOUCH_INTERVAL:
+            return False
+        _touched[key] = now
+        return True
+
+
+def touch(folder):
+    """Record a read of a top-level folder (by name)"""
+    folder = folder.replace("\\", "/").strip("/").split("/")[0]
+    if not folder or not _due(("folder", folder)):
+        return
+    row = catalog.get_connection().execute("SELECT id FROM folders WHERE name = ?", (folder,)).fetchone()
+    if row is None:
+        return
+    with catalog.transaction() as conn:
+        conn.execute(
+            "INSERT INTO folder_access (folder_id, last_access) VALUES (?, ?) "
+            "ON CONFLICT (folder_id) DO UPDATE SET last_access = excluded.last_access", (row["id"], time.time())
+        )
+
+
+def is_archived(blob_hash):
+    return catalog.get_connection().execute(
+        "SELECT 1 FROM cold_blobs WHERE hash = ?", (blob_hash,)
+    ).fetchone() is not None
+
+
+def is_archived_ref(key):
+    """True for a stored file whose bytes were moved into a cold archive"""
+    return catalog.get_connection().execute(
+        "SELECT 1 FROM file_refs r JOIN cold_blobs c ON c.hash = r.hash WHERE r.path = ?", (key,)
+    ).fetchone() is not None
+
+
+def archived_folders():
+    """Names of the top-level folders with archived files"""
+    rows = catalog.get_connection().execute(
+        "SELECT DISTINCT r.folder FROM file_refs r JOIN cold_blobs c ON c.hash = r.hash"
+    )
+    return {row["folder"] for row in rows}
+
+
+# ---------------------------------------------------------------- reading archived files
+
+def _lock_for(blob_hash):
+    with _extract_lock:
+        return _extract_locks.setdefault(blob_hash, threading.Lock())
+
+
+def rehydrate(blob_hash):
+    """Make an archived blob readable at its blob store path; returns False if it is not archived
+
+    The first read extracts the member through the index, without reading
+    the rest of the archive; the bytes then stay in the rehydration cache
+    until it needs the space.
+    """
+    path = blob_store.blob_path(blob_hash)
+    if os.path.exists(path):
+        COLD_READS.inc(outcome="cached")
+        if _due(("blob", blob_hash)):
+            with catalog.transaction() as conn:
+                conn.execute("UPDATE cold_cache SET last_access = ? WHERE hash = ?", (time.time(), blob_hash))
+        return True
+    try:
+        with _lock_for(blob_hash):
+            if os.path.exists(path):
+                return True
+            row = catalog.get_connection().execute(
+                "SELECT c.*, a.path AS archive_path FROM cold_blobs c JOIN cold_archives a ON a.id = c.archive "
+                "WHERE c.hash = ?", (blob_hash,)
+            ).fetchone()
+            if row is None:
+                return False
+            started = time.perf_counter()
+            staged = blob_store.staging_path()
+            try:
+                _extract(row, staged)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(staged, path)
+            finally:
+                if os.path.exists(staged):
+                    os.remove(staged)
+            with catalog.transaction() as conn:
+                conn.execute("INSERT OR REPLACE INTO cold_cache (hash, size, last_access) VALUES (?, ?, ?)",
+                             (blob_hash, row["size"], time.time()))
+    finally:
+        with _extract_lock:
+            _extract_locks.pop(blob_hash, None)
+    COLD_READS.inc(outcome="rehydrated")
+    metrics.BYTES_WRITTEN.inc(row["size"], kind="rehydrate")
+    print(f"🧊 Rehydrated {blob_hash[:12]} ({row['size']} bytes) in {time.perf_counter() - started:.2f}s")
+    evict()
+    return True
+
+
+def _extract(row, target_path):
+    """Copy one member out of its archive by its local header offset, checking size and CRC"""
+    with open(os.path.join(COLD_FOLDER, row["archive_path"]), "rb") as archive, open(target_path, "wb") as out:
+        archive.seek(row["header_offset"])
+        header = archive.read(30)
+        if header[:4] != b"PK\x03\x04":
+            raise IOError(f"Archive index of {row['hash']} points at no member")
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        archive.seek(name_length + extra_length, os.SEEK_CUR)
+        inflater = zlib.decompressobj(-15) if row["method"] == zipfile.ZIP_DEFLATED else None
+        remaining = row["compressed_size"]
+        crc = 0
+        size = 0
+        while remaining:
+            block = archive.read(min(COPY_BUFFER_SIZE, remaining))
+            if not block:
+                raise IOError(f"Archive member {row['hash']} is truncated")
+            remaining -= len(block)
+            if inflater is not None:
+                block = inflater.decompress(block)
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            out.write(block)
+        if inflater is not None:
+            tail = inflater.flush()
+            crc = zlib.crc32(tail, crc)
+            size += len(tail)
+            out.write(tail)
+    if size != row["size"] or crc != row["crc"]:
+        raise IOError(f"Archive member {row['hash']} is corrupt")
+
+
+def thaw(file_path):
+    """Bring an archived file back into its folder for good, e.g. before it is moved or deleted"""
+    stored = blob_store.lookup(file_path)
+    if stored is not None and not os.path.exists(file_path):
+        _thaw(stored["hash"])
+
+
+def _thaw(blob_hash):
+    """Relink every file of an archived blob and drop it from the archive index"""
+    if not rehydrate(blob_hash):
+        return
+    source = blob_store.blob_path(blob_hash)
+    for row in catalog.get_connection().execute("SELECT path FROM file_refs WHERE hash = ?", (blob_hash,)).fetchall():
+        file_path = os.path.join(blob_store.UPLOAD_ROOT, row["path"])
+        if not os.path.exists(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.link(source, file_path)
+    with catalog.transaction() as conn:
+        conn.execute("DELETE FROM cold_blobs WHERE hash = ?", (blob_hash,))
+        conn.execute("DELETE FROM cold_cache WHERE hash = ?", (blob_hash,))
+
+
+def evict(limit=TIER_CACHE_BYTES):
+    """Drop least recently read blobs from the rehydration cache until it is below 90% of ``limit``
+
+    A cached blob that gained another link or holder meanwhile is in use
+    outside its cold folder and is thawed instead.
+    """
+    conn = catalog.get_connection()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cold_cache").fetchone()[0]
+    if total <= limit:
+        return
+    target = limit * 0.9
+    for row in conn.execute("SELECT hash, size FROM cold_cache ORDER BY last_access").fetchall():
+        if total <= target:
+            break
+        total -= row["size"]
+        path = blob_store.blob_path(row["hash"])
+        with _lock_for(row["hash"]):
+            if _exclusive(row["hash"]) and os.path.exists(path) and os.stat(path).st_nlink == 1:
+                os.remove(path)
+                with catalog.transaction() as conn:
+                    conn.execute("DELETE FROM cold_cache WHERE hash = ?", (row["hash"],))
+                continue
+        _thaw(row["hash"])
+
+
+def _exclusive(blob_hash):
+    """True while a blob is held by its folder's files only"""
+    row = catalog.get_connection().execute(
+        f"SELECT b.refcount = {_FILE_HOLDS.format('b.hash')} AS exclusive FROM blobs b WHERE b.hash = ?", (blob_hash,)
+    ).fetchone()
+    return row is not None and bool(row["exclusive"])
+
+
+# ---------------------------------------------------------------- archiving
+
+def _compress_type(file_path, blob_path):
+    if file_path.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    with open(blob_path, "rb") as f:
+        sample = f.read(COPY_BUFFER_SIZE)
+    if len(zlib.compress(sample, 6)) > len(sample) * (1 - MIN_SAMPLE_SAVING):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def _candidates(folder, limit=-1):
+    """Blobs held only by files of this folder that are still on disk, one row per blob with a path using it"""
+    rows = catalog.get_connection().execute(
+        "SELECT r.hash, MIN(r.path) AS path, b.size FROM file_refs r JOIN blobs b ON b.hash = r.hash "
+        "WHERE r.folder = ? AND r.hash NOT IN (SELECT hash FROM cold_blobs) GROUP BY r.hash "
+        f"HAVING b.refcount = {_FILE_HOLDS.format('r.hash')} "
+        "AND NOT EXISTS (SELECT 1 FROM file_refs x WHERE x.hash = r.hash AND x.folder != r.folder) LIMIT ?",
+        (folder, limit)
+    ).fetchall()
+    return [row for row in rows if os.path.exists(blob_store.blob_path(row["hash"]))]
+
+
+def archive_folder_job(job):
+    """Pack the files only this folder holds into a new cold archive and free their disk space"""
+    folder = catalog.get_folder(job.payload["folderId"])
+    if folder is None:
+        return {"folderId": job.payload["folderId"], "skipped": "Folder was deleted"}
+    candidates = _candidates(folder["name"])
+    if not candidates:
+        return {"folderId": folder["id"], "archived": 0}
+
+    archive_id = str(uuid.uuid4())
+    relative_path = f"{folder['id']}/{archive_id}.zip"
+    archive_path = os.path.join(COLD_FOLDER, relative_path)
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    started = time.perf_counter()
+    try:
+        with zipfile.ZipFile(archive_path, "w", allowZip64=True) as archive:
+            for index, row in enumerate(candidates):
+                job.check_cancelled()
+                source = blob_store.blob_path(row["hash"])
+                zinfo = zipfile.ZipInfo(row["hash"], date_time=time.localtime()[:6])
+                zinfo.file_size = row["size"]
+                zinfo.compress_type = _compress_type(row["path"], source)
+                with open(source, "rb") as f, archive.open(zinfo, "w") as member:
+                    for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+                        member.write(block)
+                job.progress(index + 1, len(candidates))
+        with zipfile.ZipFile(archive_path) as archive:
+            members = {info.filename: info for info in archive.infolist()}
+        # The archive must be on disk before the only other copy is removed
+        with open(archive_path, "rb") as f:
+            os.fsync(f.fileno())
+        metrics.BYTES_WRITTEN.inc(os.path.getsize(archive_path), kind="archive")
+
+        with catalog.transaction() as conn:
+            conn.execute("INSERT INTO cold_archives (id, folder_id, path, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (archive_id, folder["id"], relative_path, os.path.getsize(archive_path),
+                          datetime.now().isoformat()))
+            for row in candidates:
+                info = members[row["hash"]]
+                conn.execute(
+                    "INSERT OR IGNORE INTO cold_blobs (hash, archive, header_offset, compressed_size, size, method, crc) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (row["hash"], archive_id, info.header_offset, info.compress_size, info.file_size,
+                     info.compress_type, info.CRC)
+                )
+    except BaseException:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+
+    freed = 0
+    for row in candidates:
+        with _lock_for(row["hash"]):
+            freed += _release_disk(row["hash"])
+    sweep()
+    print(f"🧊 Archived {len(candidates)} file(s) of folder {folder['name']} in {time.perf_counter() - started:.1f}s: "
+          f"{freed} bytes freed, archive {os.path.getsize(archive_path) if os.path.exists(archive_path) else 0} bytes")
+    return {"folderId": folder["id"], "archived": len(candidates), "freedBytes": freed}
+
+
+def _release_disk(blob_hash):
+    """Remove an archived blob's links and file; a blob shared meanwhile stays and leaves the index"""
+    source = blob_store.blob_path(blob_hash)
+    if not _exclusive(blob_hash):
+        with catalog.transaction() as conn:
+            conn.execute("DELETE FROM cold_blobs WHERE hash = ?", (blob_hash,))
+        return 0
+    source_stat = os.stat(source)
+    for row in catalog.get_connection().execute("SELECT path FROM file_refs WHERE hash = ?", (blob_hash,)).fetchall():
+        file_path = os.path.join(blob_store.UPLOAD_ROOT, row["path"])
+        try:
+            if os.path.samestat(os.stat(file_path), source_stat):
+                os.remove(file_path)
+        except FileNotFoundError:
+            pass
+    os.remove(source)
+    compression.remove_variants(source)
+    return source_stat.st_size
+
+
+def sweep():
+    """Forget archived blobs nothing references any more and delete archives left without members
+
+    Archived blobs that something besides their files holds now (a saved
+    version, an optimization) are thawed, so those holders find them on disk.
+    """
+    shared = catalog.get_connection().execute(
+        "SELECT c.hash FROM cold_blobs c JOIN blobs b ON b.hash = c.hash "
+        f"WHERE b.refcount != {_FILE_HOLDS.format('c.hash')}"
+    ).fetchall()
+    for row in shared:
+        _thaw(row["hash"])
+    with catalog.transaction() as conn:
+        conn.execute("DELETE FROM cold_blobs WHERE hash NOT IN (SELECT hash FROM blobs)")
+        conn.execute("DELETE FROM cold_cache WHERE hash NOT IN (SELECT hash FROM blobs)")
+        empty = conn.execute(
+            "SELECT id, path FROM cold_archives WHERE id NOT IN (SELECT DISTINCT archive FROM cold_blobs)"
+        ).fetchall()
+        conn.executemany("DELETE FROM cold_archives WHERE id = ?", [(row["id"],) for row in empty])
+    for row in empty:
+        try:
+            os.remove(os.path.join(COLD_FOLDER, row["path"]))
+        except FileNotFoundError:
+            pass
+    if empty:
+        print(f"🧹 Removed {len(empty)} cold archive(s) without live files")
+
+
+def queue_archive(folder_id):
+    """Queue packing a folder unless it is queued already; returns the job"""
+    row = catalog.get_connection().execute(
+        "SELECT id FROM jobs WHERE kind = 'folder.archive' AND status IN ('queued', 'running') "
+        "AND json_extract(payload, '$.folderId') = ?", (folder_id,)
+    ).fetchone()
+    if row is not None:
+        return jobs.get_job(row["id"])
+    return jobs.enqueue("folder.archive", {"folderId": folder_id}, jobs.PRIORITY_LOW, max_attempts=1)
+
+
+def idle_folders(now=None):
+    """Ids of folders neither read nor written for ``TIER_COLD_AFTER`` seconds that still have files on disk"""
+    cutoff = (now or time.time()) - TIER_COLD_AFTER
+    accessed = {row["folder_id"]: row["last_access"]
+                for row in catalog.get_connection().execute("SELECT folder_id, last_access FROM folder_access")}
+    idle = []
+    for folder in catalog.list_folders():
+        written = folder["lastModified"] or folder["uploadDate"]
+        last = max(accessed.get(folder["id"], 0), datetime.fromisoformat(written).timestamp() if written else 0)
+        if last < cutoff and _candidates(folder["name"], limit=1):
+            idle.append(folder["id"])
+    return idle
+
+
+# ---------------------------------------------------------------- scanner
+
+def start_scanner():
+    """Start the thread queueing idle folders for archiving, once per process"""
+    global _started
+    with _condition:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_scan, name="tier-scanner", daemon=True).start()
+
+
+def _scan():
+    while True:
+        try:
+            sweep()
+            evict()
+            for folder_id in idle_folders():
+                queue_archive(folder_id)
+        except Exception as e:
+            print(f"❌ Tier scan failed: {str(e)}")
+        with _condition:
+            _condition.wait(TIER_SCAN_INTERVAL)
+
+
+jobs.register("folder.archive", archive_folder_job)
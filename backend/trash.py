@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from datetime import datetime
+
+import annotations
+import blob_store
+import catalog
+import pdf_optimize
+import pdf_versions
+import search_index
+import tiering
+
+# Seconds a deleted folder, file or snip can be restored before it is purged
+TRASH_UNDO_WINDOW = int(os.environ.get("TRASH_UNDO_WINDOW", 24 * 60 * 60))
+# I/O budget of the reaper: files unlinked per second while purging
+TRASH_REAP_RATE = float(os.environ.get("TRASH_REAP_RATE", "500"))
+# Idle reaper checks for due entries this often (purging one now wakes it at once)
+REAP_INTERVAL = 60
+# Trash directories without an entry are left alone this long (a delete may still be committing)
+ORPHAN_AGE = 3600
+
+# One row per deleted item.  ``records`` holds its catalog rows by table so an
+# undo can put them back; the item's files sit under .trash/<id>/.  The entry
+# keeps the blob references in ``hashes`` until it is purged, so nothing is
+# collected during the undo window.  ``status`` is held, restoring or purging.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS trash (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        name TEXT NOT NULL,
+        folder TEXT NOT NULL DEFAULT '',
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL DEFAULT 0,
+        records TEXT NOT NULL,
+        hashes TEXT NOT NULL,
+        documents TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'held',
+        deleted_at TEXT NOT NULL,
+        purge_after REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_trash_purge ON trash (status, purge_after);
+"""
+
+TRASH_FOLDER = None
+
+_condition = threading.Condition()
+_started = False
+
+
+class TrashError(Exception):
+    """A restore or purge that cannot be done; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def init_trash(upload_root):
+    """Create the trash table and directory; restores cut short by a restart are undone"""
+    global TRASH_FOLDER
+    TRASH_FOLDER = os.path.join(upload_root, ".trash")
+    os.makedirs(TRASH_FOLDER, exist_ok=True)
+    catalog.get_connection().executescript(SCHEMA)
+    with catalog.transaction() as conn:
+        conn.execute("UPDATE trash SET status = 'held' WHERE status = 'restoring'")
+
+
+def new_entry_id():
+    return str(uuid.uuid4())
+
+
+def trash_path(entry_id, file_path):
+    """Where a deleted file or folder is moved to (a rename) until it is restored or purged"""
+    return os.path.join(TRASH_FOLDER, entry_id, os.path.basename(file_path))
+
+
+def entry_from_row(row):
+    """Public form of a trash row"""
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "itemId": row["ref"],
+        "name": row["name"],
+        "folder": row["folder"],
+        "path": row["path"],
+        "size": row["size"],
+        "status": row["status"],
+        "deletedAt": row["deleted_at"],
+        "purgeAfter": datetime.fromtimestamp(row["purge_after"]).isoformat()
+    }
+
+
+def list_entries():
+    """Restorable and purging entries, most recently deleted first"""
+    return [entry_from_row(row) for row in
+            catalog.get_connection().execute("SELECT * FROM trash ORDER BY deleted_at DESC")]
+
+
+def _take(conn, table, where, params):
+    """Remove rows, returning them for the trash entry"""
+    rows = [dict(row) for row in conn.execute(f"SELECT * FROM {table} WHERE {where}", params)]
+    conn.execute(f"DELETE FROM {table} WHERE {where}", params)
+    return rows
+
+
+def _hold(conn, entry_id, kind, ref, name, folder, file_path, size, records, hashes, documents):
+    conn.execute(
+        "INSERT INTO trash (id, kind, ref, name, folder, path, size, records, hashes, documents, deleted_at, "
+        "purge_after) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (entry_id, kind, ref, name, folder, blob_store.ref_key(file_path), size or 0, json.dumps(records),
+         json.dumps(hashes), json.dumps(documents), datetime.now().isoformat(), time.time() + TRASH_UNDO_WINDOW)
+    )
+
+
+# ---------------------------------------------------------------- deleting
+
+def trash_snip(entry_id, snip, size):
+    """Unlist a snip whose file was moved to ``trash_path``; its image blobs stay referenced"""
+    key = blob_store.ref_key(snip["file_path"])
+    with catalog.transaction() as conn:
+        refs = _take(conn, "file_refs", "path = ?", (key,))
+        snips = _take(conn, "snips", "id = ?", (snip["id"],))
+        if size is not None:
+            catalog.record_file_change(snip["folder"], snip["filename"], size, None, datetime.now().isoformat())
+        search_index.remove("snip", snip["id"])
+        hashes = [ref["hash"] for ref in refs]
+        hashes += [rendition["hash"] for rendition in (snip.get("renditions") or {}).values()]
+        _hold(conn, entry_id, "snip", snip["id"], snip["title"], snip["folder"], snip["file_path"], size,
+              {"file_refs": refs, "snips": snips}, hashes, [])
+
+
+def trash_file(entry_id, ref, file_path, folder):
+    """Unlist a stored file that was moved to ``trash_path``"""
+    with catalog.transaction() as conn:
+        refs = _take(conn, "file_refs", "id = ?", (ref["id"],))
+        catalog.record_file_change(folder, os.path.basename(file_path), ref["size"], None,
+                                   datetime.now().isoformat())
+        search_index.remove("pdf", ref["id"])
+        _hold(conn, entry_id, "file", ref["id"], os.path.basename(file_path), folder, file_path, ref["size"],
+              {"file_refs": refs}, [row["hash"] for row in refs], [ref["id"]])
+
+
+def trash_folder(entry_id, folder):
+    """Unlist a folder that was moved to ``trash_path`` together with its stored files"""
+    with catalog.transaction() as conn:
+        refs = _take(conn, "file_refs", "folder = ?", (folder["name"],))
+        folders = _take(conn, "folders", "id = ?", (folder["id"],))
+        search_index.remove_folder(folder["name"])
+        _hold(conn, entry_id, "folder", folder["id"], folder["name"], folder["name"],
+              os.path.join(blob_store.UPLOAD_ROOT, folder["name"]), folder.get("totalBytes"),
+              {"folders": folders, "file_refs": refs}, [row["hash"] for row in refs], [row["id"] for row in refs])
+
+
+# ---------------------------------------------------------------- restoring
+
+def _conflict(conn, row, records):
+    """Why the entry cannot go back where it came from, or None"""
+    target = os.path.join(blob_store.UPLOAD_ROOT, row["path"])
+    if os.path.lexists(target):
+        return f"{row['path']} already exists"
+    keys = [ref["path"] for ref in records.get("file_refs", [])]
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        if conn.execute(f"SELECT 1 FROM file_refs WHERE path IN ({', '.join('?' * len(chunk))}) LIMIT 1",
+                        chunk).fetchone():
+            return f"{row['path']} already exists"
+    if row["kind"] == "folder" and conn.execute("SELECT 1 FROM folders WHERE name = ?", (row["name"],)).fetchone():
+        return "A folder with that name already exists"
+    if row["kind"] == "file" and row["folder"] and \
+            not conn.execute("SELECT 1 FROM folders WHERE name = ?", (row["folder"],)).fetchone():
+        return "Restore the folder the file was in first"
+    return None
+
+
+def restore(entry_id):
+    """Move a trashed item back and put its catalog rows back; returns the entry
+
+    Raises ``TrashError`` when the entry is unknown (404), its place is
+    taken (409) or it is already being purged (410).
+    """
+    with catalog.transaction() as conn:
+        row = conn.execute("SELECT * FROM trash WHERE id = ?", (entry_id,)).fetchone()
+        if row is None:
+            raise TrashError("Trash entry not found", 404)
+        if row["status"] != "held":
+            raise TrashError("The entry is already being purged" if row["status"] == "purging"
+                             else "The entry is already being restored", 410 if row["status"] == "purging" else 409)
+        records = json.loads(row["records"])
+        conflict = _conflict(conn, row, records)
+        if conflict:
+            raise TrashError(conflict, 409)
+        # The reaper only claims held entries
+        conn.execute("UPDATE trash SET status = 'restoring' WHERE id = ?", (entry_id,))
+
+    target = os.path.join(blob_store.UPLOAD_ROOT, row["path"])
+    source = trash_path(entry_id, target)
+    moved = False
+    try:
+        if os.path.lexists(source):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(source, target)
+            moved = True
+        with catalog.transaction() as conn:
+            for table, rows in records.items():
+                for record in rows:
+                    conn.execute(
+                        f"INSERT INTO {table} ({', '.join(record)}) VALUES ({', '.join('?' * len(record))})",
+                        tuple(record.values())
+                    )
+            if row["kind"] != "folder" and moved and os.path.isfile(target):
+                catalog.record_file_change(row["folder"], os.path.basename(target), None,
+                                           os.path.getsize(target), datetime.now().isoformat())
+            conn.execute("DELETE FROM trash WHERE id = ?", (entry_id,))
+    except BaseException:
+        if moved:
+            os.rename(target, source)
+        with catalog.transaction() as conn:
+            conn.execute("UPDATE trash SET status = 'held' WHERE id = ?", (entry_id,))
+        raise
+    shutil.rmtree(os.path.join(TRASH_FOLDER, entry_id), ignore_errors=True)
+    # Search entries were dropped with the item; index it again in the background
+    search_index.queue_backfill()
+    print(f"♻️ Restored {row['kind']} {row['name']} from the trash")
+    return entry_from_row(row)
+
+
+# ---------------------------------------------------------------- purging
+
+def purge_now(entry_id):
+    """End an entry's undo window so the reaper purges it next; False if there is no such entry"""
+    with catalog.transaction() as conn:
+        row = conn.execute("SELECT status FROM trash WHERE id = ?", (entry_id,)).fetchone()
+        if row is None:
+            return False
+        conn.execute("UPDATE trash SET purge_after = 0 WHERE id = ? AND status = 'held'", (entry_id,))
+    with _condition:
+        _condition.notify_all()
+    return True
+
+
+def start_reaper():
+    """Start the reaper thread once per process"""
+    global _started
+    with _condition:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_reap, name="trash-reaper", daemon=True).start()
+
+
+def _claim():
+    """Mark the next due entry (or one whose purge was interrupted) as purging and return it, or None"""
+    with catalog.transaction() as conn:
+        row = conn.execute(
+            "SELECT * FROM trash WHERE status = 'purging' OR (status = 'held' AND purge_after <= ?) "
+            "ORDER BY purge_after LIMIT 1", (time.time(),)
+        ).fetchone()
+        if row is not None:
+            conn.execute("UPDATE trash SET status = 'purging' WHERE id = ?", (row["id"],))
+        return row
+
+
+def _next_due():
+    row = catalog.get_connection().execute(
+        "SELECT MIN(purge_after) AS due FROM trash WHERE status = 'held'"
+    ).fetchone()
+    return row["due"]
+
+
+def _reap():
+    _sweep_orphans()
+    while True:
+        try:
+            row = _claim()
+            if row is not None:
+                _purge(row)
+                continue
+            due = _next_due()
+        except Exception as e:
+            print(f"❌ Could not purge the trash: {str(e)}")
+            due = None
+        timeout = REAP_INTERVAL if due is None else min(REAP_INTERVAL, max(due - time.time(), 0.1))
+        with _condition:
+            _condition.wait(timeout)
+
+
+def _purge(row):
+    """Unlink an entry's files within the I/O budget, then drop its history and blob references"""
+    started = time.perf_counter()
+    removed = _unlink_tree(os.path.join(TRASH_FOLDER, row["id"]))
+    documents = json.loads(row["documents"])
+    annotations.remove_documents(documents)
+    pdf_versions.remove_documents(documents)
+    pdf_optimize.remove_documents(documents)
+    with catalog.transaction() as conn:
+        for blob_hash in json.loads(row["hashes"]):
+            blob_store.release_blob(blob_hash)
+        conn.execute("DELETE FROM trash WHERE id = ?", (row["id"],))
+    blob_store.collect_garbage()
+    # Archives whose files were all purged are deleted
+    tiering.sweep()
+    print(f"🗑️ Purged {row['kind']} {row['name']} from the trash: {removed} files "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def _unlink_tree(path):
+    """Remove a directory tree at no more than ``TRASH_REAP_RATE`` files per second; returns the count"""
+    started = time.monotonic()
+    removed = 0
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            try:
+                os.remove(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            removed += 1
+            delay = removed / TRASH_REAP_RATE - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        for name in dirs:
+            child = os.path.join(root, name)
+            try:
+                if os.path.islink(child):
+                    os.remove(child)
+                else:
+                    os.rmdir(child)
+            except FileNotFoundError:
+                pass
+    if os.path.isdir(path):
+        os.rmdir(path)
+    return removed
+
+
+def _sweep_orphans():
+    """Remove trash directories left without an entry, e.g. by a crash during a delete"""
+    known = {row["id"] for row in catalog.get_connection().execute("SELECT id FROM trash")}
+    for name in os.listdir(TRASH_FOLDER):
+        path = os.path.join(TRASH_FOLDER, name)
+        try:
+            if name in known or time.time() - os.lstat(path).st_mtime < ORPHAN_AGE:
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                _unlink_tree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            print(f"❌ Could not remove {path} from the trash: {str(e)}")
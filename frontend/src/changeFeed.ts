@@ -0,0 +1,97 @@
+// One shared subscription to the backend change feed. Components load a list
+// once, note the X-Change-Seq header of that response and then apply deltas
+// instead of reloading the whole list after every change.
+
+const API = "http://127.0.0.1:5000";
+
+export interface Change<T = any> {
+  seq: number;
+  entity: "folder" | "file" | "snip" | "highlight";
+  id: string;
+  op: "upsert" | "delete";
+  folder: string | null;
+  item?: T;
+}
+
+interface Subscriber {
+  onChange: (change: Change) => void;
+  onReset: () => void;
+}
+
+const subscribers = new Set<Subscriber>();
+let source: EventSource | null = null;
+let position = 0;
+
+// Change feed position a list response was read at
+export const changeSeq = (response: Response): number =>
+  Number(response.headers.get("X-Change-Seq") || 0);
+
+const open = (since: number) => {
+  source = new EventSource(`${API}/changes/events?since=${since}`);
+  source.addEventListener("change", (event) => {
+    const change = JSON.parse((event as MessageEvent).data) as Change;
+    position = Math.max(position, change.seq);
+    subscribers.forEach((subscriber) => subscriber.onChange(change));
+  });
+  source.addEventListener("reset", (event) => {
+    // Too far behind the server's log: reload the lists and follow from its head
+    const { seq } = JSON.parse((event as MessageEvent).data);
+    source?.close();
+    position = seq;
+    subscribers.forEach((subscriber) => subscriber.onReset());
+    open(seq);
+  });
+};
+
+// Deliver what the shared stream passed before this subscriber's snapshot
+const catchUp = async (subscriber: Subscriber, since: number) => {
+  let seq = since;
+  while (seq < position) {
+    const response = await fetch(`${API}/changes?since=${seq}`);
+    if (response.status === 410) {
+      subscriber.onReset();
+      return;
+    }
+    if (!response.ok) return;
+    const delta = await response.json();
+    delta.changes.forEach(subscriber.onChange);
+    if (delta.seq === seq) return;
+    seq = delta.seq;
+  }
+};
+
+// Follow changes after `since`; returns the unsubscribe function
+export const subscribeToChanges = (
+  since: number,
+  onChange: (change: Change) => void,
+  onReset: () => void
+): (() => void) => {
+  const subscriber = { onChange, onReset };
+  subscribers.add(subscriber);
+  if (!source) {
+    position = since;
+    open(since);
+  } else if (since < position) {
+    catchUp(subscriber, since);
+  }
+  return () => {
+    subscribers.delete(subscriber);
+    if (subscribers.size === 0 && source) {
+      source.close();
+      source = null;
+    }
+  };
+};
+
+// Apply one change to a list of items; `include` is false when the changed
+// item no longer belongs in this list (e.g. it moved to another folder)
+export const applyChange = <T extends { id: string }>(items: T[], change: Change, include = true): T[] => {
+  const index = items.findIndex((item) => item.id === change.id);
+  if (change.op === "delete" || !include || !change.item) {
+    return index === -1 ? items : items.filter((item) => item.id !== change.id);
+  }
+  if (index === -1) return [...items, change.item as T];
+  const next = items.slice();
+  next[index] = change.item as T;
+  return next;
+};
@@ -1,5 +1,6 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { Folder, Upload, FileText, Trash2, Eye, Play, Image } from "lucide-react";
+import { Change, applyChange, changeSeq, subscribeToChanges } from "../changeFeed";
 
 interface FolderData {
   id: string;
@@ -10,8 +11,8 @@ interface FolderData {
 }
 
 interface FileData {
+  id: string;
   filename: string;
-  
   url: string;
 }
 
@@ -23,6 +24,7 @@ interface SnipData {
   filename: string;
   folder: string;
   url: string;
+  thumbnailUrl?: string;
   created_at: string;
 }
 
@@ -38,10 +40,20 @@ const Dashboard: React.FC<DashboardProps> = ({ onGetStarted }) => {
   const [currentFolderName, setCurrentFolderName] = useState("");
   const [loading, setLoading] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
+  // Read by the change feed callback, which outlives renders
+  const currentFolderRef = useRef("");
 
-  // Load folders on component mount
+  // Load folders on component mount, then follow changes instead of reloading
   useEffect(() => {
-    loadFolders();
+    let active = true;
+    let unsubscribe = () => {};
+    loadFolders().then((seq) => {
+      if (active) unsubscribe = subscribeToChanges(seq, handleChange, handleReset);
+    });
+    return () => {
+      active = false;
+      unsubscribe();
+    };
   }, []);
 
   const loadFolders = async () => {
@@ -50,10 +62,43 @@ const Dashboard: React.FC<DashboardProps> = ({ onGetStarted }) => {
       if (response.ok) {
         const data = await response.json();
         setFolders(data);
+        return changeSeq(response);
       }
     } catch (error) {
       console.error("Error loading folders:", error);
     }
+    return 0;
+  };
+
+  const handleChange = (change: Change) => {
+    if (change.entity === "folder") {
+      setFolders((items) => applyChange(items, change));
+    }
+    const folderName = currentFolderRef.current;
+    if (!folderName) return;
+    if (change.entity === "snip") {
+      setSelectedFolderSnips((items) => applyChange(items, change, change.folder === folderName));
+    } else if (change.entity === "file") {
+      const isPdf = !!change.item?.filename.toLowerCase().endsWith(".pdf");
+      setSelectedFolderFiles((items) => applyChange(items, change, change.folder === folderName && isPdf));
+    }
+  };
+
+  // Fell behind the change log: reload everything shown
+  const handleReset = () => {
+    loadFolders();
+    if (currentFolderRef.current) {
+      loadFilesForFolder(currentFolderRef.current);
+      loadSnipsForFolder(currentFolderRef.current);
+    }
+  };
+
+  const loadFilesForFolder = async (folderName: string) => {
+    const response = await fetch(`http://127.0.0.1:5000/get-pdfs?folder=${encodeURIComponent(folderName)}`);
+    if (response.ok) {
+      setSelectedFolderFiles(await response.json());
+    }
+    return response.ok;
   };
 
   const loadSnipsForFolder = async (folderName: string) => {
@@ -105,12 +150,21 @@ const Dashboard: React.FC<DashboardProps> = ({ onGetStarted }) => {
           console.log("Response status:", response.status); // Debug log
 
           if (response.ok) {
-            const result = await response.json();
+            let result = await response.json();
+
+            // Files are imported in the background; long-poll the job until it finishes
+            while (result.statusUrl && (result.status === undefined || result.status === "queued" || result.status === "running")) {
+              const statusResponse = await fetch(`${result.statusUrl}?wait=25`);
+              if (!statusResponse.ok) break;
+              result = { ...result, ...(await statusResponse.json()) };
+            }
             console.log("Folder uploaded successfully:", result);
-            alert(`✅ Folder "${folderName}" uploaded successfully with ${files.length} files!`);
-            
-            // Reload folders list
-            await loadFolders();
+            if (result.status === "failed") {
+              alert(`❌ Upload failed: ${result.error || 'Unknown error'}`);
+            } else {
+              alert(`✅ Folder "${folderName}" uploaded successfully with ${files.length} files!`);
+            }
+            // The new folder arrives through the change feed
           } else {
             const errorData = await response.json();
             console.error("Upload failed:", errorData);
@@ -134,10 +188,8 @@ const Dashboard: React.FC<DashboardProps> = ({ onGetStarted }) => {
   const handleFolderDoubleClick = async (folderName: string) => {
     setLoading(true);
     try {
-      const response = await fetch(`http://127.0.0.1:5000/get-pdfs?folder=${encodeURIComponent(folderName)}`);
-      if (response.ok) {
-        const data = await response.json();
-        setSelectedFolderFiles(data);
+      currentFolderRef.current = folderName;
+      if (await loadFilesForFolder(folderName)) {
         setShowFiles(true);
         setCurrentFolderName(folderName);
         await loadSnipsForFolder(folderName);
@@ -154,6 +206,7 @@ const Dashboard: React.FC<DashboardProps> = ({ onGetStarted }) => {
   };
 
   const handleBackToFolders = () => {
+    currentFolderRef.current = "";
     setShowFiles(false);
     setSelectedFolderFiles([]);
     setSelectedFolderSnips([]);
@@ -168,13 +221,18 @@ const Dashboard: React.FC<DashboardProps> = ({ onGetStarted }) => {
         });
 
         if (response.ok) {
-          await loadFolders();
           if (showFiles && selectedFolderFiles.length > 0) {
+            currentFolderRef.current = "";
             setShowFiles(false);
             setSelectedFolderFiles([]);
             setSelectedFolderSnips([]);
             setCurrentFolderName("");
           }
+          // Deletes can be undone until the trash is purged; the folder comes back through the change feed
+          const { restoreUrl } = await response.json();
+          if (window.confirm(`"${folderName}" was moved to the trash. Undo?`)) {
+            await fetch(restoreUrl, { method: "POST" });
+          }
         }
       } catch (error) {
         console.error("Error deleting folder:", error);
@@ -193,8 +251,13 @@ const Dashboard: React.FC<DashboardProps> = ({ onGetStarted }) => {
           method: "DELETE",
         });
 
-        if (response.ok) {
-          await loadSnipsForFolder(currentFolderName); // Reload snips for the current folder
+        if (!response.ok) {
+          console.error("Error deleting snip:", response.status);
+        } else {
+          const { restoreUrl } = await response.json();
+          if (window.confirm(`"${snipTitle}" was moved to the trash. Undo?`)) {
+            await fetch(restoreUrl, { method: "POST" });
+          }
         }
       } catch (error) {
         console.error("Error deleting snip:", error);
@@ -270,6 +333,14 @@ const Dashboard: React.FC<DashboardProps> = ({ onGetStarted }) => {
                   onClick={() => handleSnipClick(snip)}
                   className="bg-white rounded-lg shadow-sm border border-gray-200 p-6 cursor-pointer hover:shadow-md transition-shadow"
                 >
+                  {snip.thumbnailUrl && (
+                    <img
+                      src={snip.thumbnailUrl}
+                      alt={snip.title}
+                      loading="lazy"
+                      className="w-full h-32 object-cover object-top rounded mb-4 border border-gray-100"
+                    />
+                  )}
                   <div className="flex items-center mb-4">
                     <Image className="w-8 h-8 text-green-500 mr-3" />
                     <div className="flex-1 min-w-0">
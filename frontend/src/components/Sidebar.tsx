@@ -1,5 +1,6 @@
 import { useState, useEffect } from "react";
 import { Folder, Upload, Trash2 } from "lucide-react";
+import { Change, applyChange, changeSeq, subscribeToChanges } from "../changeFeed";
 
 interface FolderData {
   id: string;
@@ -18,8 +19,17 @@ const Sidebar: React.FC<SidebarProps> = ({ onFolderSelect, selectedFolder }) =>
   const [folders, setFolders] = useState<FolderData[]>([]);
   const [isUploading, setIsUploading] = useState(false);
 
+  // Load folders once, then apply folder changes from the change feed
   useEffect(() => {
-    loadFolders();
+    let active = true;
+    let unsubscribe = () => {};
+    loadFolders().then((seq) => {
+      if (active) unsubscribe = subscribeToChanges(seq, handleChange, loadFolders);
+    });
+    return () => {
+      active = false;
+      unsubscribe();
+    };
   }, []);
 
   const loadFolders = async () => {
@@ -28,10 +38,18 @@ const Sidebar: React.FC<SidebarProps> = ({ onFolderSelect, selectedFolder }) =>
       if (response.ok) {
         const data = await response.json();
         setFolders(data);
+        return changeSeq(response);
       }
     } catch (error) {
       console.error("Error loading folders:", error);
     }
+    return 0;
+  };
+
+  const handleChange = (change: Change) => {
+    if (change.entity === "folder") {
+      setFolders((items) => applyChange(items, change));
+    }
   };
 
   const handleFolderUpload = async () => {
@@ -61,12 +79,17 @@ const Sidebar: React.FC<SidebarProps> = ({ onFolderSelect, selectedFolder }) =>
           });
 
           if (response.ok) {
-            const result = await response.json();
+            let result = await response.json();
+
+            // Files are imported in the background; long-poll the job until it finishes
+            while (result.statusUrl && (result.status === undefined || result.status === "queued" || result.status === "running")) {
+              const statusResponse = await fetch(`${result.statusUrl}?wait=25`);
+              if (!statusResponse.ok) break;
+              result = { ...result, ...(await statusResponse.json()) };
+            }
             console.log("Folder uploaded successfully:", result);
-            
-            // Reload folders list
-            await loadFolders();
-            
+            // The new folder arrives through the change feed
+
             // Auto-select the uploaded folder
             onFolderSelect(folderName);
           } else {
@@ -91,10 +114,13 @@ const Sidebar: React.FC<SidebarProps> = ({ onFolderSelect, selectedFolder }) =>
         });
 
         if (response.ok) {
-          await loadFolders();
           if (selectedFolder === folderName) {
             onFolderSelect("");
           }
+          const { restoreUrl } = await response.json();
+          if (window.confirm(`"${folderName}" was moved to the trash. Undo?`)) {
+            await fetch(restoreUrl, { method: "POST" });
+          }
         }
       } catch (error) {
         console.error("Error deleting folder:", error);
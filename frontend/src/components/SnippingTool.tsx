@@ -99,10 +99,18 @@ const SnippingTool: React.FC<SnippingToolProps> = ({ selectedFolder, onSnipSaved
         body: formData,
       });
 
-      const data = await response.json();
+      let data = await response.json();
+      const statusUrl = data.statusUrl;
+
+      // The snip is picked up in the background; long-poll the job until it finishes
+      while (response.ok && (data.status === "pending" || data.status === "processing")) {
+        const statusResponse = await fetch(`${statusUrl}?wait=25`);
+        data = await statusResponse.json();
+        if (!statusResponse.ok) break;
+      }
       console.log("📸 Snip Response:", data);
 
-      if (response.ok) {
+      if (response.ok && data.status === "done") {
         // Fetch the snip as Blob
         const snipResponse = await fetch(data.file_path);
         if (snipResponse.ok) {
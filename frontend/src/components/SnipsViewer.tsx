@@ -9,6 +9,8 @@ interface SnipData {
   filename: string;
   folder: string;
   url: string;
+  thumbnailUrl?: string;
+  displayUrl?: string;
   created_at: string;
 }
 
@@ -65,6 +67,31 @@ const SnipsViewer: React.FC<SnipsViewerProps> = ({ selectedFolder }) => {
     }
   };
 
+  const handleClearSnips = async () => {
+    if (snips.length === 0) return;
+    if (window.confirm(`Are you sure you want to delete all ${snips.length} snips in "${selectedFolder}"?`)) {
+      try {
+        // One request and one metadata transaction for the whole folder
+        const response = await fetch("http://127.0.0.1:5000/snips/batch", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ operations: snips.map((snip) => ({ op: "delete", id: snip.id })) }),
+        });
+
+        if (response.ok) {
+          const result = await response.json();
+          if (result.failed > 0) {
+            console.error("Some snips could not be deleted:", result.results.filter((item: { status: number }) => item.status !== 200));
+          }
+          setSelectedSnip(null);
+          await loadSnips();
+        }
+      } catch (error) {
+        console.error("Error deleting snips:", error);
+      }
+    }
+  };
+
   const handleSnipClick = (snip: SnipData) => {
     setSelectedSnip(snip);
   };
@@ -91,10 +118,22 @@ const SnipsViewer: React.FC<SnipsViewerProps> = ({ selectedFolder }) => {
     <div className="flex h-full">
       {/* Snips List */}
       <div className="w-1/2 p-4 border-r border-gray-200 overflow-y-auto">
-        <h3 className="text-lg font-semibold mb-4 flex items-center">
-          <Image className="w-5 h-5 mr-2" />
-          Saved Snips ({snips.length})
-        </h3>
+        <div className="flex items-center justify-between mb-4">
+          <h3 className="text-lg font-semibold flex items-center">
+            <Image className="w-5 h-5 mr-2" />
+            Saved Snips ({snips.length})
+          </h3>
+          {snips.length > 0 && (
+            <button
+              onClick={handleClearSnips}
+              className="flex items-center text-sm text-gray-500 hover:text-red-600 transition-colors"
+              title="Delete all snips in this folder"
+            >
+              <Trash2 className="w-4 h-4 mr-1" />
+              Clear all
+            </button>
+          )}
+        </div>
 
         {loading ? (
           <div className="text-center py-8">
@@ -165,7 +204,7 @@ const SnipsViewer: React.FC<SnipsViewerProps> = ({ selectedFolder }) => {
               {/* Snip Image */}
               <div className="border border-gray-200 rounded-lg overflow-hidden">
                 <img
-                  src={selectedSnip.url}
+                  src={selectedSnip.displayUrl ?? selectedSnip.url}
                   alt={selectedSnip.title}
                   className="w-full h-auto"
                 />